@@ -0,0 +1,102 @@
+import builtins
+import os
+import shutil
+import sys
+import threading
+
+# 统计调用次数的文件系统函数 (Python 层的调用；C 代码内部的系统调用，如 DirEntry.stat 的缓存结果，不计入)
+COUNTED_OS_FUNCTIONS = (
+    'stat', 'lstat', 'scandir', 'listdir', 'open', 'read', 'write', 'mkdir', 'makedirs', 'rename', 'replace',
+    'unlink', 'remove', 'rmdir', 'utime', 'chmod', 'link', 'fsync', 'copy_file_range', 'sendfile',
+)
+
+
+class SyscallCounter:
+    """
+    在测量期间替换 os 模块和内置 open 中的函数，统计各函数的调用次数 (线程安全)
+    """
+
+    def __init__(self, names=COUNTED_OS_FUNCTIONS):
+        self.names = [name for name in names if hasattr(os, name)]
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._saved = []
+
+    def _wrap(self, key, func):
+        counts, lock = self.counts, self._lock
+
+        def wrapper(*args, **kwargs):
+            with lock:
+                counts[key] = counts.get(key, 0) + 1
+            return func(*args, **kwargs)
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def __enter__(self):
+        self.counts.clear()
+        for name in self.names:
+            func = getattr(os, name)
+            self._saved.append((os, name, func))
+            setattr(os, name, self._wrap(name, func))
+        self._saved.append((builtins, 'open', builtins.open))
+        builtins.open = self._wrap('open_file', builtins.open)
+        # shutil 在导入时保存了部分函数的引用
+        if hasattr(shutil, '_fastcopy_sendfile'):
+            self._saved.append((shutil, '_fastcopy_sendfile', shutil._fastcopy_sendfile))
+            shutil._fastcopy_sendfile = self._wrap('sendfile', shutil._fastcopy_sendfile)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for owner, name, func in reversed(self._saved):
+            setattr(owner, name, func)
+        self._saved.clear()
+        return False
+
+
+def read_proc_io():
+    """
+    Linux: 进程的 I/O 计数 (/proc/self/io，包括 read/write 类系统调用次数 syscr/syscw)
+    """
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(':') for line in f)}
+    except (OSError, ValueError):
+        return None
+
+
+def diff_io(before, after):
+    if before is None or after is None:
+        return None
+    return {key: after[key] - before.get(key, 0) for key in after}
+
+
+def reset_peak_rss():
+    """
+    Linux: 重置进程的峰值常驻内存 (VmHWM)，返回是否成功
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """
+    峰值常驻内存 (字节): Linux 读取 VmHWM，其他 Unix 使用 getrusage (进程生命周期内的峰值)，不支持时返回 None
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 的单位是字节，Linux 是 KB
+    return peak if sys.platform == 'darwin' else peak * 1024
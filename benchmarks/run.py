@@ -0,0 +1,175 @@
+"""
+备份性能基准: 生成可复现的目录树，分别以增量和同步模式执行 冷启动/无变化/变化后 三次备份，
+记录各阶段耗时、文件系统调用次数、I/O 计数和峰值内存，结果保存为 JSON 以便跨版本比较。
+
+    python -m benchmarks.run                          # 全部目录树，默认规模
+    python -m benchmarks.run --trees tiny,huge --scale 0.2 --output before.json
+    python -m benchmarks.run --compare before.json --output after.json
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.probes import SyscallCounter, read_proc_io, diff_io, reset_peak_rss, peak_rss
+from benchmarks.trees import TREES, build_tree, churn
+from core.backup import BackupManager
+from core.copier import DEFAULT_COPY_WORKERS
+from core.logger import Logger, CATEGORY_FILE
+from core.version import VERSION
+
+MODES = ('incremental', 'sync')
+# 冷启动: 空目标目录；无变化: 立即再次备份；变化后: 源目录经过重命名/删除/修改/新增后备份
+RUNS = ('cold', 'warm', 'churn')
+RESULT_FORMAT = 1
+
+
+def run_backup(manager, src_dir, dst_dir, sync_mode, workers, count_syscalls):
+    """
+    执行一次备份并测量
+    """
+    gc.collect()
+    rss_reset = reset_peak_rss()
+    io_before = read_proc_io()
+    counter = SyscallCounter() if count_syscalls else None
+    done = None
+    start = time.perf_counter()
+    if counter is not None:
+        counter.__enter__()
+    try:
+        for event in manager.backup_generator(src_dir, dst_dir, sync_mode=sync_mode, workers=workers):
+            if event['type'] == 'done':
+                done = event
+    finally:
+        if counter is not None:
+            counter.__exit__(None, None, None)
+    wall = time.perf_counter() - start
+    manager.metrics.finish(done is None or done['stopped'])
+    report = manager.metrics.report()
+    return {
+        'wall': wall,
+        'stopped': done is None or done['stopped'],
+        'summary': done['summary'] if done is not None else None,
+        'phases': report['phases'],
+        'actions': report['actions'],
+        'bytes_transferred': report['bytes_transferred'],
+        'throughput': report['throughput'],
+        'syscalls': dict(sorted(counter.counts.items())) if counter is not None else None,
+        'io': diff_io(io_before, read_proc_io()),
+        # 无法重置峰值时为进程生命周期内的峰值
+        'peak_rss': peak_rss(),
+        'peak_rss_per_run': rss_reset,
+    }
+
+
+def run_case(workdir, tree, mode, seed, scale, workers, count_syscalls):
+    """
+    一个 (目录树, 模式) 组合: 依次执行 cold/warm/churn 三次备份
+    """
+    src_dir = os.path.join(workdir, f"{tree}-{mode}-src")
+    dst_dir = os.path.join(workdir, f"{tree}-{mode}-dst")
+    build_tree(src_dir, tree, seed, scale)
+    manager = BackupManager()
+    sync_mode = mode == 'sync'
+    results = []
+    try:
+        for run in RUNS:
+            changes = churn(src_dir, seed) if run == 'churn' else None
+            result = run_backup(manager, src_dir, dst_dir, sync_mode, workers, count_syscalls)
+            result.update({'tree': tree, 'mode': mode, 'run': run, 'changes': changes})
+            results.append(result)
+            print(f"{tree:6s} {mode:11s} {run:5s} {result['wall']:8.2f}s  "
+                  f"{result['summary']['processed'] if result['summary'] else 0:>7} ops  "
+                  f"{result['bytes_transferred'] / (1024 * 1024):9.1f} MB", flush=True)
+    finally:
+        shutil.rmtree(src_dir, ignore_errors=True)
+        shutil.rmtree(dst_dir, ignore_errors=True)
+    return results
+
+
+def compare(baseline, results):
+    """
+    与之前保存的结果比较耗时，返回文本行
+    """
+    old = {(r['tree'], r['mode'], r['run']): r for r in baseline['results']}
+    lines = [f"对比 {baseline.get('version')} ({baseline.get('timestamp')}):"]
+    for r in results:
+        key = (r['tree'], r['mode'], r['run'])
+        if key not in old or old[key]['wall'] <= 0:
+            continue
+        ratio = r['wall'] / old[key]['wall']
+        lines.append(f"  {' '.join(key):28s} {old[key]['wall']:8.2f}s -> {r['wall']:8.2f}s  ({ratio:5.2f}x)")
+    return lines
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="BakUI 备份性能基准")
+    parser.add_argument('--trees', default=','.join(TREES), help=f"目录树类型，逗号分隔 ({', '.join(TREES)})")
+    parser.add_argument('--modes', default=','.join(MODES), help="备份模式，逗号分隔 (incremental, sync)")
+    parser.add_argument('--scale', type=float, default=1.0, help="目录树规模系数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=DEFAULT_COPY_WORKERS)
+    parser.add_argument('--workdir', default=None, help="生成目录树的位置 (默认系统临时目录)")
+    parser.add_argument('--output', default=None, help="结果 JSON 文件")
+    parser.add_argument('--compare', default=None, help="与之前保存的结果 JSON 比较")
+    parser.add_argument('--no-syscalls', action='store_true', help="不统计文件系统调用 (避免计数本身的开销)")
+    parser.add_argument('--file-log', action='store_true', help="保留逐文件日志 (默认只输出警告和摘要)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    trees = [t for t in args.trees.split(',') if t]
+    modes = [m for m in args.modes.split(',') if m]
+    for name, values, allowed in (('trees', trees, TREES), ('modes', modes, MODES)):
+        unknown = set(values) - set(allowed)
+        if unknown:
+            raise SystemExit(f"未知的 {name}: {', '.join(sorted(unknown))}")
+    if not args.file_log:
+        Logger().set_category(CATEGORY_FILE, level=logging.WARNING)
+
+    workdir = tempfile.mkdtemp(prefix="bakui-bench-", dir=args.workdir)
+    results = []
+    try:
+        for tree in trees:
+            for mode in modes:
+                results.extend(run_case(workdir, tree, mode, args.seed, args.scale, args.workers,
+                                        not args.no_syscalls))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    data = {
+        'format': RESULT_FORMAT,
+        'version': VERSION,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'scale': args.scale,
+        'workers': args.workers,
+        'syscall_counting': not args.no_syscalls,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print("\n".join(compare(baseline, results)))
+    return data
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import os
+import random
+import shutil
+
+# 生成数据用的随机块 (按种子生成一次后重复使用，大文件的生成速度与磁盘速度相当)
+BLOCK_SIZE = 1024 * 1024
+# 固定的修改时间基准，保证相同种子生成的目录树完全一致
+BASE_MTIME = 1600000000
+
+# 目录树类型
+TREE_TINY = 'tiny'
+TREE_HUGE = 'huge'
+TREE_DEEP = 'deep'
+TREE_WIDE = 'wide'
+TREE_MIXED = 'mixed'
+TREES = (TREE_TINY, TREE_HUGE, TREE_DEEP, TREE_WIDE, TREE_MIXED)
+
+
+def _random_bytes(rng, n):
+    return rng.getrandbits(8 * n).to_bytes(n, 'little') if n else b''
+
+
+class TreeBuilder:
+    """
+    按种子生成可复现的目录树: 文件名、目录结构、大小、内容和修改时间只取决于 (种类, 种子, 规模)
+    """
+
+    def __init__(self, root, seed=0, scale=1.0):
+        self.root = root
+        self.seed = seed
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self._block = _random_bytes(self.rng, BLOCK_SIZE)
+        self._index = 0
+
+    def count(self, n):
+        return max(1, int(n * self.scale))
+
+    def write(self, rel_path, size):
+        path = os.path.join(self.root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._index += 1
+        # 每个文件以不同的偏移开始截取随机块，内容各不相同
+        offset = (self._index * 7919) % BLOCK_SIZE
+        with open(path, 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                chunk = self._block[offset:offset + remaining]
+                f.write(chunk)
+                remaining -= len(chunk)
+                offset = 0
+        mtime = BASE_MTIME + self._index
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def tiny(self):
+        # 大量 0~4 KB 的小文件，分布在 2 层目录中
+        for i in range(self.count(20000)):
+            self.write(os.path.join(f"d{i % 50:02d}", f"s{i % 7}", f"f{i:06d}.txt"), self.rng.randint(0, 4096))
+
+    def huge(self):
+        # 少量大文件
+        for i in range(4):
+            self.write(f"big{i}.bin", self.count(64) * BLOCK_SIZE)
+
+    def deep(self):
+        # 多条深层目录链，每层一个文件
+        for branch in range(self.count(20)):
+            parts = []
+            for depth in range(40):
+                parts.append(f"b{branch}l{depth}")
+                self.write(os.path.join(*parts, "file.dat"), self.rng.randint(100, 8192))
+
+    def wide(self):
+        # 单个目录中大量文件
+        for i in range(self.count(10000)):
+            self.write(os.path.join("wide", f"item{i:06d}.dat"), self.rng.randint(0, 2048))
+
+    def mixed(self):
+        # 小文件、中等文件和少量大文件混合
+        for i in range(self.count(5000)):
+            self.write(os.path.join(f"p{i % 40:02d}", f"q{i % 9}", f"m{i:05d}.txt"), self.rng.randint(0, 16384))
+        for i in range(self.count(50)):
+            self.write(os.path.join("media", f"v{i:03d}.bin"), self.rng.randint(1, 4) * BLOCK_SIZE)
+        self.write(os.path.join("media", "archive.bin"), self.count(128) * BLOCK_SIZE)
+
+    def build(self, kind):
+        if kind not in TREES:
+            raise ValueError(f"未知的目录树类型: {kind}")
+        os.makedirs(self.root, exist_ok=True)
+        getattr(self, kind)()
+
+
+def build_tree(root, kind, seed=0, scale=1.0):
+    TreeBuilder(root, seed, scale).build(kind)
+
+
+def list_files(root):
+    """
+    目录树中所有文件的 {相对路径: 大小}，按路径排序
+    """
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            result[os.path.relpath(path, root)] = os.path.getsize(path)
+    return result
+
+
+def churn(root, seed=0, fraction=0.05):
+    """
+    模拟两次备份之间的变化: 按比例重命名/移动、删除、修改和新增文件，并删除一个子目录
+    返回: 各类变化的数量
+    """
+    rng = random.Random(seed + 1)
+    files = sorted(list_files(root))
+    rng.shuffle(files)
+    n = max(1, int(len(files) * fraction))
+    renamed, deleted, modified = files[:n], files[n:2 * n], files[2 * n:3 * n]
+    counts = {'renamed': 0, 'deleted': 0, 'modified': 0, 'added': 0, 'deleted_dirs': 0}
+
+    for rel_path in renamed:
+        src = os.path.join(root, rel_path)
+        dst_dir = os.path.join(root, "moved", os.path.dirname(rel_path))
+        os.makedirs(dst_dir, exist_ok=True)
+        os.rename(src, os.path.join(dst_dir, "r_" + os.path.basename(rel_path)))
+        counts['renamed'] += 1
+    for rel_path in deleted:
+        os.unlink(os.path.join(root, rel_path))
+        counts['deleted'] += 1
+    for i, rel_path in enumerate(modified):
+        path = os.path.join(root, rel_path)
+        with open(path, 'ab') as f:
+            f.write(_random_bytes(rng, rng.randint(1, 512)))
+        mtime = BASE_MTIME + 10 ** 7 + i
+        os.utime(path, (mtime, mtime))
+        counts['modified'] += 1
+    builder = TreeBuilder(root, seed + 2)
+    for i in range(n):
+        builder.write(os.path.join("added", f"n{i % 10}", f"new{i:05d}.dat"), rng.randint(0, 8192))
+        counts['added'] += 1
+
+    # 删除一个子目录: 在文件数不超过总数 10% 的子目录中选文件最多的一个
+    sizes = {}
+    remaining = list_files(root)
+    for rel_path in remaining:
+        parts = rel_path.split(os.sep)[:-1]
+        if parts and parts[0] in ("moved", "added"):
+            continue
+        for depth in range(1, len(parts) + 1):
+            rel_dir = os.path.join(*parts[:depth])
+            sizes[rel_dir] = sizes.get(rel_dir, 0) + 1
+    candidates = sorted(d for d, count in sizes.items() if count <= len(remaining) * 0.1)
+    if candidates:
+        victim = max(candidates, key=sizes.get)
+        shutil.rmtree(os.path.join(root, victim))
+        counts['deleted_dirs'] += 1
+    return counts
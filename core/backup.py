@@ -1,85 +1,137 @@
+import errno
 import os
-import shutil
+import queue
+import sqlite3
+import threading
 import time
 import stat
-from core.logger import Logger
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from core.logger import Logger, CATEGORY_FILE
+from core.copier import ParallelCopier, DEFAULT_COPY_WORKERS
+from core.fastcopy import FastCopier, METHOD_REFLINK
+from core.scanner import FileEntry, iter_tree, DirectoryLookup
+from core.tree import FileTree
+from core.deletion import DeletionPlan, remove_tree, remove_files, DELETE_WORKERS
+from core.dircache import DirCache, DIR_FULL_SCAN_INTERVAL
+from core.compress import (CompressIndex, ParallelCompressor, is_compressible, stored_name, COMPRESS_GZIP,
+                           COMPRESS_SUFFIXES, METHOD_RAW)
+from core.dedup import DedupStore
+from core.fanout import FanoutCopier
+from core.pack import PackStore, PACK_THRESHOLD
+from core.snapshot import SnapshotStore, expired_snapshots, KEEP_LAST, KEEP_DAILY, KEEP_WEEKLY
+from core.watcher import InotifyWatcher, PollingWatcher, DirtySet, WATCH_DEBOUNCE, POLL_INTERVAL
+from core.diff import (merge_walk, DIFF_ENGINE_TREE, DIFF_ENGINE_MERGE, DIFF_DIR, DIFF_FILE, DIFF_DELETE,
+                       DIFF_DELETE_DIR)
+from core.manifest import Manifest, META_DIR
+from core.profiler import Profiler, PROFILE_ENV, PROFILE_SAMPLER_ENV, PROFILE_FILES_ENV
+from core.metrics import RunMetrics, PHASE_SCAN_SOURCE, PHASE_SCAN_DESTINATION, PHASE_DIFF
+from core.moves import MoveDetector, MOVE_DETECTION_OFF, MOVE_DETECTION_METADATA
+from core.delta import DeltaCopier, DELTA_THRESHOLD
+from core.resumable import ResumableCopier, RESUME_THRESHOLD
+from core.hashing import HashCache, HashJob, ParallelHasher, COMPARE_METADATA, COMPARE_CONTENT
+from core.plan import (BackupPlan, PLAN_COPY, PLAN_UPDATE, PLAN_MOVE, PLAN_CREATE_DIR, PLAN_DELETE,
+                       PLAN_DELETE_DIR)
+
+# 扫描队列容量 (批次数) 与每批文件数，决定流水线的内存上限
+SCAN_QUEUE_SIZE = 64
+SCAN_BATCH_SIZE = 256
+# 超过该大小的文件总是回调进度
+PROGRESS_SIZE_THRESHOLD = 10 * 1024 * 1024
+# 任务结束时写入运行指标的路径 (Prometheus 文本文件，供 node exporter 的 textfile collector 读取；JSON 报告)
+METRICS_TEXTFILE_ENV = 'BAKUI_METRICS_TEXTFILE'
+METRICS_REPORT_ENV = 'BAKUI_METRICS_REPORT'
+# 按字节计算进度时每个操作额外计入的字节数 (删除、创建目录等操作也占用进度)
+PROGRESS_FILE_WEIGHT = 64 * 1024
+# 文件级事件 (start_backup 中会限制回调频率)
+FILE_ACTIONS = ('copied', 'skipped', 'updated', 'synced', 'stored', 'deduped', 'restored', 'packed', 'compressed')
+
+
+class BackupStats:
+    """
+    单次备份的计数
+    total 在扫描过程中随发现的文件增长，扫描结束后才是最终值
+    """
+    __slots__ = ('processed', 'processed_bytes', 'total', 'total_bytes', 'copied', 'moved', 'failed', 'bytes_copied', 'created_dirs',
+                 'deleted_files', 'deleted_dirs', 'failed_deletes', 'failed_dir_deletes', 'content_mismatches',
+                 'hashed_files', 'hashed_bytes', 'hash_rate', 'linked', 'pruned_snapshots', 'deduped', 'deferred',
+                 'scan_done')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+        self.scan_done = False
+
+    def percent(self):
+        """
+        按字节加权的进度，一个大文件与大量小文件混合时不会按文件数失真
+        """
+        if not self.scan_done or self.total == 0:
+            return 0
+        done = self.processed_bytes + self.processed * PROGRESS_FILE_WEIGHT
+        total = self.total_bytes + self.total * PROGRESS_FILE_WEIGHT
+        return min(100, done / total * 100)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class FanoutTarget:
+    """
+    多目标备份中单个目标的比对状态和计数
+    清单可信时逐个查询清单，否则按目录懒加载扫描目标目录
+    """
+    __slots__ = ('dst_dir', 'manifest', 'lookup', 'has_dir', 'directory_lookup', 'known_dirs', 'stats')
+
+    def __init__(self, dst_dir, manifest, on_error):
+        self.dst_dir = dst_dir
+        self.manifest = manifest
+        self.directory_lookup = None
+        if manifest is not None and manifest.stale_reason() is None:
+            manifest.begin_run()
+            self.lookup, self.has_dir = manifest.lookup, manifest.has_dir
+        else:
+            self.directory_lookup = DirectoryLookup(dst_dir, on_error=on_error)
+            self.lookup, self.has_dir = self.directory_lookup.get, self.directory_lookup.dir_exists
+        self.known_dirs = set()
+        self.stats = BackupStats()
+
+    def ensure_dir(self, rel_dir):
+        if rel_dir in self.known_dirs:
+            return
+        if not rel_dir:
+            os.makedirs(self.dst_dir, exist_ok=True)
+        elif not self.has_dir(rel_dir):
+            os.makedirs(os.path.join(self.dst_dir, rel_dir), exist_ok=True)
+            if self.manifest is not None:
+                self.manifest.record_dir(rel_dir)
+            if self.directory_lookup is not None:
+                self.directory_lookup.mark_created(rel_dir)
+        self.known_dirs.add(rel_dir)
+
 
 class BackupManager:
     def __init__(self):
         self.stop_flag = False
         self.logger = Logger()
+        # 复制方式按文件系统探测并缓存，跨多次备份复用
+        self.fast_copier = FastCopier()
+        # 当前 (或上一次) 任务的运行指标，可在其他线程中读取
+        self.metrics = RunMetrics()
+        self.metrics_textfile = os.environ.get(METRICS_TEXTFILE_ENV)
+        self.metrics_report = os.environ.get(METRICS_REPORT_ENV)
+        # 性能分析: 设置输出目录后，每次任务记录阶段和逐文件操作的 span，可选 cProfile / 调用栈采样
+        self.profile_dir = os.environ.get(PROFILE_ENV)
+        self.profile_sampler = os.environ.get(PROFILE_SAMPLER_ENV) or None
+        self.profile_file_spans = os.environ.get(PROFILE_FILES_ENV, '1') != '0'
+        # 当前任务的分析器 (未启用时为 None)
+        self.profiler = None
 
     def stop(self):
         self.stop_flag = True
 
-    def _remove_file_safe(self, file_path, max_retries=3):
-        """
-        安全删除文件，处理 Windows 权限问题
-        返回: (success, error_message)
-        """
-        import time as time_module
-        
-        for attempt in range(max_retries):
-            try:
-                # 尝试移除只读属性
-                if os.path.exists(file_path):
-                    try:
-                        os.chmod(file_path, stat.S_IWRITE)
-                    except:
-                        pass  # 如果无法修改属性，继续尝试删除
-                    
-                    # 尝试删除
-                    os.remove(file_path)
-                    return True, None
-            except PermissionError as e:
-                if attempt < max_retries - 1:
-                    # 等待一小段时间后重试（文件可能正在被释放）
-                    time_module.sleep(0.5)
-                    continue
-                else:
-                    return False, f"权限拒绝 (可能被其他程序占用): {str(e)}"
-            except Exception as e:
-                return False, str(e)
-        
-        return False, "删除失败，已达到最大重试次数"
-
-    def _remove_dir_safe(self, dir_path, max_retries=3):
-        """
-        安全删除目录，处理 Windows 权限问题
-        返回: (success, error_message)
-        """
-        import time as time_module
-        
-        for attempt in range(max_retries):
-            try:
-                if os.path.exists(dir_path) and os.path.isdir(dir_path):
-                    # 尝试移除只读属性（递归）
-                    def make_writable(path):
-                        try:
-                            os.chmod(path, stat.S_IWRITE)
-                        except:
-                            pass
-                    
-                    # 先尝试使所有文件可写
-                    for root, dirs, files in os.walk(dir_path):
-                        for d in dirs:
-                            make_writable(os.path.join(root, d))
-                        for f in files:
-                            make_writable(os.path.join(root, f))
-                    
-                    # 删除目录
-                    shutil.rmtree(dir_path)
-                    return True, None
-            except PermissionError as e:
-                if attempt < max_retries - 1:
-                    time_module.sleep(0.5)
-                    continue
-                else:
-                    return False, f"权限拒绝 (可能被其他程序占用): {str(e)}"
-            except Exception as e:
-                return False, str(e)
-        
-        return False, "删除失败，已达到最大重试次数"
+    def _begin_run(self):
+        self.stop_flag = False
+        self.metrics = RunMetrics(tracer=self.profiler)
 
     def _is_modified(self, src_path, dst_path):
         """
@@ -103,345 +155,2084 @@ class BackupManager:
         except OSError:
             return True
 
-    def start_backup(self, src_dir, dst_dir, progress_callback=None, sync_mode=False):
+    def _needs_copy(self, src_entry, dst_entry):
+        """
+        判断文件是否需要复制 (基于扫描阶段已获取的 stat 结果，不再访问磁盘)
+        """
+        if dst_entry is None:
+            return True
+
+        if src_entry.size != dst_entry.size:
+            return True
+
+        # 允许 2 秒的时间误差
+        if src_entry.mtime > dst_entry.mtime + 2:
+            return True
+
+        return False
+
+    def _copy_file(self, src_path, dst_path):
+        """
+        复制单个文件 (在复制线程中执行)
+        优先使用 reflink / copy_file_range / sendfile，不支持时自动回退
+        返回 None 表示写入了完整文件
+        """
+        self.fast_copier.copy2(src_path, dst_path)
+
+    def _delta_copy(self, delta, src_path, dst_path, rel_path):
+        """
+        块级差异更新已存在的大文件 (在复制线程中执行)
+        返回: 实际写入的字节数
+        """
+        try:
+            return delta.copy(src_path, dst_path, rel_path, stop_check=lambda: self.stop_flag)
+        except FileNotFoundError:
+            if not os.path.exists(src_path):
+                raise
+            # 清单中记录的目标文件已不存在，回退到完整复制
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            return self._copy_file(src_path, dst_path)
+
+    def _resumable_copy(self, resumable, src_path, dst_path, rel_path):
+        """
+        可续传的分块复制大文件 (在复制线程中执行)
+        返回: 实际写入的字节数，使用 reflink 克隆时返回 None
+        """
+        src_dev = os.stat(src_path).st_dev
+        dst_dev = os.stat(os.path.dirname(dst_path)).st_dev
+        if self.fast_copier.method_for(src_dev, dst_dev) == METHOD_REFLINK:
+            # 同一文件系统支持 reflink 时克隆几乎瞬间完成，无需分块续传
+            return self._copy_file(src_path, dst_path)
+        return resumable.copy(src_path, dst_path, rel_path, stop_check=lambda: self.stop_flag)
+
+    def _large_file_copiers(self, dst_dir, delta_threshold, resume_threshold):
+        """
+        返回: (DeltaCopier, ResumableCopier)，对应阈值为 None 时为 None
+        """
+        # 已存在的大文件使用块级差异更新
+        delta = DeltaCopier(dst_dir) if delta_threshold else None
+        # 大文件分块复制，可在块之间停止并在下次续传
+        resumable = None
+        if resume_threshold:
+            resumable = ResumableCopier(dst_dir)
+            resumable.cleanup()
+        return delta, resumable
+
+    def _submit_copy(self, copier, entry, src_dir, dst_dir, update, delta, delta_threshold,
+                     resumable, resume_threshold):
+        """
+        按文件大小选择复制方式并提交到复制线程 (目标父目录需已存在)
+        update: 目标文件已存在
+        """
+        src_path = os.path.join(src_dir, entry.rel_path)
+        dst_path = os.path.join(dst_dir, entry.rel_path)
+        if delta is not None and update and entry.size >= delta_threshold:
+            copier.submit(self._delta_copy, delta, src_path, dst_path, entry.rel_path,
+                          size=entry.size, tag=entry)
+        elif resumable is not None and entry.size >= resume_threshold:
+            copier.submit(self._resumable_copy, resumable, src_path, dst_path, entry.rel_path,
+                          size=entry.size, tag=entry)
+        else:
+            copier.submit(self._copy_file, src_path, dst_path, size=entry.size, tag=entry)
+
+    def _scan_error(self, path, e):
+        self.logger.warning(f"无法访问文件 {path}: {e}")
+
+    def _open_manifest(self, dst_dir):
+        manifest = Manifest(dst_dir)
+        if not manifest.open():
+            self.logger.warning(f"无法打开目标清单，回退到目录扫描: {manifest.path}")
+            return None
+        return manifest
+
+    def _scan_destination(self, dst_dir, manifest):
+        """
+        全量扫描目标目录，并用结果重建清单
+        返回: FileTree
+        """
+        dst_tree = FileTree()
+        if os.path.exists(dst_dir):
+            try:
+                with self.metrics.phase(PHASE_SCAN_DESTINATION):
+                    dst_tree = FileTree.scan(dst_dir, lambda: self.stop_flag, self._scan_error, exclude=(META_DIR,))
+            except Exception as e:
+                self.logger.warning(f"扫描目标目录出错: {str(e)}")
+
+        # 扫描被中止时结果不完整，不能用于重建清单
+        if manifest is not None and not self.stop_flag:
+            manifest.rebuild(dst_tree.iter_files(), dst_tree.iter_dirs())
+            manifest.begin_run()
+        return dst_tree
+
+    def _scan_producer(self, src_dir, out, stop_event, walk=iter_tree):
+        """
+        扫描线程: 逐目录扫描源目录，按批次放入有界队列
+        walk: 目录遍历函数 (iter_tree 或 DirCache.walk)
+        队列元素: ('dir', rel_dir) / ('files', [FileEntry]) / ('unreadable', rel_path) /
+                  ('done', None) / ('failed', exception)
+        """
+        def stopped():
+            return stop_event.is_set() or self.stop_flag
+
+        def put(item):
+            return self._queue_put(out, item, stopped)
+
+        def on_error(path, e):
+            self._scan_error(path, e)
+            put(('unreadable', os.path.relpath(path, src_dir)))
+
+        try:
+            for rel_dir, files, subdirs in walk(src_dir, stopped, on_error, exclude=(META_DIR,)):
+                if rel_dir and not put(('dir', rel_dir)):
+                    return
+                batch = []
+                for entry in files.values():
+                    batch.append(entry)
+                    if len(batch) >= SCAN_BATCH_SIZE:
+                        if not put(('files', batch)):
+                            return
+                        batch = []
+                if batch and not put(('files', batch)):
+                    return
+            put(('done', None))
+        except Exception as e:
+            put(('failed', e))
+
+    def _merge_producer(self, src_dir, dst_dir, out, stop_event):
+        """
+        归并比对线程 (同步模式): 逐目录同时读取源目录和目标目录，按批次放入有界队列
+        队列元素: ('dir', rel_dir) / ('pairs', [(FileEntry, 目标 FileEntry 或 None)]) /
+                  ('delete', 目标 FileEntry) / ('delete_dir', rel_dir) / ('done', None) / ('failed', exception)
+        """
+        def stopped():
+            return stop_event.is_set() or self.stop_flag
+
+        def put(item):
+            return self._queue_put(out, item, stopped)
+
+        try:
+            batch = []
+            for kind, rel_path, src_entry, dst_entry in merge_walk(src_dir, dst_dir, stopped, self._scan_error,
+                                                                   exclude=(META_DIR,)):
+                if kind == DIFF_FILE:
+                    batch.append((src_entry, dst_entry))
+                    if len(batch) < SCAN_BATCH_SIZE:
+                        continue
+                    item = None
+                elif kind == DIFF_DIR:
+                    item = ('dir', rel_path)
+                elif kind == DIFF_DELETE:
+                    item = ('delete', dst_entry)
+                elif kind == DIFF_DELETE_DIR:
+                    item = ('delete_dir', rel_path)
+                # 保持产出顺序: 先放入已积累的文件批次
+                if batch and not put(('pairs', batch)):
+                    return
+                batch = []
+                if item is not None and not put(item):
+                    return
+            if batch and not put(('pairs', batch)):
+                return
+            put(('done', None))
+        except Exception as e:
+            put(('failed', e))
+
+    def _queue_put(self, out, item, stopped):
+        """
+        放入有界队列，队列满时等待；停止时返回 False
+        """
+        while not stopped():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _progress_event(self, stats, action, rel_path, size=0):
+        stats.processed += 1
+        stats.processed_bytes += size
+        self.metrics.file_done(stats, action, size)
+        self.logger.record(action, rel_path, size)
+        return {'type': 'progress', 'action': action, 'rel_path': rel_path, 'size': size,
+                'processed': stats.processed, 'total': stats.total, 'percent': stats.percent()}
+
+    def _error_event(self, stats, action, rel_path, message):
+        stats.processed += 1
+        stats.failed += 1
+        self.metrics.file_failed(stats, action)
+        self.logger.error(message, category=CATEGORY_FILE)
+        self.logger.record(action, rel_path, error=message)
+        return {'type': 'error', 'action': action, 'rel_path': rel_path, 'message': message}
+
+    def _copy_events(self, results, stats, manifest, copied_action, src_dir, hashes=None):
+        """
+        把复制线程的结果转换为事件 (在调用线程中执行，清单也只在这里更新)
+        hashes: 内容比对模式下已知的源文件哈希 {rel_path: hash}，复制成功后记入清单
+        """
+        for result in results:
+            entry = result.tag
+            file_hash = hashes.pop(entry.rel_path, None) if hashes else None
+            if result.stopped:
+                continue
+            if result.error is not None:
+                yield self._error_event(stats, 'copy_failed', entry.rel_path,
+                                        f"复制失败 {os.path.join(src_dir, entry.rel_path)}: {result.error}")
+                continue
+            stats.copied += 1
+            written = entry.size if result.value is None else result.value
+            stats.bytes_copied += written
+            if manifest is not None:
+                manifest.record_file(entry, file_hash)
+            event = self._progress_event(stats, copied_action, entry.rel_path, entry.size)
+            if result.value is not None:
+                # 块级差异更新，只写入了变化部分
+                event['written'] = written
+            if file_hash is not None:
+                event['content_mismatch'] = True
+            yield event
+
+    def start_backup(self, src_dir, dst_dir, progress_callback=None, sync_mode=False,
+                     workers=DEFAULT_COPY_WORKERS, use_manifest=True, verify_destination=False,
+                     move_detection=MOVE_DETECTION_METADATA, delta_threshold=DELTA_THRESHOLD,
+                     resume_threshold=RESUME_THRESHOLD, compare_mode=COMPARE_METADATA,
+                     diff_engine=DIFF_ENGINE_TREE, dir_pruning=False, full_scan_interval=DIR_FULL_SCAN_INTERVAL):
         """
         执行备份
         progress_callback: function(current, total, message)
         sync_mode: True=同步备份(完全一致), False=增量备份(仅复制变更)
+        workers: 并行复制线程数
+        use_manifest: 使用目标目录中的清单代替扫描目标设备
+        verify_destination: 忽略清单，全量扫描目标目录并重建清单
+        move_detection: 同步模式的移动检测 off/metadata/hash
+        delta_threshold: 大于该大小的已存在文件使用块级差异更新 (None 表示禁用)
+        resume_threshold: 大于该大小的文件使用可续传的分块复制 (None 表示禁用)
+        compare_mode: metadata=比较大小和修改时间, content=另外比较内容哈希 (目标哈希取自清单),
+                      verify=另外比较内容哈希并重新读取目标文件 (发现备份介质上的损坏)
+        diff_engine: 同步模式的比对方式 tree=先建立目标目录索引 (支持移动检测),
+                     merge=逐目录归并源目录和目标目录，内存与文件总数无关 (不做移动检测)
+        dir_pruning: 增量模式跳过上次以来条目未变化的源目录 (不发现原地修改的文件，直到下次全量扫描)
+        full_scan_interval: dir_pruning 时强制全量扫描源目录的间隔 (秒)
         """
-        if sync_mode:
-            self._start_sync_backup(src_dir, dst_dir, progress_callback)
-        else:
-            self._start_incremental_backup(src_dir, dst_dir, progress_callback)
+        events = self.backup_generator(src_dir, dst_dir, sync_mode=sync_mode, workers=workers,
+                                       use_manifest=use_manifest,
+                                       verify_destination=verify_destination,
+                                       move_detection=move_detection,
+                                       delta_threshold=delta_threshold,
+                                       resume_threshold=resume_threshold,
+                                       compare_mode=compare_mode,
+                                       diff_engine=diff_engine,
+                                       dir_pruning=dir_pruning,
+                                       full_scan_interval=full_scan_interval)
+        self._dispatch_events(events, progress_callback)
 
-    def _start_incremental_backup(self, src_dir, dst_dir, progress_callback=None):
+    def _dispatch_events(self, events, progress_callback):
         """
-        增量备份：仅复制变更的文件
+        消费事件流并转换为 progress_callback(current, total, message) 回调
+        整个过程记为一次任务 (日志中的 run_id)，结束时写入一条带用时和计数的摘要记录
         """
-        self.stop_flag = False
-        
+        self.logger.begin_run()
+        self._start_profiler()
+        start_time = time.time()
+        try:
+            self._dispatch(events, progress_callback, start_time)
+        finally:
+            self._finish_profiler()
+            self.logger.end_run()
+        self._export_metrics()
+
+    def _start_profiler(self):
+        self.profiler = None
+        if not self.profile_dir:
+            return
+        try:
+            self.profiler = Profiler(file_spans=self.profile_file_spans, sampler=self.profile_sampler)
+        except ValueError as e:
+            self.logger.warning(f"性能分析未启用: {e}")
+            return
+        self.profiler.start()
+
+    def _finish_profiler(self):
+        if self.profiler is None:
+            return
+        self.profiler.stop()
+        try:
+            paths = self.profiler.write(self.profile_dir, self.logger.run_id)
+        except OSError as e:
+            self.logger.warning(f"写入性能分析结果失败 {self.profile_dir}: {e}")
+            return
+        self.logger.info(f"性能分析结果已保存: {', '.join(paths)}")
+
+    def _export_metrics(self):
+        for path, write in ((self.metrics_textfile, self.metrics.write_prometheus),
+                            (self.metrics_report, self.metrics.write_json)):
+            if not path:
+                continue
+            try:
+                write(path)
+            except OSError as e:
+                self.logger.warning(f"写入运行指标失败 {path}: {e}")
+
+    def _dispatch(self, events, progress_callback, start_time):
+        for event in events:
+            if event['type'] == 'done':
+                self.metrics.finish(event['stopped'])
+                self.logger.summary(event['message'], event['summary'], time.time() - start_time, event['stopped'])
+            if not progress_callback:
+                continue
+
+            etype = event['type']
+            if etype == 'status':
+                progress_callback(0, 0, event['message'])
+            elif etype == 'progress':
+                processed, total = event['processed'], event['total']
+                # 限制回调频率
+                if (event['action'] not in FILE_ACTIONS or total <= 10 or processed % 5 == 0
+                        or event['size'] > PROGRESS_SIZE_THRESHOLD or event['percent'] >= 100):
+                    msg = f"[{processed}/{total}] {event['action']}: {event['rel_path']}"
+                    if 'target' in event:
+                        msg += f" -> {event['target']}"
+                    progress_callback(event['percent'], total, msg)
+            elif etype == 'error' and event['action'] in ('scan_failed', 'target_failed'):
+                progress_callback(0, 0, event['message'])
+            elif etype == 'done':
+                summary = event['summary']
+                if event['stopped']:
+                    progress_callback(summary['processed'], summary['total'], event['message'])
+                else:
+                    progress_callback(100, summary['total'], event['message'])
+
+    def backup_generator(self, src_dir, dst_dir, sync_mode=False, workers=DEFAULT_COPY_WORKERS,
+                         use_manifest=True, verify_destination=False,
+                         move_detection=MOVE_DETECTION_METADATA, delta_threshold=DELTA_THRESHOLD,
+                         resume_threshold=RESUME_THRESHOLD, compare_mode=COMPARE_METADATA,
+                         diff_engine=DIFF_ENGINE_TREE, dir_pruning=False,
+                         full_scan_interval=DIR_FULL_SCAN_INTERVAL):
+        """
+        流式备份: 扫描线程通过有界队列把源文件交给复制阶段，扫描开始后即开始复制
+        产出事件:
+          {'type': 'status', 'message'}
+          {'type': 'progress', 'action', 'rel_path', 'size', 'processed', 'total', 'percent'}
+          {'type': 'error', 'action', 'rel_path', 'message'}
+          {'type': 'done', 'stopped', 'message', 'summary'}
+        action: copied/skipped (增量), updated/synced (同步), moved, created_dir, deleted, deleted_dir
+        moved 事件额外带有 'from' (目标目录中的原相对路径)；
+        块级差异更新和分块续传的 copied/updated 事件额外带有 'written' (实际写入字节数)；
+        内容比对发现不一致而重新复制的 copied/updated 事件额外带有 'content_mismatch': True
+        """
+        self._begin_run()
+        yield from self._backup_events(src_dir, dst_dir, sync_mode, workers, use_manifest, verify_destination,
+                                       move_detection, delta_threshold, resume_threshold, compare_mode,
+                                       diff_engine, dir_pruning, full_scan_interval)
+
+    def _backup_events(self, src_dir, dst_dir, sync_mode, workers, use_manifest, verify_destination,
+                       move_detection, delta_threshold, resume_threshold, compare_mode, diff_engine,
+                       dir_pruning=False, full_scan_interval=DIR_FULL_SCAN_INTERVAL):
+        # backup_generator 的主体 (不重置停止标志，实时备份的重新扫描也使用)
         if not os.path.exists(src_dir):
-            self.logger.error(f"源目录不存在: {src_dir}")
-            if progress_callback:
-                progress_callback(0, 0, f"源目录不存在: {src_dir}")
+            msg = f"源目录不存在: {src_dir}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
             return
 
-        self.logger.info(f"开始增量备份扫描: {src_dir}")
-        if progress_callback:
-            progress_callback(0, 0, "正在扫描文件...")
-        
-        files_to_process = []
-        total_bytes = 0
-        
-        # 1. 扫描阶段
+        mode_name = "同步备份" if sync_mode else "增量备份"
+        self.logger.info(f"开始{mode_name}扫描: {src_dir}")
+
+        manifest = self._open_manifest(dst_dir) if use_manifest else None
+        dir_cache = None
+        if dir_pruning and not sync_mode:
+            dir_cache = self._open_dir_cache(src_dir, dst_dir, manifest, verify_destination, compare_mode,
+                                             full_scan_interval)
         try:
-            for root, dirs, files in os.walk(src_dir):
-                if self.stop_flag:
-                    break
-                for file in files:
-                    src_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(src_path, src_dir)
+            for event in self._run_pipeline(src_dir, dst_dir, sync_mode, workers,
+                                            manifest, verify_destination, move_detection,
+                                            delta_threshold, resume_threshold, compare_mode, diff_engine,
+                                            dir_cache):
+                if dir_cache is not None:
+                    self._update_dir_cache(dir_cache, event)
+                yield event
+        except GeneratorExit:
+            # 调用方提前放弃迭代，停止扫描和尚未开始的复制任务
+            self.stop_flag = True
+            raise
+        finally:
+            if dir_cache is not None:
+                dir_cache.close()
+            if manifest is not None:
+                manifest.close()
+
+    def start_watch(self, src_dir, dst_dir, progress_callback=None, sync_mode=False,
+                    workers=DEFAULT_COPY_WORKERS, use_manifest=True, debounce=WATCH_DEBOUNCE,
+                    poll_interval=POLL_INTERVAL, use_inotify=True, delta_threshold=DELTA_THRESHOLD,
+                    resume_threshold=RESUME_THRESHOLD):
+        """
+        实时备份，直到调用 stop() (参数同 watch_generator)
+        progress_callback: function(current, total, message)
+        """
+        events = self.watch_generator(src_dir, dst_dir, sync_mode=sync_mode, workers=workers,
+                                      use_manifest=use_manifest, debounce=debounce,
+                                      poll_interval=poll_interval, use_inotify=use_inotify,
+                                      delta_threshold=delta_threshold, resume_threshold=resume_threshold)
+        self._dispatch_events(events, progress_callback)
+
+    def watch_generator(self, src_dir, dst_dir, sync_mode=False, workers=DEFAULT_COPY_WORKERS,
+                        use_manifest=True, debounce=WATCH_DEBOUNCE, poll_interval=POLL_INTERVAL,
+                        use_inotify=True, delta_threshold=DELTA_THRESHOLD, resume_threshold=RESUME_THRESHOLD):
+        """
+        实时备份: 先做一次完整备份，之后只备份发生变化的路径，直到调用 stop()
+        Linux 上使用 inotify 监视源目录 (use_inotify=False 或不可用时改为每 poll_interval 秒轮询)，
+        变化平静 debounce 秒后批量处理；事件溢出时重新完整备份一次。
+        产出事件同 backup_generator，完整备份的 'done' 转换为 'status'，停止后产出一个 'done'。
+        """
+        self._begin_run()
+
+        if not os.path.exists(src_dir):
+            msg = f"源目录不存在: {src_dir}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
+            return
+
+        # 先注册监视再做完整备份，备份期间发生的变化之后会补上
+        watcher = self._create_watcher(src_dir, poll_interval, use_inotify)
+        stats = BackupStats()
+        stats.scan_done = True
+        try:
+            yield from self._watch_rescan(src_dir, dst_dir, sync_mode, workers, use_manifest,
+                                          delta_threshold, resume_threshold)
+            dirty = DirtySet(debounce)
+            while not self.stop_flag:
+                try:
+                    paths, overflow = watcher.changes(0.1)
+                    if overflow:
+                        self.logger.warning("文件变化事件溢出，重新完整备份")
+                except OSError as e:
+                    # 例如新目录超过系统监视数量上限；切换期间的变化由重新备份补上
+                    self.logger.warning(f"文件监视出错，改为轮询并重新完整备份: {e}")
+                    watcher.close()
+                    watcher = PollingWatcher(src_dir, (META_DIR,), poll_interval)
+                    paths, overflow = set(), True
+                if overflow:
+                    dirty.clear()
+                    yield from self._watch_rescan(src_dir, dst_dir, sync_mode, workers, use_manifest,
+                                                  delta_threshold, resume_threshold)
+                    continue
+                dirty.add(paths)
+                if dirty.ready():
+                    batch = dirty.take()
+                    yield {'type': 'status', 'message': f"检测到 {len(batch)} 处变化，正在备份..."}
+                    yield from self._watch_batch(src_dir, dst_dir, batch, sync_mode, workers, use_manifest,
+                                                 stats, delta_threshold, resume_threshold)
+        except GeneratorExit:
+            self.stop_flag = True
+            raise
+        finally:
+            watcher.close()
+
+        self.logger.info(f"实时备份已停止: 复制 {stats.copied}, 删除文件 {stats.deleted_files}, "
+                         f"删除目录 {stats.deleted_dirs}")
+        yield {'type': 'done', 'stopped': True, 'message': "实时备份已停止", 'summary': stats.to_dict()}
+
+    def _create_watcher(self, src_dir, poll_interval, use_inotify):
+        if use_inotify:
+            try:
+                watcher = InotifyWatcher(src_dir, exclude=(META_DIR,))
+                self.logger.info(f"使用 inotify 监视 {watcher.watch_count} 个目录: {src_dir}")
+                return watcher
+            except OSError as e:
+                self.logger.warning(f"inotify 不可用 ({e})，改为轮询")
+        self.logger.info(f"每 {poll_interval} 秒轮询源目录: {src_dir}")
+        return PollingWatcher(src_dir, (META_DIR,), poll_interval)
+
+    def _watch_rescan(self, src_dir, dst_dir, sync_mode, workers, use_manifest, delta_threshold,
+                      resume_threshold):
+        # 完整备份一次；其结束不代表实时备份结束，'done' 转换为状态消息
+        events = self._backup_events(src_dir, dst_dir, sync_mode, workers, use_manifest, False,
+                                     MOVE_DETECTION_METADATA, delta_threshold, resume_threshold,
+                                     COMPARE_METADATA, DIFF_ENGINE_TREE)
+        for event in events:
+            if event['type'] != 'done':
+                yield event
+            elif not self.stop_flag:
+                yield {'type': 'status', 'message': f"{event['message']}，正在监视变化..."}
+
+    def _watch_batch(self, src_dir, dst_dir, rel_paths, sync_mode, workers, use_manifest, stats,
+                     delta_threshold, resume_threshold):
+        """
+        备份一批变化的路径: 源文件用 _is_modified 判断后复制，同步模式删除源中已不存在的路径
+        """
+        copied_action, skipped_action = ("updated", "synced") if sync_mode else ("copied", "skipped")
+        manifest = self._open_manifest(dst_dir) if use_manifest else None
+        delta, resumable = self._large_file_copiers(dst_dir, delta_threshold, resume_threshold)
+        try:
+            with ParallelCopier(workers=workers, stop_check=lambda: self.stop_flag, tracer=self.profiler) as copier:
+                for rel_path in rel_paths:
+                    if self.stop_flag:
+                        break
+                    yield from self._copy_events(copier.completed(), stats, manifest, copied_action, src_dir)
+                    src_path = os.path.join(src_dir, rel_path)
+                    dst_path = os.path.join(dst_dir, rel_path)
                     try:
-                        size = os.path.getsize(src_path)
-                        files_to_process.append((rel_path, size))
-                        total_bytes += size
+                        st = os.stat(src_path)
+                    except FileNotFoundError:
+                        st = None
                     except OSError as e:
-                        self.logger.warning(f"无法访问文件 {src_path}: {e}")
-        except Exception as e:
-            self.logger.error(f"扫描出错: {str(e)}")
+                        stats.total += 1
+                        yield self._error_event(stats, 'copy_failed', rel_path, f"无法访问文件 {src_path}: {e}")
+                        continue
+
+                    dst_is_dir = os.path.isdir(dst_path) and not os.path.islink(dst_path)
+                    if sync_mode and os.path.lexists(dst_path) and (
+                            st is None or dst_is_dir != stat.S_ISDIR(st.st_mode)):
+                        # 源中已删除，或文件与目录互相替换
+                        if dst_is_dir:
+                            yield from self._delete_targets(dst_dir, [], [rel_path], stats, manifest)
+                        else:
+                            dst_entry = FileEntry.from_stat(rel_path, os.lstat(dst_path))
+                            yield from self._delete_targets(dst_dir, [dst_entry], [], stats, manifest,
+                                                            delta, delta_threshold)
+                        dst_is_dir = False
+                    if st is None:
+                        continue
+
+                    if stat.S_ISDIR(st.st_mode):
+                        # 增量模式的目录随文件创建；同步模式也创建空目录
+                        if sync_mode and not dst_is_dir:
+                            stats.total += 1
+                            yield self._create_dir_event(stats, dst_dir, rel_path, manifest)
+                        continue
+                    if not stat.S_ISREG(st.st_mode):
+                        continue
+
+                    stats.total += 1
+                    stats.total_bytes += st.st_size
+                    if not self._is_modified(src_path, dst_path):
+                        yield self._progress_event(stats, skipped_action, rel_path, st.st_size)
+                        continue
+                    entry = FileEntry.from_stat(rel_path, st)
+                    try:
+                        parent = os.path.dirname(rel_path)
+                        os.makedirs(os.path.join(dst_dir, parent), exist_ok=True)
+                        if parent and manifest is not None:
+                            manifest.record_dir(parent)
+                    except OSError as e:
+                        yield self._error_event(stats, 'copy_failed', rel_path, f"复制失败 {src_path}: {e}")
+                        continue
+                    self._submit_copy(copier, entry, src_dir, dst_dir, os.path.exists(dst_path),
+                                      delta, delta_threshold, resumable, resume_threshold)
+                yield from self._copy_events(copier.drain(), stats, manifest, copied_action, src_dir)
+        finally:
+            if manifest is not None:
+                manifest.close()
+
+    def start_snapshot(self, src_dir, dst_dir, progress_callback=None, workers=DEFAULT_COPY_WORKERS,
+                       keep_last=KEEP_LAST, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY):
+        """
+        执行快照备份 (参数同 snapshot_generator)
+        progress_callback: function(current, total, message)
+        """
+        events = self.snapshot_generator(src_dir, dst_dir, workers=workers, keep_last=keep_last,
+                                         keep_daily=keep_daily, keep_weekly=keep_weekly)
+        self._dispatch_events(events, progress_callback)
+
+    def snapshot_generator(self, src_dir, dst_dir, workers=DEFAULT_COPY_WORKERS, keep_last=KEEP_LAST,
+                           keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY):
+        """
+        快照备份: 在目标目录中创建以时间命名的快照目录 (类似 rsync --link-dest)
+        与上一个快照相比未变化的文件创建硬链接，只复制变化的文件；完成后按保留策略删除旧快照
+        (保留最新的 keep_last 个，最近 keep_daily 个日期、keep_weekly 个周各保留最新的一个)。
+        被中断的快照在下次运行时继续。
+        产出事件同 backup_generator，action: copied/linked/skipped (续传时已写入)/pruned
+        """
+        self._begin_run()
+
+        if not os.path.exists(src_dir):
+            msg = f"源目录不存在: {src_dir}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
             return
 
-        total_files = len(files_to_process)
-        self.logger.info(f"扫描完成: {total_files} 个文件, 共 {total_bytes} 字节")
-        
-        # 2. 复制阶段
-        processed_files = 0
-        copied_files = 0
-        processed_bytes = 0
+        self.logger.info(f"开始快照备份扫描: {src_dir}")
+        store = SnapshotStore(dst_dir)
+        try:
+            os.makedirs(dst_dir, exist_ok=True)
+            resumed = bool(store.partials())
+            partial = store.begin()
+        except OSError as e:
+            msg = f"无法创建快照目录: {e}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
+            return
+        previous = store.latest()
+        if resumed:
+            self.logger.info(f"继续未完成的快照: {partial}")
+        self.logger.info(f"上一个快照: {previous}" if previous else "没有已有快照，复制所有文件")
+
+        try:
+            yield from self._snapshot_pipeline(src_dir, store, partial, previous, resumed, workers,
+                                               (keep_last, keep_daily, keep_weekly))
+        except GeneratorExit:
+            self.stop_flag = True
+            raise
+
+    def _snapshot_pipeline(self, src_dir, store, partial, previous, resumed, workers, retention):
+        stats = BackupStats()
         start_time = time.time()
-        
-        if total_files == 0:
-             if progress_callback:
-                progress_callback(100, 100, "目录为空，无需备份")
-             return
+        snap_root = store.path(partial)
+        prev_root = store.path(previous) if previous else None
+        prev_lookup = DirectoryLookup(prev_root, on_error=self._scan_error) if previous else None
+        # 续用未完成的快照时，其中已有的文件可能是中断时未写完的
+        partial_lookup = DirectoryLookup(snap_root, on_error=self._scan_error) if resumed else None
+        can_link = previous is not None
 
-        for rel_path, size in files_to_process:
-            if self.stop_flag:
-                self.logger.info("备份已停止")
-                if progress_callback:
-                    progress_callback(processed_files, total_files, "备份已停止")
-                break
+        yield {'type': 'status', 'message': "正在创建快照..."}
+        with ParallelCopier(workers=workers, stop_check=lambda: self.stop_flag, tracer=self.profiler) as copier:
+            self.metrics.begin(PHASE_SCAN_SOURCE)
+            for rel_dir, files, subdirs in iter_tree(src_dir, lambda: self.stop_flag, self._scan_error,
+                                                     exclude=(META_DIR,)):
+                try:
+                    os.makedirs(os.path.join(snap_root, rel_dir), exist_ok=True)
+                except OSError as e:
+                    for entry in files.values():
+                        stats.total += 1
+                        yield self._error_event(stats, 'copy_failed', entry.rel_path,
+                                                f"创建目录失败 {rel_dir}: {e}")
+                    continue
+                for entry in files.values():
+                    if self.stop_flag:
+                        break
+                    yield from self._copy_events(copier.completed(), stats, None, 'copied', src_dir)
+                    rel_path = entry.rel_path
+                    stats.total += 1
+                    stats.total_bytes += entry.size
+                    dst_path = os.path.join(snap_root, rel_path)
 
-            src_path = os.path.join(src_dir, rel_path)
-            dst_path = os.path.join(dst_dir, rel_path)
-            
-            try:
-                dst_file_dir = os.path.dirname(dst_path)
-                if not os.path.exists(dst_file_dir):
-                    os.makedirs(dst_file_dir, exist_ok=True)
-
-                action = "skipped"
-                if self._is_modified(src_path, dst_path):
-                    shutil.copy2(src_path, dst_path)
-                    copied_files += 1
-                    action = "copied"
-
-                processed_files += 1
-                processed_bytes += size
-
-                # 计算进度
-                percent = (processed_files / total_files) * 100
-                
-                # 限制回调频率
-                if total_files <= 10 or processed_files % 5 == 0 or size > 1024*1024*10 or processed_files == total_files:
-                    if progress_callback:
-                        msg = f"[{processed_files}/{total_files}] {action}: {rel_path}"
-                        progress_callback(percent, total_files, msg)
+                    existing = partial_lookup.get(rel_path) if partial_lookup is not None else None
+                    if existing is not None:
+                        if not self._needs_copy(entry, existing):
+                            yield self._progress_event(stats, 'skipped', rel_path, entry.size)
+                            continue
+                        # 可能是指向旧快照的硬链接，必须先删除，不能原地覆盖
+                        try:
+                            os.unlink(dst_path)
+                        except OSError as e:
+                            yield self._error_event(stats, 'copy_failed', rel_path, f"无法替换 {dst_path}: {e}")
+                            continue
 
-            except Exception as e:
-                self.logger.error(f"复制失败 {src_path}: {e}")
+                    prev_entry = prev_lookup.get(rel_path) if can_link else None
+                    if prev_entry is not None and not self._needs_copy(entry, prev_entry):
+                        try:
+                            os.link(os.path.join(prev_root, rel_path), dst_path)
+                        except OSError as e:
+                            if e.errno in (errno.EPERM, errno.EOPNOTSUPP, errno.EXDEV):
+                                # FAT/exFAT 等文件系统不支持硬链接
+                                can_link = False
+                                self.logger.warning(f"目标文件系统不支持硬链接，改为复制所有文件: {e}")
+                            elif e.errno != errno.EMLINK:
+                                yield self._error_event(stats, 'link_failed', rel_path,
+                                                        f"创建硬链接失败 {dst_path}: {e}")
+                                continue
+                            # EMLINK: 链接数达到上限，复制一份新的
+                        else:
+                            stats.linked += 1
+                            yield self._progress_event(stats, 'linked', rel_path, entry.size)
+                            continue
+                    copier.submit(self._copy_file, os.path.join(src_dir, rel_path), dst_path,
+                                  size=entry.size, tag=entry)
+            # 扫描结束，剩余的复制任务按准确的总数计算进度
+            stats.scan_done = True
+            self.metrics.end(PHASE_SCAN_SOURCE)
+            yield from self._copy_events(copier.drain(), stats, None, 'copied', src_dir)
+
+        if self.stop_flag:
+            self.logger.info(f"快照备份已停止，下次运行将继续: {partial}")
+            yield {'type': 'done', 'stopped': True, 'message': "备份已停止", 'summary': stats.to_dict()}
+            return
+
+        try:
+            name = store.commit(partial)
+        except OSError as e:
+            msg = f"无法完成快照 {partial}: {e}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'snapshot_failed', 'rel_path': partial, 'message': msg}
+            yield {'type': 'done', 'stopped': False, 'message': msg, 'summary': stats.to_dict()}
+            return
+        self.logger.info(f"快照已创建: {name}, 复制 {stats.copied}, 硬链接 {stats.linked}")
 
-        if not self.stop_flag:
-            duration = time.time() - start_time
-            self.logger.info(f"增量备份完成! 用时: {duration:.2f}s, 复制: {copied_files}, 总计: {total_files}")
-            if progress_callback:
-                progress_callback(100, total_files, "增量备份完成")
+        yield from self._prune_snapshots(store, stats, retention)
 
-    def _start_sync_backup(self, src_dir, dst_dir, progress_callback=None):
+        duration = time.time() - start_time
+        msg = f"快照备份完成: {name} (复制 {stats.copied}, 链接 {stats.linked}, 清理 {stats.pruned_snapshots} 个旧快照)"
+        self.logger.info(f"{msg} 用时: {duration:.2f}s")
+        yield {'type': 'done', 'stopped': False, 'message': msg, 'summary': stats.to_dict()}
+
+    def _prune_snapshots(self, store, stats, retention):
         """
-        同步备份：确保目标目录与源目录完全一致
-        1. 复制/更新源目录中的所有文件
-        2. 删除目标目录中源目录不存在的文件和目录
+        按保留策略 (keep_last, keep_daily, keep_weekly) 删除旧快照和遗留的未完成快照，多个快照并行删除
         """
-        self.stop_flag = False
-        
+        keep_last, keep_daily, keep_weekly = retention
+        expired = expired_snapshots(store.snapshots(), keep_daily, keep_weekly, keep_last) + store.partials()
+        if not expired:
+            return
+        self.logger.info(f"清理旧快照: {', '.join(expired)}")
+        stats.total += len(expired)
+        tasks = [(name, None, remove_tree, store.path(name)) for name in expired]
+        for name, _chunk, (files, dirs, failures, stopped) in self._run_deletions(tasks, lambda: self.stop_flag):
+            if stopped:
+                continue
+            if failures:
+                yield self._delete_failed_event(stats, 'prune_failed', name,
+                                                f"删除快照失败 {name}: {len(failures)} 项无法删除 ({failures[0][1]})")
+                continue
+            stats.pruned_snapshots += 1
+            self.logger.info(f"删除快照: {name}")
+            yield self._progress_event(stats, 'pruned', name)
+
+    def start_dedup(self, src_dir, dst_dir, progress_callback=None, workers=DEFAULT_COPY_WORKERS):
+        """
+        执行去重备份 (参数同 dedup_generator)
+        progress_callback: function(current, total, message)
+        """
+        self._dispatch_events(self.dedup_generator(src_dir, dst_dir, workers=workers), progress_callback)
+
+    def dedup_generator(self, src_dir, dst_dir, workers=DEFAULT_COPY_WORKERS):
+        """
+        去重备份: 目标目录为内容寻址存储 (core.dedup.DedupStore)，相同内容只写入一次，
+        每次备份生成一个 路径 -> 哈希 的索引，用 restore_generator 还原。
+        源文件哈希缓存在目标目录的 .bakui/hashes.db，未变化的文件不再读取。
+        产出事件同 backup_generator，action: stored (写入新内容)/deduped (内容已存在)
+        """
+        self._begin_run()
+
         if not os.path.exists(src_dir):
-            self.logger.error(f"源目录不存在: {src_dir}")
-            if progress_callback:
-                progress_callback(0, 0, f"源目录不存在: {src_dir}")
+            msg = f"源目录不存在: {src_dir}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
             return
 
-        self.logger.info(f"开始同步备份扫描: {src_dir}")
-        if progress_callback:
-            progress_callback(0, 0, "正在扫描源目录...")
-        
-        # 1. 扫描源目录（包括空目录）
-        src_files = set()
-        src_dirs = set()
-        files_to_process = []
-        total_bytes = 0
-        
+        self.logger.info(f"开始去重备份扫描: {src_dir}")
+        store = DedupStore(dst_dir)
         try:
-            # 使用 os.walk 扫描文件和目录
-            for root, dirs, files in os.walk(src_dir):
-                if self.stop_flag:
-                    break
-                rel_root = os.path.relpath(root, src_dir)
-                if rel_root != '.':
-                    src_dirs.add(rel_root)
-                
-                for file in files:
-                    src_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(src_path, src_dir)
-                    src_files.add(rel_path)
+            os.makedirs(dst_dir, exist_ok=True)
+            store.clean_tmp()
+            index = store.begin_index(src_dir)
+        except OSError as e:
+            msg = f"无法创建备份索引: {e}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
+            return
+        hash_cache = HashCache(dst_dir)
+        if not hash_cache.open():
+            self.logger.warning(f"无法打开哈希缓存，重新计算所有文件的哈希: {hash_cache.path}")
+
+        try:
+            yield from self._dedup_pipeline(src_dir, store, index, hash_cache, workers)
+        except GeneratorExit:
+            self.stop_flag = True
+            raise
+        finally:
+            hash_cache.close()
+            if index.name is None:
+                index.abort()
+
+    def _dedup_pipeline(self, src_dir, store, index, hash_cache, workers):
+        stats = BackupStats()
+        start_time = time.time()
+        yield {'type': 'status', 'message': "正在写入去重存储..."}
+        with ParallelCopier(workers=workers, stop_check=lambda: self.stop_flag, tracer=self.profiler) as copier:
+            self.metrics.begin(PHASE_SCAN_SOURCE)
+            for rel_dir, files, subdirs in iter_tree(src_dir, lambda: self.stop_flag, self._scan_error,
+                                                     exclude=(META_DIR,)):
+                if rel_dir:
+                    index.add_dir(rel_dir)
+                for entry in files.values():
+                    if self.stop_flag:
+                        break
+                    yield from self._dedup_events(copier.completed(), stats, index, hash_cache, src_dir)
+                    stats.total += 1
+                    stats.total_bytes += entry.size
+                    file_hash = hash_cache.get(entry)
+                    if file_hash is not None and store.has(file_hash):
+                        # 内容未变化且已在存储中，不读取源文件
+                        index.add_file(entry, file_hash)
+                        stats.deduped += 1
+                        yield self._progress_event(stats, 'deduped', entry.rel_path, entry.size)
+                        continue
+                    copier.submit(store.store_file, os.path.join(src_dir, entry.rel_path), file_hash,
+                                  size=entry.size, tag=entry)
+            # 扫描结束，剩余的复制任务按准确的总数计算进度
+            stats.scan_done = True
+            self.metrics.end(PHASE_SCAN_SOURCE)
+            yield from self._dedup_events(copier.drain(), stats, index, hash_cache, src_dir)
+
+        if self.stop_flag:
+            self.logger.info("去重备份已停止，已写入的内容下次备份时复用")
+            yield {'type': 'done', 'stopped': True, 'message': "备份已停止", 'summary': stats.to_dict()}
+            return
+
+        try:
+            name = index.commit()
+        except OSError as e:
+            msg = f"无法保存备份索引: {e}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'index_failed', 'rel_path': '', 'message': msg}
+            yield {'type': 'done', 'stopped': False, 'message': msg, 'summary': stats.to_dict()}
+            return
+        duration = time.time() - start_time
+        mb = 1024 * 1024
+        msg = (f"去重备份完成: {name} (写入 {stats.copied} 个文件 {stats.bytes_copied / mb:.1f} MB, "
+               f"重复内容 {stats.deduped} 个文件)")
+        self.logger.info(f"{msg} 用时: {duration:.2f}s, 总计 {stats.total_bytes / mb:.1f} MB")
+        yield {'type': 'done', 'stopped': False, 'message': msg, 'summary': stats.to_dict()}
+
+    def _dedup_events(self, results, stats, index, hash_cache, src_dir):
+        for result in results:
+            entry = result.tag
+            if result.stopped:
+                continue
+            if result.error is not None:
+                yield self._error_event(stats, 'copy_failed', entry.rel_path,
+                                        f"写入失败 {os.path.join(src_dir, entry.rel_path)}: {result.error}")
+                continue
+            file_hash, written = result.value
+            hash_cache.put(entry, file_hash)
+            index.add_file(entry, file_hash)
+            if written:
+                stats.copied += 1
+                stats.bytes_copied += written
+                yield self._progress_event(stats, 'stored', entry.rel_path, entry.size)
+            else:
+                stats.deduped += 1
+                yield self._progress_event(stats, 'deduped', entry.rel_path, entry.size)
+
+    def start_restore(self, store_dir, target_dir, progress_callback=None, run=None,
+                      workers=DEFAULT_COPY_WORKERS):
+        """
+        从去重存储恢复 (参数同 restore_generator)
+        progress_callback: function(current, total, message)
+        """
+        events = self.restore_generator(store_dir, target_dir, run=run, workers=workers)
+        self._dispatch_events(events, progress_callback)
+
+    def restore_generator(self, store_dir, target_dir, run=None, workers=DEFAULT_COPY_WORKERS):
+        """
+        按去重存储中的索引还原目录树 (文件内容、修改时间和权限)
+        run: 索引名称，None 表示最近一次备份
+        目标中大小和修改时间与索引一致的文件跳过，中断后可重新运行
+        产出事件同 backup_generator，action: restored/skipped
+        """
+        self._begin_run()
+        store = DedupStore(store_dir)
+        run = run or store.latest_run()
+        try:
+            if run is None:
+                raise FileNotFoundError(f"没有已完成的备份: {store.index_dir}")
+            header, records = store.read_index(run)
+        except (OSError, ValueError) as e:
+            msg = f"无法读取备份索引: {e}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
+            return
+        self.logger.info(f"开始恢复 {run} (源目录 {header.get('src_dir')}) 到: {target_dir}")
+
+        stats = BackupStats()
+        start_time = time.time()
+        yield {'type': 'status', 'message': f"正在恢复 {run}..."}
+        try:
+            with ParallelCopier(workers=workers, stop_check=lambda: self.stop_flag, tracer=self.profiler) as copier:
+                os.makedirs(target_dir, exist_ok=True)
+                self.metrics.begin(PHASE_SCAN_SOURCE)
+                for record in records:
+                    if self.stop_flag:
+                        break
+                    yield from self._copy_events(copier.completed(), stats, None, 'restored', target_dir)
+                    dst_path = os.path.join(target_dir, record['path'])
+                    if record.get('dir'):
+                        try:
+                            os.makedirs(dst_path, exist_ok=True)
+                        except OSError as e:
+                            self.logger.warning(f"创建目录失败 {dst_path}: {e}")
+                        continue
+                    entry = FileEntry(record['path'], record['size'], record['mtime'], mode=record['mode'])
+                    stats.total += 1
+                    stats.total_bytes += entry.size
                     try:
-                        size = os.path.getsize(src_path)
-                        files_to_process.append((rel_path, size))
-                        total_bytes += size
+                        st = os.stat(dst_path)
+                    except OSError:
+                        pass
+                    else:
+                        if st.st_size == entry.size and abs(st.st_mtime - entry.mtime) < 1:
+                            yield self._progress_event(stats, 'skipped', entry.rel_path, entry.size)
+                            continue
+                    copier.submit(self._restore_object, store, record['hash'], dst_path, entry,
+                                  size=entry.size, tag=entry)
+                # 索引读取完毕，剩余的复制任务按准确的总数计算进度
+                stats.scan_done = True
+                self.metrics.end(PHASE_SCAN_SOURCE)
+                yield from self._copy_events(copier.drain(), stats, None, 'restored', target_dir)
+        except GeneratorExit:
+            self.stop_flag = True
+            raise
+        except (OSError, ValueError) as e:
+            # 索引文件损坏或无法读取
+            msg = f"恢复失败: {e}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'restore_failed', 'rel_path': '', 'message': msg}
+            yield {'type': 'done', 'stopped': True, 'message': msg, 'summary': stats.to_dict()}
+            return
+        stats.scan_done = True
+
+        if self.stop_flag:
+            self.logger.info("恢复已停止")
+            yield {'type': 'done', 'stopped': True, 'message': "恢复已停止", 'summary': stats.to_dict()}
+            return
+        duration = time.time() - start_time
+        msg = f"恢复完成: {run} (恢复 {stats.copied} 个文件, 失败 {stats.failed})"
+        self.logger.info(f"{msg} 用时: {duration:.2f}s")
+        yield {'type': 'done', 'stopped': False, 'message': msg, 'summary': stats.to_dict()}
+
+    def _restore_object(self, store, file_hash, dst_path, entry):
+        """
+        把对象复制到目标路径并还原修改时间和权限 (在复制线程中执行)
+        """
+        obj_path = store.object_path(file_hash)
+        if not os.path.isfile(obj_path):
+            raise FileNotFoundError(f"存储中缺少内容对象 {file_hash}")
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        self._copy_file(obj_path, dst_path)
+        os.utime(dst_path, (entry.mtime, entry.mtime))
+        os.chmod(dst_path, entry.mode)
+
+    def start_packed(self, src_dir, dst_dir, progress_callback=None, workers=DEFAULT_COPY_WORKERS,
+                     pack_threshold=PACK_THRESHOLD):
+        """
+        执行打包备份 (参数同 packed_generator)
+        progress_callback: function(current, total, message)
+        """
+        events = self.packed_generator(src_dir, dst_dir, workers=workers, pack_threshold=pack_threshold)
+        self._dispatch_events(events, progress_callback)
+
+    def packed_generator(self, src_dir, dst_dir, workers=DEFAULT_COPY_WORKERS, pack_threshold=PACK_THRESHOLD):
+        """
+        打包备份 (增量): 小于 pack_threshold 的文件追加到 .bakui/packs/ 中的段文件，
+        由偏移索引记录位置 (core.pack.PackStore)，其余文件按原样复制到目标目录。
+        与索引或目标文件相比未变化的文件跳过；备份结束后回收失效数据过多的段。
+        产出事件同 backup_generator，action: packed/copied/skipped
+        """
+        self._begin_run()
+
+        if not os.path.exists(src_dir):
+            msg = f"源目录不存在: {src_dir}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
+            return
+
+        self.logger.info(f"开始打包备份扫描: {src_dir}")
+        pack = PackStore(dst_dir)
+        if not pack.open():
+            msg = f"无法打开打包索引: {pack.path}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
+            return
+        try:
+            yield from self._packed_pipeline(src_dir, dst_dir, pack, workers, pack_threshold)
+        except GeneratorExit:
+            self.stop_flag = True
+            raise
+        finally:
+            pack.close()
+
+    def _packed_pipeline(self, src_dir, dst_dir, pack, workers, pack_threshold):
+        stats = BackupStats()
+        start_time = time.time()
+        dst_lookup = DirectoryLookup(dst_dir, on_error=self._scan_error)
+        yield {'type': 'status', 'message': "正在打包备份..."}
+        with ParallelCopier(workers=workers, stop_check=lambda: self.stop_flag, tracer=self.profiler) as copier:
+            self.metrics.begin(PHASE_SCAN_SOURCE)
+            for rel_dir, files, subdirs in iter_tree(src_dir, lambda: self.stop_flag, self._scan_error,
+                                                     exclude=(META_DIR,)):
+                for entry in files.values():
+                    if self.stop_flag:
+                        break
+                    yield from self._copy_events(copier.completed(), stats, None, 'copied', src_dir)
+                    rel_path = entry.rel_path
+                    stats.total += 1
+                    stats.total_bytes += entry.size
+                    dst_path = os.path.join(dst_dir, rel_path)
+                    # 大小跨过阈值的文件只保留一种存放方式
+                    plain = dst_lookup.get(rel_path)
+                    if entry.size >= pack_threshold:
+                        pack.remove(rel_path)
+                        if plain is not None and not self._needs_copy(entry, plain):
+                            yield self._progress_event(stats, 'skipped', rel_path, entry.size)
+                            continue
+                        try:
+                            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                        except OSError as e:
+                            yield self._error_event(stats, 'copy_failed', rel_path, f"创建目录失败 {rel_dir}: {e}")
+                            continue
+                        copier.submit(self._copy_file, os.path.join(src_dir, rel_path), dst_path,
+                                      size=entry.size, tag=entry)
+                        continue
+
+                    record = pack.get(rel_path)
+                    if record is not None and not self._needs_copy(entry, record):
+                        yield self._progress_event(stats, 'skipped', rel_path, entry.size)
+                        continue
+                    try:
+                        with open(os.path.join(src_dir, rel_path), 'rb') as f:
+                            data = f.read()
+                        pack.add(entry, data)
+                        if plain is not None:
+                            os.unlink(dst_path)
                     except OSError as e:
-                        self.logger.warning(f"无法访问文件 {src_path}: {e}")
-            
-            
-        except Exception as e:
-            self.logger.error(f"扫描源目录出错: {str(e)}")
+                        yield self._error_event(stats, 'copy_failed', rel_path,
+                                                f"打包失败 {os.path.join(src_dir, rel_path)}: {e}")
+                        continue
+                    stats.copied += 1
+                    stats.bytes_copied += len(data)
+                    yield self._progress_event(stats, 'packed', rel_path, entry.size)
+            # 扫描结束，剩余的复制任务按准确的总数计算进度
+            stats.scan_done = True
+            self.metrics.end(PHASE_SCAN_SOURCE)
+            yield from self._copy_events(copier.drain(), stats, None, 'copied', src_dir)
+
+        if self.stop_flag:
+            self.logger.info("打包备份已停止，已打包的文件下次跳过")
+            yield {'type': 'done', 'stopped': True, 'message': "备份已停止", 'summary': stats.to_dict()}
             return
 
-        # 2. 扫描目标目录（如果存在）
-        dst_files = set()
-        dst_dirs = set()
-        if os.path.exists(dst_dir):
-            if progress_callback:
-                progress_callback(0, 0, "正在扫描目标目录...")
-            try:
-                for root, dirs, files in os.walk(dst_dir):
+        try:
+            compacted, freed = pack.compact(stop_check=lambda: self.stop_flag)
+        except (OSError, sqlite3.Error) as e:
+            self.logger.warning(f"回收段文件失败: {e}")
+        else:
+            if compacted:
+                self.logger.info(f"回收 {compacted} 个段文件，释放 {freed / (1024 * 1024):.1f} MB")
+        duration = time.time() - start_time
+        msg = f"打包备份完成 (写入 {stats.copied} 个文件, 共 {stats.total} 个文件)"
+        self.logger.info(f"{msg} 用时: {duration:.2f}s, 索引中 {len(pack)} 个小文件")
+        yield {'type': 'done', 'stopped': False, 'message': msg, 'summary': stats.to_dict()}
+
+    def start_compressed(self, src_dir, dst_dir, progress_callback=None, workers=DEFAULT_COPY_WORKERS,
+                         algorithm=COMPRESS_GZIP, level=None):
+        """
+        执行压缩备份 (参数同 compressed_generator)
+        progress_callback: function(current, total, message)
+        """
+        events = self.compressed_generator(src_dir, dst_dir, workers=workers, algorithm=algorithm, level=level)
+        self._dispatch_events(events, progress_callback)
+
+    def compressed_generator(self, src_dir, dst_dir, workers=DEFAULT_COPY_WORKERS, algorithm=COMPRESS_GZIP,
+                             level=None):
+        """
+        压缩备份 (增量): 文件压缩后以 原文件名 + .gz/.bz2/.xz 保存，可用常规工具解压；
+        采样发现不可压缩的文件 (以及已压缩的格式) 按原样保存。大文件按块在进程池中并行压缩。
+        原始大小和修改时间记录在 .bakui/compress.db，增量比对与其比较，不读取压缩后的文件。
+        产出事件同 backup_generator，action: compressed/copied (按原样保存)/skipped，
+        compressed/copied 事件带有 'written' (实际写入字节数)
+        """
+        self._begin_run()
+
+        if not os.path.exists(src_dir):
+            msg = f"源目录不存在: {src_dir}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
+            return
+
+        self.logger.info(f"开始压缩备份扫描 ({algorithm}): {src_dir}")
+        index = CompressIndex(dst_dir)
+        if not index.open():
+            msg = f"无法打开压缩索引: {index.path}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
+            return
+        try:
+            with ParallelCompressor(algorithm, level) as compressor:
+                yield from self._compressed_pipeline(src_dir, dst_dir, index, compressor, workers)
+        except GeneratorExit:
+            self.stop_flag = True
+            raise
+        finally:
+            index.close()
+
+    def _compressed_pipeline(self, src_dir, dst_dir, index, compressor, workers):
+        suffix = COMPRESS_SUFFIXES[compressor.algorithm]
+        stats = BackupStats()
+        start_time = time.time()
+        yield {'type': 'status', 'message': "正在压缩备份..."}
+        with ParallelCopier(workers=workers, stop_check=lambda: self.stop_flag, tracer=self.profiler) as copier:
+            self.metrics.begin(PHASE_SCAN_SOURCE)
+            for rel_dir, files, subdirs in iter_tree(src_dir, lambda: self.stop_flag, self._scan_error,
+                                                     exclude=(META_DIR,)):
+                if files:
+                    try:
+                        os.makedirs(os.path.join(dst_dir, rel_dir), exist_ok=True)
+                    except OSError as e:
+                        for entry in files.values():
+                            stats.total += 1
+                            yield self._error_event(stats, 'copy_failed', entry.rel_path,
+                                                    f"创建目录失败 {rel_dir}: {e}")
+                        continue
+                for entry in files.values():
                     if self.stop_flag:
                         break
-                    rel_root = os.path.relpath(root, dst_dir)
-                    if rel_root != '.':
-                        dst_dirs.add(rel_root)
-                    
-                    for file in files:
-                        rel_path = os.path.relpath(os.path.join(root, file), dst_dir)
-                        dst_files.add(rel_path)
-            except Exception as e:
-                self.logger.warning(f"扫描目标目录出错: {str(e)}")
+                    yield from self._compressed_events(copier.completed(), stats, index, src_dir)
+                    stats.total += 1
+                    stats.total_bytes += entry.size
+                    record = index.get(entry.rel_path)
+                    if not self._needs_copy(entry, record):
+                        yield self._progress_event(stats, 'skipped', entry.rel_path, entry.size)
+                        continue
+                    # 同一目录下已有 "文件名 + 压缩后缀" 的源文件时按原样保存，避免两者对应同一个备份文件
+                    compress = os.path.basename(entry.rel_path) + suffix not in files
+                    copier.submit(self._compress_copy, compressor, entry, src_dir, dst_dir, record, compress,
+                                  size=entry.size, tag=entry)
+            # 扫描结束，剩余的复制任务按准确的总数计算进度
+            stats.scan_done = True
+            self.metrics.end(PHASE_SCAN_SOURCE)
+            yield from self._compressed_events(copier.drain(), stats, index, src_dir)
 
-        # 3. 计算需要删除的文件和目录
-        files_to_delete = dst_files - src_files
-        
-        # 对于目录删除，需要确保删除所有不在源目录中的目录
-        # 构建源目录的所有路径（包括所有父路径）
-        src_all_paths = set()
-        src_all_paths.add('.')  # 根目录
-        for rel_dir in src_dirs:
-            src_all_paths.add(rel_dir)
-            # 添加所有父路径
-            parts = rel_dir.split(os.sep)
-            for i in range(1, len(parts)):
-                parent = os.sep.join(parts[:i])
-                src_all_paths.add(parent)
-        
-        # 对于文件，也要添加其父目录路径
-        for rel_file in src_files:
-            parent_dir = os.path.dirname(rel_file)
-            if parent_dir and parent_dir != '.':
-                src_all_paths.add(parent_dir)
-                # 添加所有父路径
-                parts = parent_dir.split(os.sep)
-                for i in range(1, len(parts)):
-                    parent = os.sep.join(parts[:i])
-                    src_all_paths.add(parent)
-        
-        # 计算需要删除的目录：目标目录中不在源目录路径集合中的目录
-        dirs_to_delete = []
-        for dst_dir_path in dst_dirs:
-            if dst_dir_path not in src_all_paths:
-                dirs_to_delete.append(dst_dir_path)
-        
-        # 计算需要创建的目录（源目录中存在但目标目录中不存在的空目录）
-        dirs_to_create = []
-        for src_dir_path in src_dirs:
-            dst_dir_path = os.path.join(dst_dir, src_dir_path)
-            if not os.path.exists(dst_dir_path):
-                dirs_to_create.append(src_dir_path)
-        
-        total_ops = len(files_to_process) + len(files_to_delete) + len(dirs_to_delete) + len(dirs_to_create)
-        self.logger.info(f"扫描完成: 源文件 {len(files_to_process)} 个, 源目录 {len(src_dirs)} 个, 需删除文件 {len(files_to_delete)} 个, 需删除目录 {len(dirs_to_delete)} 个, 需创建目录 {len(dirs_to_create)} 个")
-        
-        if total_ops == 0:
-            if progress_callback:
-                progress_callback(100, 100, "目录已同步，无需操作")
+        summary = stats.to_dict()
+        if self.stop_flag:
+            self.logger.info("压缩备份已停止")
+            yield {'type': 'done', 'stopped': True, 'message': "备份已停止", 'summary': summary}
+            return
+        duration = time.time() - start_time
+        mb = 1024 * 1024
+        msg = f"压缩备份完成 (写入 {stats.copied} 个文件, {stats.bytes_copied / mb:.1f} MB)"
+        self.logger.info(f"{msg} 用时: {duration:.2f}s, 源文件总计 {stats.total_bytes / mb:.1f} MB")
+        yield {'type': 'done', 'stopped': False, 'message': msg, 'summary': summary}
+
+    def _compress_copy(self, compressor, entry, src_dir, dst_dir, record, compress=True):
+        """
+        压缩或按原样复制单个文件 (在复制线程中执行)
+        返回: (保存方式, 写入字节数)
+        """
+        src_path = os.path.join(src_dir, entry.rel_path)
+        method = METHOD_RAW
+        if compress and is_compressible(src_path, entry.size):
+            method = compressor.algorithm
+        dst_path = os.path.join(dst_dir, stored_name(entry.rel_path, method))
+        if method == METHOD_RAW:
+            self._copy_file(src_path, dst_path)
+            written = entry.size
+        else:
+            written = compressor.compress_file(src_path, dst_path, lambda: self.stop_flag)
+            os.utime(dst_path, (entry.mtime, entry.mtime))
+        if record is not None and record.method != method:
+            # 保存方式变化 (例如内容变得不可压缩)，删除旧的备份文件
+            try:
+                os.unlink(os.path.join(dst_dir, stored_name(entry.rel_path, record.method)))
+            except FileNotFoundError:
+                pass
+        return method, written
+
+    def _compressed_events(self, results, stats, index, src_dir):
+        for result in results:
+            entry = result.tag
+            if result.stopped:
+                continue
+            if result.error is not None:
+                yield self._error_event(stats, 'copy_failed', entry.rel_path,
+                                        f"压缩失败 {os.path.join(src_dir, entry.rel_path)}: {result.error}")
+                continue
+            method, written = result.value
+            index.put(entry, method, written)
+            stats.copied += 1
+            stats.bytes_copied += written
+            event = self._progress_event(stats, 'copied' if method == METHOD_RAW else 'compressed',
+                                         entry.rel_path, entry.size)
+            event['written'] = written
+            yield event
+
+    def start_fanout(self, src_dir, dst_dirs, progress_callback=None, workers=DEFAULT_COPY_WORKERS,
+                     use_manifest=True):
+        """
+        执行多目标备份 (参数同 fanout_generator)
+        progress_callback: function(current, total, message)
+        """
+        events = self.fanout_generator(src_dir, dst_dirs, workers=workers, use_manifest=use_manifest)
+        self._dispatch_events(events, progress_callback)
+
+    def fanout_generator(self, src_dir, dst_dirs, workers=DEFAULT_COPY_WORKERS, use_manifest=True):
+        """
+        多目标备份 (增量): 源目录只扫描一次，逐个目标比对，需要复制的文件只读取一次，
+        数据同时写往所有需要它的目标 (core.fanout.FanoutCopier)。
+        写入慢的目标不阻塞其他目标 (落后过多时自行读取源文件)，出现空间不足等错误的目标停用，其他目标继续。
+        产出事件同 backup_generator，progress/error 事件额外带有 'target' (目标目录)，
+        processed/total 按 (文件, 目标) 计数；done 事件的 'targets' 为 {目标目录: 该目标的统计}。
+        目标排队的文件过多时新文件推迟 ('deferred' 事件，计入统计的 deferred)，下次备份时复制。
+        """
+        self._begin_run()
+
+        if not os.path.exists(src_dir):
+            msg = f"源目录不存在: {src_dir}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
             return
 
-        # 4. 执行操作
-        processed_ops = 0
-        copied_files = 0
-        deleted_files = 0
-        deleted_dirs = 0
+        dst_dirs = list(dict.fromkeys(os.path.normpath(d) for d in dst_dirs))
+        self.logger.info(f"开始多目标备份扫描: {src_dir} -> {', '.join(dst_dirs)}")
+        targets = []
+        try:
+            for dst_dir in dst_dirs:
+                try:
+                    os.makedirs(dst_dir, exist_ok=True)
+                except OSError as e:
+                    msg = f"无法访问目标目录 {dst_dir}: {e}"
+                    self.logger.error(msg)
+                    yield {'type': 'error', 'action': 'target_failed', 'rel_path': '', 'message': msg,
+                           'target': dst_dir}
+                    continue
+                manifest = self._open_manifest(dst_dir) if use_manifest else None
+                targets.append(FanoutTarget(dst_dir, manifest, self._scan_error))
+            if not targets:
+                yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': "没有可用的目标目录"}
+                return
+            yield from self._fanout_pipeline(src_dir, targets, workers)
+        except GeneratorExit:
+            self.stop_flag = True
+            raise
+        finally:
+            for target in targets:
+                if target.manifest is not None:
+                    target.manifest.close()
+
+    def _fanout_pipeline(self, src_dir, targets, workers):
+        stats = BackupStats()
         start_time = time.time()
+        yield {'type': 'status', 'message': f"正在备份到 {len(targets)} 个目标..."}
+        with FanoutCopier([t.dst_dir for t in targets], self._copy_file, workers=workers,
+                          stop_check=lambda: self.stop_flag) as copier:
+            lanes = copier.lanes
+            self.metrics.begin(PHASE_SCAN_SOURCE)
+            for rel_dir, files, subdirs in iter_tree(src_dir, lambda: self.stop_flag, self._scan_error,
+                                                     exclude=(META_DIR,)):
+                for entry in files.values():
+                    if self.stop_flag:
+                        break
+                    yield from self._fanout_events(copier.completed(), stats, targets, src_dir)
+                    rel_path = entry.rel_path
+                    needed = []
+                    for target, lane in zip(targets, lanes):
+                        if lane.failed:
+                            continue
+                        stats.total += 1
+                        stats.total_bytes += entry.size
+                        target.stats.total += 1
+                        target.stats.total_bytes += entry.size
+                        if not self._needs_copy(entry, target.lookup(rel_path)):
+                            target.stats.processed += 1
+                            event = self._progress_event(stats, 'skipped', rel_path, entry.size)
+                            event['target'] = target.dst_dir
+                            yield event
+                            continue
+                        try:
+                            target.ensure_dir(rel_dir)
+                        except OSError as e:
+                            target.stats.processed += 1
+                            target.stats.failed += 1
+                            event = self._error_event(stats, 'copy_failed', rel_path,
+                                                      f"创建目录失败 {os.path.join(target.dst_dir, rel_dir)}: {e}")
+                            event['target'] = target.dst_dir
+                            yield event
+                            continue
+                        needed.append((lane, os.path.join(target.dst_dir, rel_path)))
+                    if needed:
+                        copier.submit(entry, os.path.join(src_dir, rel_path), needed)
+            # 扫描结束，剩余的复制任务按准确的总数计算进度
+            stats.scan_done = True
+            self.metrics.end(PHASE_SCAN_SOURCE)
+            for target in targets:
+                target.stats.scan_done = True
+            yield from self._fanout_events(copier.drain(), stats, targets, src_dir)
+            detached = {t.dst_dir: lane.detached for t, lane in zip(targets, lanes) if lane.detached}
+            failed = {t.dst_dir: lane.error for t, lane in zip(targets, lanes) if lane.failed}
 
-        # 4.1 删除多余的文件
-        failed_deletes = []
-        for rel_path in sorted(files_to_delete, reverse=True):
-            if self.stop_flag:
-                break
-            dst_path = os.path.join(dst_dir, rel_path)
-            success, error_msg = self._remove_file_safe(dst_path)
-            if success:
-                deleted_files += 1
-                self.logger.info(f"删除文件: {rel_path}")
+        summary = stats.to_dict()
+        per_target = {t.dst_dir: t.stats.to_dict() for t in targets}
+        if self.stop_flag:
+            self.logger.info("多目标备份已停止")
+            yield {'type': 'done', 'stopped': True, 'message': "备份已停止", 'summary': summary,
+                   'targets': per_target}
+            return
+        duration = time.time() - start_time
+        for dst_dir, count in detached.items():
+            self.logger.info(f"目标 {dst_dir} 写入较慢，{count} 个文件单独读取源文件复制")
+        parts = []
+        for target in targets:
+            if target.dst_dir in failed:
+                parts.append(f"{target.dst_dir}: 已停用 ({failed[target.dst_dir]})")
             else:
-                failed_deletes.append((rel_path, error_msg))
-                self.logger.warning(f"删除文件失败 {rel_path}: {error_msg}")
-            
-            processed_ops += 1
-            if progress_callback:
-                percent = (processed_ops / total_ops) * 100
-                status = "删除" if success else "删除失败"
-                msg = f"[{processed_ops}/{total_ops}] {status}: {rel_path}"
-                progress_callback(percent, total_ops, msg)
-
-        # 4.2 删除多余的目录（从深层到浅层，使用 rmtree 确保完全删除）
-        failed_dir_deletes = []
-        for rel_dir in sorted(dirs_to_delete, key=lambda x: x.count(os.sep), reverse=True):
-            if self.stop_flag:
-                break
-            dst_path = os.path.join(dst_dir, rel_dir)
-            success, error_msg = self._remove_dir_safe(dst_path)
-            if success:
-                deleted_dirs += 1
-                self.logger.info(f"删除目录: {rel_dir}")
+                part = f"{target.dst_dir}: 复制 {target.stats.copied}, 失败 {target.stats.failed}"
+                if target.stats.deferred:
+                    part += f", 写入过慢推迟到下次备份 {target.stats.deferred}"
+                parts.append(part)
+        # 有文件推迟时本次备份不完整
+        if stats.deferred:
+            msg = f"多目标备份未完成 ({len(targets)} 个目标) - {stats.deferred} 个文件推迟到下次备份"
+        else:
+            msg = f"多目标备份完成 ({len(targets)} 个目标)"
+        log = f"{msg} 用时: {duration:.2f}s\n" + "\n".join(parts)
+        if failed:
+            msg += f" - {len(failed)} 个目标失败"
+        if failed or stats.deferred:
+            self.logger.warning(log)
+        else:
+            self.logger.info(log)
+        yield {'type': 'done', 'stopped': False, 'message': msg, 'summary': summary, 'targets': per_target}
+
+    def _fanout_events(self, results, stats, targets, src_dir):
+        """
+        把写入结果转换为事件，并更新对应目标的清单和计数
+        """
+        for result in results:
+            if result.stopped:
+                continue
+            entry, lane = result.tag, result.lane
+            target = targets[lane.index]
+            target.stats.processed += 1
+            if result.deferred:
+                # 不记入清单，下次备份时复制
+                lane.record(result)
+                target.stats.deferred += 1
+                stats.deferred += 1
+                event = self._progress_event(stats, 'deferred', entry.rel_path, entry.size)
+                event['target'] = target.dst_dir
+                yield event
+                continue
+            if result.error is not None:
+                target.stats.failed += 1
+                event = self._error_event(stats, 'copy_failed', entry.rel_path,
+                                          f"复制失败 {os.path.join(src_dir, entry.rel_path)} -> "
+                                          f"{target.dst_dir}: {result.error}")
+                event['target'] = target.dst_dir
+                yield event
+                if lane.record(result):
+                    msg = f"目标 {target.dst_dir} 已停用，其他目标继续备份: {result.error}"
+                    self.logger.error(msg)
+                    yield {'type': 'error', 'action': 'target_failed', 'rel_path': '', 'message': msg,
+                           'target': target.dst_dir}
+                continue
+            lane.record(result)
+            target.stats.copied += 1
+            target.stats.bytes_copied += entry.size
+            stats.copied += 1
+            stats.bytes_copied += entry.size
+            if target.manifest is not None:
+                target.manifest.record_file(entry)
+            event = self._progress_event(stats, 'copied', entry.rel_path, entry.size)
+            event['target'] = target.dst_dir
+            yield event
+
+    def _open_dir_cache(self, src_dir, dst_dir, manifest, verify_destination, compare_mode, full_scan_interval):
+        """
+        打开源目录状态缓存，决定本次是否可以跳过未变化的目录
+        """
+        if compare_mode != COMPARE_METADATA:
+            self.logger.info("内容比对需要读取所有文件，不跳过未变化的目录")
+            return None
+        dir_cache = DirCache(dst_dir, full_scan_interval)
+        if not dir_cache.open():
+            self.logger.warning(f"无法打开目录缓存，扫描所有目录: {dir_cache.path}")
+            return None
+        # 目标清单不可信时目标中可能缺少文件，源目录也需要全量扫描
+        force_reason = "已要求全量校验" if verify_destination else None
+        if force_reason is None and manifest is not None and manifest.stale_reason() is not None:
+            force_reason = "目标清单不可信"
+        reason = dir_cache.load(src_dir, force_reason)
+        if reason:
+            self.logger.info(f"全量扫描源目录: {reason}")
+        else:
+            self.logger.info("跳过条目未变化的源目录")
+        return dir_cache
+
+    def _update_dir_cache(self, dir_cache, event):
+        # 处理失败的文件所在目录下次需要重新扫描；备份完整结束后才保存目录记录
+        if event['type'] == 'error':
+            dir_cache.invalidate(os.path.dirname(event['rel_path']))
+        elif event['type'] == 'done' and not event['stopped'] and event['summary']['scan_done']:
+            dir_cache.commit()
+            self.logger.info(f"目录缓存: 跳过 {dir_cache.pruned_dirs} 个未变化的目录, "
+                             f"扫描 {dir_cache.scanned_dirs} 个目录")
+
+    def _run_pipeline(self, src_dir, dst_dir, sync_mode, workers, manifest, verify_destination,
+                      move_detection=MOVE_DETECTION_OFF, delta_threshold=None, resume_threshold=None,
+                      compare_mode=COMPARE_METADATA, diff_engine=DIFF_ENGINE_TREE, dir_cache=None):
+        stats = BackupStats()
+        start_time = time.time()
+        copied_action, skipped_action = ("updated", "synced") if sync_mode else ("copied", "skipped")
+
+        # 1. 目标目录索引: 清单可信时直接查询清单，否则全量扫描一次 (同步模式需要完整列表)
+        reason = None
+        if manifest is not None:
+            reason = "已要求全量校验" if verify_destination else manifest.stale_reason()
+
+        merge = sync_mode and diff_engine == DIFF_ENGINE_MERGE
+        dst_tree = None
+        if merge:
+            # 归并比对边遍历边读取目标目录，不预先建立索引；清单只记录本次的变更
+            self.logger.info("使用归并比对，逐目录读取目标目录")
+            if manifest is not None:
+                manifest.begin_run()
+        elif manifest is not None and reason is None:
+            self.logger.info("使用目标清单比对，跳过目标目录扫描")
+            manifest.begin_run()
+            if sync_mode:
+                with self.metrics.phase(PHASE_SCAN_DESTINATION):
+                    dst_tree = manifest.load_tree()
+        elif manifest is not None or sync_mode:
+            if reason:
+                self.logger.info(f"全量扫描目标目录: {reason}")
+            yield {'type': 'status', 'message': "正在扫描目标目录..."}
+            dst_tree = self._scan_destination(dst_dir, manifest)
+
+        directory_lookup = None
+        if merge:
+            # 目标文件信息随比对结果一起传递，只有目录需要查询
+            lookup = None
+
+            def has_dir(rel_dir):
+                return os.path.isdir(os.path.join(dst_dir, rel_dir))
+        elif sync_mode:
+            # 扫描源目录时在目标目录树中标记仍存在的路径，未标记的即为需删除的内容
+            lookup, has_dir = dst_tree.get, dst_tree.has_dir
+        elif manifest is not None:
+            # 增量模式逐个查询清单，不在内存中保留目标目录列表
+            dst_tree = None
+            lookup, has_dir = manifest.lookup, manifest.has_dir
+        else:
+            # 目标目录按目录懒加载扫描，每个目录只 scandir 一次
+            directory_lookup = DirectoryLookup(dst_dir, on_error=self._scan_error)
+            lookup, has_dir = directory_lookup.get, directory_lookup.dir_exists
+
+        known_dirs = set()
+
+        def ensure_dir(rel_dir):
+            if rel_dir in known_dirs:
+                return
+            if not rel_dir or not has_dir(rel_dir):
+                os.makedirs(os.path.join(dst_dir, rel_dir), exist_ok=True)
+                if rel_dir and manifest is not None:
+                    manifest.record_dir(rel_dir)
+                if directory_lookup is not None:
+                    directory_lookup.mark_created(rel_dir)
+            known_dirs.add(rel_dir)
+
+        delta, resumable = self._large_file_copiers(dst_dir, delta_threshold, resume_threshold)
+
+        # 同步模式: 可能是移动的新文件暂缓到扫描结束后再处理
+        mover = None
+        deferred = []
+        if sync_mode and not merge and move_detection != MOVE_DETECTION_OFF:
+            mover = MoveDetector(dst_tree.iter_files(), move_detection,
+                                 source_inodes=(manifest is not None and reason is None))
+
+        # 内容比对: 元数据一致的文件再比较内容哈希，哈希在进程池中计算，源文件哈希按 stat 缓存
+        hasher, hash_cache, hashes = None, None, {}
+        if compare_mode != COMPARE_METADATA:
+            hash_cache = HashCache(dst_dir)
+            if not hash_cache.open():
+                self.logger.warning(f"无法打开哈希缓存，所有文件都将重新计算哈希: {hash_cache.path}")
+            hasher = ParallelHasher()
+
+        # 2. 扫描与复制流水线
+        src_file_count, src_dir_count, unreadable = 0, 0, set()
+        scan_failed = False
+        scan_queue = queue.Queue(maxsize=SCAN_QUEUE_SIZE)
+        stop_event = threading.Event()
+        if merge:
+            producer = threading.Thread(target=self._merge_producer, args=(src_dir, dst_dir, scan_queue, stop_event),
+                                        name="bakui-scan", daemon=True)
+        else:
+            walk = dir_cache.walk if dir_cache is not None else iter_tree
+            producer = threading.Thread(target=self._scan_producer, args=(src_dir, scan_queue, stop_event, walk),
+                                        name="bakui-scan", daemon=True)
+
+        yield {'type': 'status', 'message': "正在扫描源目录..." if sync_mode else "正在扫描文件..."}
+        self.metrics.begin(PHASE_SCAN_SOURCE)
+        producer.start()
+        try:
+            with ParallelCopier(workers=workers, stop_check=lambda: self.stop_flag, tracer=self.profiler) as copier:
+                def copy_entry(entry, dst_entry=None):
+                    try:
+                        ensure_dir(os.path.dirname(entry.rel_path))
+                    except Exception as e:
+                        yield self._error_event(stats, 'copy_failed', entry.rel_path,
+                                                f"复制失败 {os.path.join(src_dir, entry.rel_path)}: {e}")
+                        return
+                    self._submit_copy(copier, entry, src_dir, dst_dir, dst_entry is not None,
+                                      delta, delta_threshold, resumable, resume_threshold)
+                    yield from self._copy_events(copier.completed(), stats, manifest, copied_action, src_dir,
+                                                 hashes)
+
+                def check_content(entry, dst_entry):
+                    # 哈希已知时直接比较，否则交给进程池计算
+                    src_hash = hash_cache.get(entry)
+                    dst_hash = None
+                    if manifest is not None and compare_mode == COMPARE_CONTENT:
+                        dst_hash = manifest.get_hash(entry.rel_path)
+                    if src_hash is not None and dst_hash is not None:
+                        yield from content_events([HashJob((entry, dst_entry), src_hash, dst_hash)])
+                        return
+                    hasher.submit((entry, dst_entry),
+                                  None if src_hash else os.path.join(src_dir, entry.rel_path),
+                                  None if dst_hash else os.path.join(dst_dir, entry.rel_path),
+                                  src_hash, dst_hash)
+                    yield from content_events(hasher.completed())
+
+                def content_events(jobs):
+                    for job in jobs:
+                        if self.stop_flag:
+                            return
+                        entry, dst_entry = job.tag
+                        rel_path = entry.rel_path
+                        if job.src_error is not None:
+                            yield self._error_event(stats, 'hash_failed', rel_path,
+                                                    f"计算哈希失败 {os.path.join(src_dir, rel_path)}: {job.src_error}")
+                            continue
+                        hash_cache.put(entry, job.src_hash)
+                        if job.src_hash == job.dst_hash:
+                            if manifest is not None:
+                                manifest.set_hash(rel_path, job.dst_hash)
+                            yield self._progress_event(stats, skipped_action, rel_path, entry.size)
+                            continue
+                        # 大小和修改时间一致但内容不同 (保留修改时间的工具写入，或目标介质损坏)
+                        stats.content_mismatches += 1
+                        self.logger.warning(f"内容不一致，重新复制: {rel_path}")
+                        if delta is not None:
+                            # 旁路校验和与目标文件的修改时间一致，不能用来判断哪些块需要重写
+                            delta.discard(rel_path)
+                        hashes[rel_path] = job.src_hash
+                        yield from copy_entry(entry, dst_entry)
+
+                while not stats.scan_done and not scan_failed and not self.stop_flag:
+                    yield from self._copy_events(copier.completed(), stats, manifest, copied_action, src_dir,
+                                                 hashes)
+                    if hasher is not None:
+                        yield from content_events(hasher.completed())
+                    try:
+                        kind, payload = scan_queue.get(timeout=0.05)
+                    except queue.Empty:
+                        continue
+
+                    if kind == 'files' or kind == 'pairs':
+                        for item in payload:
+                            if self.stop_flag:
+                                break
+                            diff_start = time.monotonic()
+                            if kind == 'pairs':
+                                entry, dst_entry = item
+                            else:
+                                entry, dst_entry = item, lookup(item.rel_path)
+                            rel_path = entry.rel_path
+                            stats.total += 1
+                            stats.total_bytes += entry.size
+                            if sync_mode:
+                                src_file_count += 1
+                                if dst_tree is not None:
+                                    dst_tree.mark(rel_path)
+
+                            needs_copy = self._needs_copy(entry, dst_entry)
+                            self.metrics.add_phase(PHASE_DIFF, time.monotonic() - diff_start)
+                            if not needs_copy:
+                                if hasher is not None:
+                                    yield from check_content(entry, dst_entry)
+                                else:
+                                    yield self._progress_event(stats, skipped_action, rel_path, entry.size)
+                                continue
+
+                            if dst_entry is None and mover is not None and mover.is_candidate(entry):
+                                deferred.append(entry)
+                                continue
+
+                            yield from copy_entry(entry, dst_entry)
+                    elif kind == 'dir':
+                        if sync_mode:
+                            # 创建所有源目录（包括空目录）
+                            src_dir_count += 1
+                            if not has_dir(payload):
+                                stats.total += 1
+                                yield self._create_dir_event(stats, dst_dir, payload, manifest)
+                                if dst_tree is not None:
+                                    dst_tree.add_dir(payload)
+                            if dst_tree is not None:
+                                dst_tree.mark_dir(payload)
+                    elif kind == 'delete':
+                        # 归并比对: 所在目录已比对完毕，可以立即删除
+                        yield from self._delete_targets(dst_dir, [payload], [], stats, manifest,
+                                                        delta, delta_threshold)
+                    elif kind == 'delete_dir':
+                        yield from self._delete_targets(dst_dir, [], [payload], stats, manifest,
+                                                        delta, delta_threshold)
+                    elif kind == 'unreadable':
+                        # 无法访问的文件仍视为存在，避免误删目标目录中的已有备份
+                        unreadable.add(payload)
+                        if dst_tree is not None:
+                            dst_tree.mark_dir(os.path.dirname(payload))
+                    elif kind == 'done':
+                        stats.scan_done = True
+                        self.metrics.end(PHASE_SCAN_SOURCE)
+                        if not sync_mode:
+                            self.logger.info(f"扫描完成: {stats.total} 个文件, 共 {stats.total_bytes} 字节")
+                    elif kind == 'failed':
+                        scan_failed = True
+                        self.metrics.end(PHASE_SCAN_SOURCE)
+                        self.logger.error(f"扫描源目录出错: {payload}")
+
+                if hasher is not None and not self.stop_flag:
+                    yield from content_events(hasher.drain())
+
+                if deferred and stats.scan_done and not self.stop_flag:
+                    yield from self._apply_moves(deferred, mover, unreadable, dst_tree,
+                                                 src_dir, dst_dir, stats, manifest, copy_entry, delta)
+                elif deferred and not self.stop_flag:
+                    # 扫描未完整结束，无法判断哪些文件会被删除，全部按新文件复制
+                    for entry in deferred:
+                        yield from copy_entry(entry)
+
+                yield from self._copy_events(copier.drain(), stats, manifest, copied_action, src_dir, hashes)
+        finally:
+            stop_event.set()
+            producer.join()
+            if hasher is not None:
+                hasher.shutdown(cancel=True)
+                stats.hashed_files, stats.hashed_bytes, stats.hash_rate = hasher.throughput()
+                self.logger.info(f"内容校验: 计算哈希 {stats.hashed_files} 个文件 "
+                                 f"({stats.hashed_bytes / 1024 / 1024:.1f} MB, "
+                                 f"{stats.hash_rate / 1024 / 1024:.1f} MB/s), "
+                                 f"缓存命中 {hash_cache.hits}, 内容不一致 {stats.content_mismatches}")
+                hash_cache.close()
+
+        # 3. 同步模式: 源目录扫描完整后删除多余的文件和目录 (归并比对已在遍历过程中删除)
+        if sync_mode and stats.scan_done and not self.stop_flag:
+            self.logger.info(f"扫描完成: 源文件 {src_file_count} 个, 源目录 {src_dir_count} 个")
+            if dst_tree is not None:
+                yield from self._sync_deletions(dst_dir, dst_tree, unreadable, stats, manifest,
+                                                delta, delta_threshold)
+
+        yield self._done_event(stats, sync_mode, time.time() - start_time)
+
+    def plan_backup(self, src_dir, dst_dir, sync_mode=False, use_manifest=True, verify_destination=False,
+                    move_detection=MOVE_DETECTION_METADATA):
+        """
+        预演备份: 扫描并比对，生成备份计划而不修改目标目录 (清单只读打开)
+        返回: BackupPlan，源目录不存在或被停止时返回 None
+        """
+        self._begin_run()
+        if not os.path.exists(src_dir):
+            self.logger.error(f"源目录不存在: {src_dir}")
+            return None
+
+        mode_name = "同步备份" if sync_mode else "增量备份"
+        self.logger.info(f"开始预演{mode_name}: {src_dir}")
+        plan = BackupPlan(src_dir, dst_dir, sync_mode)
+        unreadable = set()
+
+        def on_error(path, e):
+            self._scan_error(path, e)
+            unreadable.add(os.path.relpath(path, src_dir))
+
+        manifest = None
+        if use_manifest and not verify_destination:
+            manifest = Manifest(dst_dir)
+            if not manifest.open(readonly=True) or manifest.stale_reason() is not None:
+                manifest.close(clean=False)
+                manifest = None
+        try:
+            # 同步模式需要完整的目标目录树，增量模式按需查询
+            dst_tree = None
+            if sync_mode:
+                if manifest is not None:
+                    dst_tree = manifest.load_tree()
+                elif os.path.exists(dst_dir):
+                    dst_tree = FileTree.scan(dst_dir, lambda: self.stop_flag, self._scan_error,
+                                             exclude=(META_DIR,))
+                else:
+                    dst_tree = FileTree()
+                lookup = dst_tree.get
+            elif manifest is not None:
+                lookup = manifest.lookup
             else:
-                failed_dir_deletes.append((rel_dir, error_msg))
-                self.logger.warning(f"删除目录失败 {rel_dir}: {error_msg}")
-            
-            processed_ops += 1
-            if progress_callback:
-                percent = (processed_ops / total_ops) * 100
-                status = "删除目录" if success else "删除目录失败"
-                msg = f"[{processed_ops}/{total_ops}] {status}: {rel_dir}"
-                progress_callback(percent, total_ops, msg)
-
-        # 4.3 创建所有源目录（包括空目录）
-        # 确保所有源目录都被创建，即使它们是空的
-        created_dirs = 0
-        for rel_dir in dirs_to_create:
-            if self.stop_flag:
-                break
-            dst_dir_path = os.path.join(dst_dir, rel_dir)
-            try:
-                os.makedirs(dst_dir_path, exist_ok=True)
-                created_dirs += 1
-                self.logger.info(f"创建目录: {rel_dir}")
-            except Exception as e:
-                self.logger.warning(f"创建目录失败 {rel_dir}: {e}")
-            
-            processed_ops += 1
-            if progress_callback:
-                percent = (processed_ops / total_ops) * 100
-                msg = f"[{processed_ops}/{total_ops}] 创建目录: {rel_dir}"
-                progress_callback(percent, total_ops, msg)
-
-        # 4.4 复制/更新文件
-        for rel_path, size in files_to_process:
-            if self.stop_flag:
-                self.logger.info("备份已停止")
-                if progress_callback:
-                    progress_callback(processed_ops, total_ops, "备份已停止")
-                break
+                lookup = DirectoryLookup(dst_dir, on_error=self._scan_error).get
 
-            src_path = os.path.join(src_dir, rel_path)
-            dst_path = os.path.join(dst_dir, rel_path)
-            
-            try:
-                dst_file_dir = os.path.dirname(dst_path)
-                if not os.path.exists(dst_file_dir):
-                    os.makedirs(dst_file_dir, exist_ok=True)
-
-                action = "skipped"
-                if self._is_modified(src_path, dst_path):
-                    shutil.copy2(src_path, dst_path)
-                    copied_files += 1
-                    action = "updated"
+            mover = None
+            deferred = []
+            if sync_mode and move_detection != MOVE_DETECTION_OFF:
+                mover = MoveDetector(dst_tree.iter_files(), move_detection, source_inodes=manifest is not None)
+
+            # 逐目录比对，不在内存中保留源目录列表
+            for rel_dir, files, subdirs in iter_tree(src_dir, lambda: self.stop_flag, on_error,
+                                                     exclude=(META_DIR,)):
+                if sync_mode and rel_dir:
+                    if not dst_tree.has_dir(rel_dir):
+                        plan.add(PLAN_CREATE_DIR, rel_dir)
+                    dst_tree.mark_dir(rel_dir)
+                for entry in files.values():
+                    rel_path = entry.rel_path
+                    if sync_mode:
+                        dst_tree.mark(rel_path)
+                    dst_entry = lookup(rel_path)
+                    if not self._needs_copy(entry, dst_entry):
+                        plan.unchanged += 1
+                    elif dst_entry is None and mover is not None and mover.is_candidate(entry):
+                        deferred.append(entry)
+                    else:
+                        plan.add(PLAN_COPY if dst_entry is None else PLAN_UPDATE, rel_path, entry.size, entry.mtime)
+        finally:
+            if manifest is not None:
+                manifest.close(clean=False)
+
+        if self.stop_flag:
+            self.logger.info("预演已停止")
+            return None
+
+        if sync_mode:
+            for rel_path in unreadable:
+                dst_tree.mark_dir(os.path.dirname(rel_path))
+            delete_entries, dirs_to_delete = self._deletion_targets(dst_tree, unreadable)
+            deleted = {e.rel_path for e in delete_entries}
+            for entry in deferred:
+                old_path = mover.match(entry, deleted, os.path.join(src_dir, entry.rel_path), dst_dir)
+                if old_path is not None:
+                    deleted.discard(old_path)
+                    plan.add(PLAN_MOVE, entry.rel_path, entry.size, entry.mtime, from_path=old_path)
                 else:
-                    action = "synced"
+                    plan.add(PLAN_COPY, entry.rel_path, entry.size, entry.mtime)
+            for entry in delete_entries:
+                if entry.rel_path in deleted:
+                    plan.add(PLAN_DELETE, entry.rel_path, entry.size, entry.mtime)
+            for rel_dir in dirs_to_delete:
+                plan.add(PLAN_DELETE_DIR, rel_dir)
 
-                processed_ops += 1
+        plan.unreadable = sorted(unreadable)
+        self.logger.info(f"预演完成: {plan.summary()}")
+        return plan
 
-                # 计算进度
-                percent = (processed_ops / total_ops) * 100
-                
-                # 限制回调频率
-                if total_ops <= 10 or processed_ops % 5 == 0 or size > 1024*1024*10 or processed_ops == total_ops:
-                    if progress_callback:
-                        msg = f"[{processed_ops}/{total_ops}] {action}: {rel_path}"
-                        progress_callback(percent, total_ops, msg)
+    def execute_plan(self, plan, progress_callback=None, workers=DEFAULT_COPY_WORKERS, use_manifest=True,
+                     delta_threshold=DELTA_THRESHOLD, resume_threshold=RESUME_THRESHOLD):
+        """
+        按原样执行保存的备份计划 (不重新扫描和比对)
+        progress_callback: function(current, total, message)
+        """
+        events = self.plan_generator(plan, workers=workers, use_manifest=use_manifest,
+                                     delta_threshold=delta_threshold, resume_threshold=resume_threshold)
+        self._dispatch_events(events, progress_callback)
 
-            except Exception as e:
-                self.logger.error(f"复制失败 {src_path}: {e}")
-
-        if not self.stop_flag:
-            duration = time.time() - start_time
-            summary = f"同步备份完成! 用时: {duration:.2f}s, 更新: {copied_files}, 创建目录: {created_dirs}, 删除文件: {deleted_files}, 删除目录: {deleted_dirs}"
-            if failed_deletes or failed_dir_deletes:
-                summary += f"\n警告: {len(failed_deletes)} 个文件删除失败, {len(failed_dir_deletes)} 个目录删除失败 (可能被其他程序占用)"
-                self.logger.warning(summary)
+    def plan_generator(self, plan, workers=DEFAULT_COPY_WORKERS, use_manifest=True,
+                       delta_threshold=DELTA_THRESHOLD, resume_threshold=RESUME_THRESHOLD):
+        """
+        执行备份计划，产出与 backup_generator 相同格式的事件
+        计划中的总数和字节数是确定的，进度从一开始就准确
+        """
+        self._begin_run()
+        if not os.path.exists(plan.src_dir):
+            msg = f"源目录不存在: {plan.src_dir}"
+            self.logger.error(msg)
+            yield {'type': 'error', 'action': 'scan_failed', 'rel_path': '', 'message': msg}
+            return
+
+        self.logger.info(f"开始执行备份计划: {plan.summary()}")
+        manifest = self._open_manifest(plan.dst_dir) if use_manifest else None
+        try:
+            if manifest is not None:
+                manifest.begin_run()
+            yield from self._execute_plan(plan, workers, manifest, delta_threshold, resume_threshold)
+        except GeneratorExit:
+            self.stop_flag = True
+            raise
+        finally:
+            if manifest is not None:
+                manifest.close()
+
+    def _execute_plan(self, plan, workers, manifest, delta_threshold, resume_threshold):
+        src_dir, dst_dir = plan.src_dir, plan.dst_dir
+        stats = BackupStats()
+        stats.total = len(plan.items)
+        stats.total_bytes = plan.totals()['transfer_bytes']
+        stats.scan_done = True
+        start_time = time.time()
+        copied_action = "updated" if plan.sync_mode else "copied"
+
+        delta, resumable = self._large_file_copiers(dst_dir, delta_threshold, resume_threshold)
+        created_dirs = set()
+        delete_files, delete_dirs = [], []
+
+        def ensure_parent(rel_path):
+            rel_dir = os.path.dirname(rel_path)
+            if rel_dir not in created_dirs:
+                os.makedirs(os.path.join(dst_dir, rel_dir), exist_ok=True)
+                created_dirs.add(rel_dir)
+
+        with ParallelCopier(workers=workers, stop_check=lambda: self.stop_flag, tracer=self.profiler) as copier:
+            for item in plan.ordered():
+                if self.stop_flag:
+                    break
+                yield from self._copy_events(copier.completed(), stats, manifest, copied_action, src_dir)
+                rel_path = item.rel_path
+
+                if item.action == PLAN_CREATE_DIR:
+                    yield self._create_dir_event(stats, dst_dir, rel_path, manifest)
+                    created_dirs.add(rel_path)
+                    continue
+                if item.action == PLAN_DELETE:
+                    delete_files.append(FileEntry(rel_path, item.size, item.mtime))
+                    continue
+                if item.action == PLAN_DELETE_DIR:
+                    delete_dirs.append(rel_path)
+                    continue
+
+                # 复制前重新读取源文件信息，清单记录的是实际复制的版本
+                src_path = os.path.join(src_dir, rel_path)
+                try:
+                    entry = FileEntry.from_stat(rel_path, os.stat(src_path))
+                    ensure_parent(rel_path)
+                except OSError as e:
+                    yield self._error_event(stats, 'copy_failed', rel_path, f"复制失败 {src_path}: {e}")
+                    continue
+
+                if item.action == PLAN_MOVE:
+                    event = self._move_file(dst_dir, item.from_path, entry, stats, manifest, delta)
+                    if event is not None:
+                        yield event
+                        continue
+                self._submit_copy(copier, entry, src_dir, dst_dir, item.action == PLAN_UPDATE,
+                                  delta, delta_threshold, resumable, resume_threshold)
+
+            yield from self._copy_events(copier.drain(), stats, manifest, copied_action, src_dir)
+
+        if not self.stop_flag and (delete_files or delete_dirs):
+            # 规划之后源目录中又出现的路径不再删除，其父目录也不能整体删除
+            keep = {p for p in [e.rel_path for e in delete_files] + delete_dirs
+                    if os.path.lexists(os.path.join(src_dir, p))}
+            keep_parents = set()
+            for rel_path in keep:
+                rel_path = os.path.dirname(rel_path)
+                while rel_path and rel_path not in keep_parents:
+                    keep_parents.add(rel_path)
+                    rel_path = os.path.dirname(rel_path)
+            for rel_path in sorted(keep):
+                yield self._delete_failed_event(stats, 'delete_skipped', rel_path,
+                                                f"源目录中已存在，跳过计划中的删除: {rel_path}")
+            files = [e for e in delete_files if not self._is_protected(e.rel_path, keep)]
+            dirs = [d for d in delete_dirs if d not in keep_parents and not self._is_protected(d, keep)]
+            # 删除操作由 _delete_targets 合并后重新计数
+            stats.total -= len(delete_files) + len(delete_dirs) - len(keep)
+            yield from self._delete_targets(dst_dir, files, dirs, stats, manifest, delta, delta_threshold)
+
+        yield self._done_event(stats, plan.sync_mode, time.time() - start_time)
+
+    def _apply_moves(self, deferred, mover, unreadable, dst_tree, src_dir, dst_dir,
+                     stats, manifest, copy_entry, delta=None):
+        """
+        把暂缓的新文件与将被删除的目标文件配对，配对成功时在目标目录内重命名，否则复制
+        """
+        deleted = {e.rel_path for e in dst_tree.unmarked_files()
+                   if not self._is_protected(e.rel_path, unreadable)}
+
+        for entry in deferred:
+            if self.stop_flag:
+                return
+            rel_path = entry.rel_path
+            old_path = mover.match(entry, deleted, os.path.join(src_dir, rel_path), dst_dir)
+            event = None
+            if old_path is not None:
+                event = self._move_file(dst_dir, old_path, entry, stats, manifest, delta)
+            if event is None:
+                yield from copy_entry(entry)
+                continue
+
+            deleted.discard(old_path)
+            # 原位置已移走，不再参与删除
+            dst_tree.mark(old_path)
+            yield event
+
+    def _move_file(self, dst_dir, old_path, entry, stats, manifest, delta=None):
+        """
+        在目标目录内把 old_path 重命名为 entry.rel_path
+        返回: moved 事件，失败时返回 None (调用方改为复制)
+        """
+        rel_path = entry.rel_path
+        try:
+            os.rename(os.path.join(dst_dir, old_path), os.path.join(dst_dir, rel_path))
+        except OSError as e:
+            self.logger.warning(f"移动文件失败 {old_path} -> {rel_path}: {e}")
+            return None
+        stats.moved += 1
+        if manifest is not None:
+            manifest.remove_file(old_path)
+            manifest.record_file(entry)
+        if delta is not None:
+            delta.discard(old_path)
+        self.logger.info(f"移动文件: {old_path} -> {rel_path}", category=CATEGORY_FILE)
+        event = self._progress_event(stats, 'moved', rel_path, entry.size)
+        event['from'] = old_path
+        return event
+
+    def _is_protected(self, rel_path, unreadable):
+        """
+        路径本身或其父目录在源目录中无法访问，目标目录中的对应内容不能删除或移走
+        """
+        while rel_path:
+            if rel_path in unreadable:
+                return True
+            rel_path = os.path.dirname(rel_path)
+        return False
+
+    def _create_dir_event(self, stats, dst_dir, rel_dir, manifest):
+        try:
+            os.makedirs(os.path.join(dst_dir, rel_dir), exist_ok=True)
+        except Exception as e:
+            self.logger.warning(f"创建目录失败 {rel_dir}: {e}")
+        else:
+            stats.created_dirs += 1
+            if manifest is not None:
+                manifest.record_dir(rel_dir)
+            self.logger.info(f"创建目录: {rel_dir}")
+        return self._progress_event(stats, 'created_dir', rel_dir)
+
+    def _deletion_targets(self, dst_tree, unreadable):
+        """
+        计算目标目录中需要删除的文件和目录 (目标目录树中未被源目录标记的部分)
+        返回: (文件 FileEntry 列表, 目录列表)
+        """
+        files_to_delete = [e for e in dst_tree.unmarked_files() if not self._is_protected(e.rel_path, unreadable)]
+        dirs_to_delete = [d for d in dst_tree.unmarked_dirs() if not self._is_protected(d, unreadable)]
+        return files_to_delete, dirs_to_delete
+
+    def _sync_deletions(self, dst_dir, dst_tree, unreadable, stats, manifest, delta=None, delta_threshold=None):
+        """
+        删除目标目录中源目录不存在的文件和目录
+        """
+        files_to_delete, dirs_to_delete = self._deletion_targets(dst_tree, unreadable)
+        self.logger.info(f"需删除文件 {len(files_to_delete)} 个, 需删除目录 {len(dirs_to_delete)} 个")
+        yield from self._delete_targets(dst_dir, files_to_delete, dirs_to_delete,
+                                        stats, manifest, delta, delta_threshold)
+
+    def _delete_targets(self, dst_dir, file_entries, dirs_to_delete, stats, manifest,
+                        delta=None, delta_threshold=None):
+        """
+        删除给定的目标文件 (FileEntry 列表) 和目录
+        位于待删除目录之下的文件和子目录合并到最上层目录中一次删除，互不包含的子树并行删除；
+        每个删除操作计入 stats.total，子树中删除失败的条目逐个报告
+        """
+        plan = DeletionPlan(file_entries, dirs_to_delete)
+        stats.total += len(plan)
+        if len(plan) < len(file_entries) + len(dirs_to_delete):
+            self.logger.info(f"删除计划: {len(plan.roots)} 个目录子树, {len(plan.files)} 个文件 "
+                             f"(合并前 {len(file_entries)} 个文件, {len(dirs_to_delete)} 个目录)")
+
+        def stop_check():
+            return self.stop_flag
+
+        def discard(entries):
+            if delta is not None:
+                for entry in entries:
+                    if entry.size >= delta_threshold:
+                        delta.discard(entry.rel_path)
+
+        tasks = [(rel_dir, None, remove_tree, os.path.join(dst_dir, rel_dir)) for rel_dir in plan.roots]
+        tasks.extend((None, chunk, remove_files, [os.path.join(dst_dir, e.rel_path) for e in chunk])
+                     for chunk in plan.file_chunks())
+        for rel_dir, chunk, result in self._run_deletions(tasks, stop_check):
+            if chunk is not None:
+                for entry, (_path, error_msg) in zip(chunk, result):
+                    rel_path = entry.rel_path
+                    if error_msg is None:
+                        stats.deleted_files += 1
+                        if manifest is not None:
+                            manifest.remove_file(rel_path)
+                        discard([entry])
+                        self.logger.info(f"删除文件: {rel_path}", category=CATEGORY_FILE)
+                        yield self._progress_event(stats, 'deleted', rel_path)
+                    else:
+                        stats.failed_deletes += 1
+                        yield self._delete_failed_event(stats, 'delete_failed', rel_path,
+                                                        f"删除文件失败 {rel_path}: {error_msg}")
+                continue
+
+            files, dirs, failures, stopped = result
+            stats.deleted_files += files
+            stats.deleted_dirs += dirs
+            if stopped:
+                continue
+            if not failures:
+                if manifest is not None:
+                    manifest.remove_tree(rel_dir)
+                discard(plan.nested.get(rel_dir, ()))
+                self.logger.info(f"删除目录: {rel_dir} ({files} 个文件)", category=CATEGORY_FILE)
+                event = self._progress_event(stats, 'deleted_dir', rel_dir)
+                event['files'] = files
+                yield event
+                continue
+            # 子树中的失败逐个报告 (不计入进度)，目录本身计为一个失败的操作
+            for path, error_msg in failures:
+                rel_path = os.path.relpath(path, dst_dir)
+                stats.failed_deletes += 1
+                message = f"删除失败 {rel_path}: {error_msg}"
+                self.logger.warning(message)
+                yield {'type': 'error', 'action': 'delete_failed', 'rel_path': rel_path, 'message': message}
+            stats.failed_dir_deletes += 1
+            yield self._delete_failed_event(stats, 'delete_dir_failed', rel_dir,
+                                            f"删除目录失败 {rel_dir}: {len(failures)} 项无法删除")
+
+    def _run_deletions(self, tasks, stop_check):
+        """
+        执行删除任务 [(rel_dir, chunk, func, path)]，多个任务时并行执行
+        按完成顺序产出 (rel_dir, chunk, 结果)
+        """
+        if len(tasks) <= 1:
+            # 归并比对和实时备份逐个删除，不必为单个任务创建线程
+            for rel_dir, chunk, func, path in tasks:
+                yield rel_dir, chunk, self._run_deletion(rel_dir, chunk, func, path, stop_check)
+            return
+        with ThreadPoolExecutor(max_workers=DELETE_WORKERS, thread_name_prefix="bakui-delete") as pool:
+            futures = {pool.submit(self._run_deletion, rel_dir, chunk, func, path, stop_check): (rel_dir, chunk)
+                       for rel_dir, chunk, func, path in tasks}
+            for future in as_completed(futures):
+                rel_dir, chunk = futures[future]
+                yield rel_dir, chunk, future.result()
+
+    def _run_deletion(self, rel_dir, chunk, func, path, stop_check):
+        if self.profiler is None:
+            return func(path, stop_check)
+        label = rel_dir if chunk is None else f"{chunk[0].rel_path} 等 {len(chunk)} 个文件"
+        with self.profiler.operation(label, cat='delete'):
+            return func(path, stop_check)
+
+    def _delete_failed_event(self, stats, action, rel_path, message):
+        stats.processed += 1
+        self.metrics.file_failed(stats, action)
+        self.logger.warning(message, category=CATEGORY_FILE)
+        self.logger.record(action, rel_path, error=message)
+        return {'type': 'error', 'action': action, 'rel_path': rel_path, 'message': message}
+
+    def _done_event(self, stats, sync_mode, duration):
+        summary = stats.to_dict()
+        if self.stop_flag:
+            self.logger.info("备份已停止")
+            return {'type': 'done', 'stopped': True, 'message': "备份已停止", 'summary': summary}
+
+        if not sync_mode:
+            if stats.total == 0:
+                msg = "目录为空，无需备份"
             else:
-                self.logger.info(summary)
-            
-            if progress_callback:
-                msg = f"同步备份完成 (更新 {copied_files}, 创建 {created_dirs} 目录, 删除 {deleted_files} 文件, {deleted_dirs} 目录)"
-                if failed_deletes or failed_dir_deletes:
-                    msg += f" - {len(failed_deletes) + len(failed_dir_deletes)} 项删除失败"
-                progress_callback(100, total_ops, msg)
+                self.logger.info(f"增量备份完成! 用时: {duration:.2f}s, 复制: {stats.copied}, 总计: {stats.total}")
+                msg = "增量备份完成"
+            return {'type': 'done', 'stopped': False, 'message': msg, 'summary': summary}
+
+        if stats.total == 0:
+            return {'type': 'done', 'stopped': False, 'message': "目录已同步，无需操作", 'summary': summary}
+
+        failed = stats.failed_deletes + stats.failed_dir_deletes
+        log_summary = f"同步备份完成! 用时: {duration:.2f}s, 更新: {stats.copied}, 移动: {stats.moved}, 创建目录: {stats.created_dirs}, 删除文件: {stats.deleted_files}, 删除目录: {stats.deleted_dirs}"
+        if failed:
+            log_summary += f"\n警告: {stats.failed_deletes} 个文件删除失败, {stats.failed_dir_deletes} 个目录删除失败 (可能被其他程序占用)"
+            self.logger.warning(log_summary)
+        else:
+            self.logger.info(log_summary)
 
+        msg = f"同步备份完成 (更新 {stats.copied}, 移动 {stats.moved}, 创建 {stats.created_dirs} 目录, 删除 {stats.deleted_files} 文件, {stats.deleted_dirs} 目录)"
+        if failed:
+            msg += f" - {failed} 项删除失败"
+        return {'type': 'done', 'stopped': False, 'message': msg, 'summary': summary}
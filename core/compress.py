@@ -0,0 +1,258 @@
+import bz2
+import gzip
+import lzma
+import multiprocessing
+import os
+import sqlite3
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from core.copier import CopyStopped
+from core.manifest import META_DIR
+
+COMPRESS_INDEX_NAME = 'compress.db'
+# 压缩算法: zlib (gzip 格式)、bz2、lzma (xz 格式)，均为标准库实现，备份文件可用常规工具解压
+COMPRESS_GZIP = 'gzip'
+COMPRESS_BZ2 = 'bz2'
+COMPRESS_XZ = 'xz'
+# 未压缩保存 (不可压缩的数据)
+METHOD_RAW = 'raw'
+COMPRESS_SUFFIXES = {COMPRESS_GZIP: '.gz', COMPRESS_BZ2: '.bz2', COMPRESS_XZ: '.xz'}
+DEFAULT_LEVELS = {COMPRESS_GZIP: 6, COMPRESS_BZ2: 9, COMPRESS_XZ: 6}
+# 按块并行压缩，每块压缩为一个完整的流，多个流首尾相连仍是合法的 .gz/.bz2/.xz 文件
+COMPRESS_CHUNK_SIZE = 4 * 1024 * 1024
+# 小于该大小的文件不压缩 (压缩头的开销大于收益)
+MIN_COMPRESS_SIZE = 1024
+# 采样判断是否可压缩: 在文件开头、中间、末尾各取一块，快速压缩后比例高于阈值视为不可压缩
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_RATIO = 0.9
+# 已压缩的格式直接跳过采样
+INCOMPRESSIBLE_EXTENSIONS = frozenset((
+    '.gz', '.tgz', '.bz2', '.xz', '.zst', '.lz4', '.7z', '.zip', '.rar', '.jar', '.apk',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.mp3', '.aac', '.ogg', '.flac',
+    '.mp4', '.mkv', '.avi', '.mov', '.webm', '.docx', '.xlsx', '.pptx', '.pdf',
+))
+# 写入中的文件后缀，完成后原子重命名
+PARTIAL_SUFFIX = '.bakui-partial'
+# 批量提交的记录条数
+COMMIT_INTERVAL = 500
+
+
+def compress_chunk(algorithm, level, data):
+    """
+    在工作进程中执行: 把一块数据压缩为完整的压缩流
+    """
+    if algorithm == COMPRESS_GZIP:
+        # mtime=0 使相同内容的压缩结果一致
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if algorithm == COMPRESS_BZ2:
+        return bz2.compress(data, compresslevel=level)
+    if algorithm == COMPRESS_XZ:
+        return lzma.compress(data, preset=level)
+    raise ValueError(f"未知的压缩算法: {algorithm}")
+
+
+def is_compressible(path, size):
+    """
+    采样判断文件是否值得压缩
+    """
+    if size < MIN_COMPRESS_SIZE:
+        return False
+    if os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return False
+    offsets = sorted({0, max(0, size // 2 - SAMPLE_SIZE // 2), max(0, size - SAMPLE_SIZE)})
+    raw = packed = 0
+    with open(path, 'rb') as f:
+        for offset in offsets:
+            f.seek(offset)
+            sample = f.read(SAMPLE_SIZE)
+            raw += len(sample)
+            packed += len(zlib.compress(sample, 1))
+    return raw > 0 and packed < raw * SAMPLE_RATIO
+
+
+def stored_name(rel_path, method):
+    """
+    备份文件在目标目录中的相对路径
+    """
+    return rel_path if method == METHOD_RAW else rel_path + COMPRESS_SUFFIXES[method]
+
+
+def decompress_file(stored_path, out_path, method):
+    """
+    把备份文件还原为原始内容
+    """
+    if method == METHOD_RAW:
+        opener = open
+    else:
+        opener = {COMPRESS_GZIP: gzip.open, COMPRESS_BZ2: bz2.open, COMPRESS_XZ: lzma.open}[method]
+    with opener(stored_path, 'rb') as src, open(out_path, 'wb') as dst:
+        while True:
+            chunk = src.read(COMPRESS_CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+
+
+class CompressedFile:
+    """
+    压缩索引中的记录: size/mtime 为原始文件的值，可直接与源文件的 FileEntry 比对
+    """
+    __slots__ = ('rel_path', 'size', 'mtime', 'method', 'stored_size')
+
+    def __init__(self, rel_path, size, mtime, method, stored_size):
+        self.rel_path = rel_path
+        self.size = size
+        self.mtime = mtime
+        self.method = method
+        self.stored_size = stored_size
+
+
+class CompressIndex:
+    """
+    压缩备份的元数据 (SQLite，保存在目标目录的 .bakui/compress.db)
+    记录每个文件的原始大小/修改时间和保存方式，增量比对不读取压缩后的文件。
+    只在当前备份线程中使用。
+    """
+
+    def __init__(self, dst_dir):
+        self.path = os.path.join(dst_dir, META_DIR, COMPRESS_INDEX_NAME)
+        self.conn = None
+        self._pending = 0
+
+    def open(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    method TEXT NOT NULL,
+                    stored_size INTEGER NOT NULL
+                )""")
+            self.conn.commit()
+            return True
+        except (OSError, sqlite3.Error):
+            self.conn = None
+            return False
+
+    def get(self, rel_path):
+        row = self.conn.execute("SELECT size, mtime, method, stored_size FROM files WHERE path = ?",
+                                (rel_path.replace(os.sep, '/'),)).fetchone()
+        return CompressedFile(rel_path, *row) if row is not None else None
+
+    def put(self, entry, method, stored_size):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime, method, stored_size) VALUES (?, ?, ?, ?, ?)",
+            (entry.rel_path.replace(os.sep, '/'), entry.size, entry.mtime, method, stored_size))
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self.conn.commit()
+            self._pending = 0
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+
+class ParallelCompressor:
+    """
+    多进程压缩
+    复制线程逐块读取文件，压缩任务分发到进程池，按顺序写回；每个文件的在途块数受限。
+    进程池不可用时 (受限环境) 回退到线程池 (标准库压缩在压缩时释放 GIL)。
+    """
+
+    def __init__(self, algorithm=COMPRESS_GZIP, level=None, workers=None, use_processes=True,
+                 chunk_size=COMPRESS_CHUNK_SIZE):
+        if algorithm not in COMPRESS_SUFFIXES:
+            raise ValueError(f"未知的压缩算法: {algorithm}")
+        self.algorithm = algorithm
+        self.level = DEFAULT_LEVELS[algorithm] if level is None else level
+        self.workers = workers or os.cpu_count() or 2
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._executor = None
+        if use_processes:
+            methods = multiprocessing.get_all_start_methods()
+            method = 'forkserver' if 'forkserver' in methods else 'spawn'
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context(method))
+            except (OSError, NotImplementedError, ImportError, ValueError):
+                self._executor = None
+        if self._executor is None:
+            self._executor = self._thread_pool()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+        return False
+
+    def _thread_pool(self):
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bakui-compress")
+
+    def _submit(self, data):
+        executor = self._executor
+        try:
+            return executor.submit(compress_chunk, self.algorithm, self.level, data)
+        except (BrokenProcessPool, RuntimeError):
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = self._thread_pool()
+                    executor.shutdown(wait=False)
+            return self._executor.submit(compress_chunk, self.algorithm, self.level, data)
+
+    def _result(self, future, data):
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            # 子进程异常退出，在当前线程中压缩这一块
+            return compress_chunk(self.algorithm, self.level, data)
+
+    def compress_file(self, src_path, dst_path, stop_check=None):
+        """
+        压缩文件到 dst_path (在复制线程中执行)，先写入临时文件再原子重命名
+        返回: 写入的字节数
+        """
+        tmp_path = dst_path + PARTIAL_SUFFIX
+        written = 0
+        pending = deque()
+        in_flight = max(2, self.workers // 2)
+        try:
+            with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                while True:
+                    if stop_check and stop_check():
+                        raise CopyStopped()
+                    data = src.read(self.chunk_size)
+                    if data:
+                        pending.append((self._submit(data), data))
+                    # 保持在途块数，按提交顺序写回
+                    while pending and (len(pending) >= in_flight or not data):
+                        future, chunk = pending.popleft()
+                        out = self._result(future, chunk)
+                        dst.write(out)
+                        written += len(out)
+                    if not data:
+                        break
+            os.replace(tmp_path, dst_path)
+        except BaseException:
+            for future, _ in pending:
+                future.cancel()
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return written
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
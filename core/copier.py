@@ -0,0 +1,132 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 默认并行复制线程数
+DEFAULT_COPY_WORKERS = 4
+# 并行线程数上限
+MAX_COPY_WORKERS = 32
+# 超过该大小的文件走独立的大文件通道，避免占满小文件线程
+LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+
+
+class CopyStopped(Exception):
+    """
+    任务在执行过程中检测到停止标志而中止
+    """
+
+
+class CopyResult:
+    """
+    单个复制任务的执行结果
+    value: 任务函数的返回值
+    error: 任务抛出的异常 (成功时为 None)
+    stopped: 任务因停止标志未执行
+    """
+    __slots__ = ('tag', 'size', 'value', 'error', 'stopped')
+
+    def __init__(self, tag, size, value=None, error=None, stopped=False):
+        self.tag = tag
+        self.size = size
+        self.value = value
+        self.error = error
+        self.stopped = stopped
+
+
+class ParallelCopier:
+    """
+    并行复制引擎
+    - 小文件通道: workers 个线程，处理绝大多数文件
+    - 大文件通道: 独立线程池，大文件不会阻塞小文件队列
+    提交数量受信号量限制，内存占用与文件总数无关；
+    结果通过队列回传，由调用线程统一处理进度回调和日志。
+    tracer: 性能分析时的 core.profiler.Profiler，每个任务记录为一个文件操作 span (tag 为 FileEntry 或路径)
+    """
+
+    def __init__(self, workers=DEFAULT_COPY_WORKERS, large_workers=None,
+                 large_file_threshold=LARGE_FILE_THRESHOLD, stop_check=None, tracer=None):
+        self.workers = max(1, min(int(workers), MAX_COPY_WORKERS))
+        self.large_workers = max(1, int(large_workers) if large_workers else self.workers // 4)
+        self.large_file_threshold = large_file_threshold
+        self.stop_check = stop_check or (lambda: False)
+        self.tracer = tracer
+
+        self._small_pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bakui-copy")
+        self._large_pool = ThreadPoolExecutor(max_workers=self.large_workers, thread_name_prefix="bakui-copy-large")
+        # 每条通道的在途任务上限
+        self._small_slots = threading.Semaphore(self.workers * 4)
+        self._large_slots = threading.Semaphore(self.large_workers * 2)
+        self._results = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+        return False
+
+    def submit(self, func, *args, size=0, tag=None):
+        """
+        提交任务，通道已满时阻塞直到有空位
+        """
+        if size >= self.large_file_threshold:
+            pool, slots = self._large_pool, self._large_slots
+        else:
+            pool, slots = self._small_pool, self._small_slots
+
+        slots.acquire()
+        with self._lock:
+            self._pending += 1
+        pool.submit(self._run, slots, func, args, size, tag)
+
+    def _run(self, slots, func, args, size, tag):
+        try:
+            if self.stop_check():
+                result = CopyResult(tag, size, stopped=True)
+            elif self.tracer is not None:
+                with self.tracer.operation(tag, size):
+                    result = CopyResult(tag, size, value=func(*args))
+            else:
+                result = CopyResult(tag, size, value=func(*args))
+        except CopyStopped:
+            result = CopyResult(tag, size, stopped=True)
+        except Exception as e:
+            result = CopyResult(tag, size, error=e)
+        finally:
+            slots.release()
+        self._results.put(result)
+
+    def _take(self, block):
+        try:
+            result = self._results.get(block=block)
+        except queue.Empty:
+            return None
+        with self._lock:
+            self._pending -= 1
+        return result
+
+    def completed(self):
+        """
+        取出已完成的结果 (不阻塞)
+        """
+        while True:
+            result = self._take(block=False)
+            if result is None:
+                return
+            yield result
+
+    def drain(self):
+        """
+        等待并取出所有剩余结果
+        """
+        while True:
+            with self._lock:
+                if self._pending == 0:
+                    return
+            yield self._take(block=True)
+
+    def shutdown(self):
+        self._small_pool.shutdown(wait=True)
+        self._large_pool.shutdown(wait=True)
@@ -0,0 +1,219 @@
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+
+from core.hashing import hash_file, HASH_CHUNK_SIZE
+from core.snapshot import SNAPSHOT_FORMAT
+
+# 内容对象目录: objects/<哈希前 2 位>/<其余部分>
+OBJECTS_DIR = 'objects'
+# 写入中的临时对象 (完成后原子重命名为对象文件)
+OBJECTS_TMP_DIR = 'tmp'
+# 每次备份一个索引文件 (以完成时间命名)，记录 路径 -> 哈希
+INDEX_DIR = 'index'
+INDEX_SUFFIX = '.jsonl.gz'
+INDEX_VERSION = 1
+
+
+def _to_key(rel_path):
+    # 索引中统一使用 '/' 分隔，跨平台恢复
+    return rel_path.replace(os.sep, '/')
+
+
+def _from_key(key):
+    return key.replace('/', os.sep)
+
+
+class IndexWriter:
+    """
+    单次备份的索引文件 (gzip 压缩的 JSON 行)
+    第一行为头部 {'version', 'src_dir', 'created_at'}，之后每行一个目录 {'path', 'dir': True}
+    或文件 {'path', 'hash', 'size', 'mtime', 'mode'}。
+    写入临时文件，commit 后才成为可恢复的备份。只在当前备份线程中使用。
+    """
+
+    def __init__(self, store, src_dir):
+        self.store = store
+        self.files = 0
+        # 提交后的索引名称
+        self.name = None
+        self.tmp_path = os.path.join(store.index_dir, f"{time.strftime(SNAPSHOT_FORMAT)}-{os.getpid()}.tmp")
+        os.makedirs(store.index_dir, exist_ok=True)
+        self._f = gzip.open(self.tmp_path, 'wt', encoding='utf-8')
+        self._write({'version': INDEX_VERSION, 'src_dir': src_dir, 'created_at': time.time()})
+
+    def _write(self, record):
+        self._f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def add_dir(self, rel_dir):
+        self._write({'path': _to_key(rel_dir), 'dir': True})
+
+    def add_file(self, entry, file_hash):
+        self.files += 1
+        self._write({'path': _to_key(entry.rel_path), 'hash': file_hash, 'size': entry.size,
+                     'mtime': entry.mtime, 'mode': entry.mode & 0o7777})
+
+    def commit(self):
+        """
+        完成索引并以完成时间命名，返回索引名称
+        """
+        self._f.close()
+        base = time.strftime(SNAPSHOT_FORMAT)
+        name, seq = base, 1
+        existing = set(self.store.runs())
+        while name in existing:
+            seq += 1
+            name = f"{base}_{seq}"
+        os.replace(self.tmp_path, self.store.index_path(name))
+        self.name = name
+        return name
+
+    def abort(self):
+        if not self._f.closed:
+            self._f.close()
+        try:
+            os.unlink(self.tmp_path)
+        except OSError:
+            pass
+
+
+class DedupStore:
+    """
+    内容寻址的去重备份存储
+    文件内容以内容哈希 (blake2b-160，与内容比对模式相同) 为名只保存一份，
+    相同内容的文件 (不论位于哪个目录、哪次备份) 只写入一次；每次备份写入一个 路径 -> 哈希 的索引，
+    恢复时按索引还原目录树。对象文件写入后不再修改，中断的备份留下的对象在下次备份时直接复用。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, OBJECTS_DIR)
+        self.tmp_dir = os.path.join(self.objects_dir, OBJECTS_TMP_DIR)
+        self.index_dir = os.path.join(root, INDEX_DIR)
+        # 已确认存在的对象 (复制线程共享)
+        self._known = set()
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._seq = itertools.count()
+
+    def object_path(self, file_hash):
+        return os.path.join(self.objects_dir, file_hash[:2], file_hash[2:])
+
+    def has(self, file_hash):
+        with self._lock:
+            if file_hash in self._known:
+                return True
+        if os.path.isfile(self.object_path(file_hash)):
+            with self._lock:
+                self._known.add(file_hash)
+            return True
+        return False
+
+    def store_file(self, src_path, file_hash=None):
+        """
+        把文件内容写入存储 (在复制线程中执行)，内容已存在时不写入
+        file_hash: 已知的源文件哈希 (来自哈希缓存)，None 时先读取计算
+        写入时重新计算哈希，源文件在两次读取之间变化时按实际写入的内容命名
+        返回: (哈希, 写入字节数)
+        """
+        if file_hash is None:
+            file_hash = hash_file(src_path)
+        if self.has(file_hash):
+            return file_hash, 0
+
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(self.tmp_dir, f"{os.getpid()}-{threading.get_ident()}-{next(self._seq)}")
+        h = hashlib.blake2b(digest_size=20)
+        written = 0
+        try:
+            with open(src_path, 'rb', buffering=0) as src, open(tmp_path, 'wb') as dst:
+                while True:
+                    chunk = src.read(HASH_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    dst.write(chunk)
+                    written += len(chunk)
+            file_hash = h.hexdigest()
+            obj_path = self.object_path(file_hash)
+            os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+            # 检查和重命名在同一把锁内: 其他线程同时写入了相同内容时只有一个计为写入
+            with self._publish_lock:
+                if self.has(file_hash):
+                    os.unlink(tmp_path)
+                    return file_hash, 0
+                os.replace(tmp_path, obj_path)
+                with self._lock:
+                    self._known.add(file_hash)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return file_hash, written
+
+    def clean_tmp(self):
+        """
+        删除上次中断时遗留的临时对象和未完成的索引
+        """
+        for dir_path, suffix in ((self.tmp_dir, ''), (self.index_dir, '.tmp')):
+            try:
+                names = os.listdir(dir_path)
+            except FileNotFoundError:
+                continue
+            for name in names:
+                if not name.endswith(suffix):
+                    continue
+                try:
+                    os.unlink(os.path.join(dir_path, name))
+                except OSError:
+                    pass
+
+    def index_path(self, name):
+        return os.path.join(self.index_dir, name + INDEX_SUFFIX)
+
+    def runs(self):
+        """
+        已完成的备份 (索引名称，从旧到新)
+        """
+        try:
+            names = os.listdir(self.index_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(n[:-len(INDEX_SUFFIX)] for n in names if n.endswith(INDEX_SUFFIX))
+
+    def latest_run(self):
+        runs = self.runs()
+        return runs[-1] if runs else None
+
+    def begin_index(self, src_dir):
+        return IndexWriter(self, src_dir)
+
+    def read_index(self, name):
+        """
+        读取索引
+        返回: (头部, 记录迭代器)，记录的 'path' 已转换为本地分隔符
+        """
+        f = gzip.open(self.index_path(name), 'rt', encoding='utf-8')
+        try:
+            header = json.loads(f.readline())
+        except (OSError, ValueError):
+            f.close()
+            raise
+        if header.get('version') != INDEX_VERSION:
+            f.close()
+            raise ValueError(f"不支持的索引版本: {header.get('version')}")
+
+        def records():
+            with f:
+                for line in f:
+                    record = json.loads(line)
+                    record['path'] = _from_key(record['path'])
+                    yield record
+
+        return header, records()
@@ -0,0 +1,160 @@
+import os
+import stat
+import time
+
+# 并行删除的线程数 (不同子树之间互不依赖)
+DELETE_WORKERS = 4
+# 去掉只读属性后仍无法删除时 (Windows 上文件被占用) 的重试次数与间隔
+DELETE_RETRIES = 3
+DELETE_RETRY_DELAY = 0.5
+# 散落文件每个删除任务包含的数量
+FILE_CHUNK_SIZE = 256
+
+
+class DeletionPlan:
+    """
+    把待删除的文件和目录合并为最少的删除操作:
+    位于待删除目录之下的文件和子目录不再单独删除，只删除最上层的目录子树。
+    roots: 需要整体删除的最上层目录
+    files: 不在这些目录之下、需要单独删除的文件 (FileEntry)
+    nested: {最上层目录: [其下的 FileEntry]}，删除后用于清理对应的旁路数据
+    """
+
+    def __init__(self, file_entries, dirs):
+        dir_set = set(dirs)
+        self.roots = sorted(d for d in dir_set if self._root_of(d, dir_set) is None)
+        self.files = []
+        self.nested = {}
+        for entry in file_entries:
+            root = self._root_of(entry.rel_path, dir_set)
+            if root is None:
+                self.files.append(entry)
+            else:
+                self.nested.setdefault(root, []).append(entry)
+        self.files.sort(key=lambda e: e.rel_path)
+
+    @staticmethod
+    def _root_of(rel_path, dir_set):
+        # 最上层的待删除祖先目录，没有时返回 None
+        root = None
+        parent = os.path.dirname(rel_path)
+        while parent:
+            if parent in dir_set:
+                root = parent
+            parent = os.path.dirname(parent)
+        return root
+
+    def __len__(self):
+        return len(self.roots) + len(self.files)
+
+    def file_chunks(self, size=FILE_CHUNK_SIZE):
+        for i in range(0, len(self.files), size):
+            yield self.files[i:i + size]
+
+
+def _make_writable(path):
+    # 去掉只读属性 (Windows)，并确保所在目录可写可进入 (删除条目需要父目录的写权限)
+    for target in (path, os.path.dirname(path)):
+        try:
+            mode = os.lstat(target).st_mode
+            if not stat.S_ISLNK(mode):
+                os.chmod(target, stat.S_IMODE(mode) | stat.S_IRWXU)
+        except OSError:
+            pass
+
+
+def _remove(func, path):
+    """
+    删除单个条目，权限错误时去掉只读属性后重试
+    返回: None 表示成功 (条目已不存在也视为成功)，否则为错误信息
+    """
+    error = None
+    for attempt in range(DELETE_RETRIES + 1):
+        try:
+            func(path)
+            return None
+        except FileNotFoundError:
+            return None
+        except PermissionError as e:
+            error = e
+            if attempt == 0:
+                _make_writable(path)
+            elif attempt < DELETE_RETRIES:
+                # 文件可能正在被其他程序释放
+                time.sleep(DELETE_RETRY_DELAY)
+        except OSError as e:
+            return str(e)
+    return f"权限拒绝 (可能被其他程序占用): {error}"
+
+
+def _list_dir(path):
+    try:
+        with os.scandir(path) as it:
+            return list(it)
+    except PermissionError:
+        _make_writable(path)
+        with os.scandir(path) as it:
+            return list(it)
+
+
+def remove_tree(path, stop_check=None):
+    """
+    单次遍历删除目录子树: 自底向上删除文件和目录，只对删除失败的条目修改权限后重试
+    (不再先遍历整棵树修改权限再 rmtree)。
+    失败的条目不影响其他条目，包含失败条目的目录保留。
+    返回: (删除的文件数, 删除的目录数, [(失败路径, 错误信息)], 是否被停止)
+    """
+    if os.path.islink(path):
+        # 不进入符号链接指向的目录
+        error = _remove(os.unlink, path)
+        return 0, 0, ([] if error is None else [(path, error)]), False
+    files, dirs, failures = 0, 0, []
+    # (路径, 是否已列出子条目, 列出时的失败数)
+    stack = [(path, False, 0)]
+    while stack:
+        current, listed, failed_before = stack.pop()
+        if listed:
+            if len(failures) == failed_before:
+                error = _remove(os.rmdir, current)
+                if error is None:
+                    dirs += 1
+                else:
+                    failures.append((current, error))
+            continue
+        if stop_check and stop_check():
+            return files, dirs, failures, True
+        try:
+            entries = _list_dir(current)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            failures.append((current, str(e)))
+            continue
+        stack.append((current, True, len(failures)))
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                is_dir = False
+            if is_dir:
+                stack.append((entry.path, False, 0))
+                continue
+            error = _remove(os.unlink, entry.path)
+            if error is None:
+                files += 1
+            else:
+                failures.append((entry.path, error))
+    return files, dirs, failures, False
+
+
+def remove_files(paths, stop_check=None):
+    """
+    删除一组文件
+    返回: [(路径, 错误信息或 None)]，被停止时只包含已处理的文件
+    """
+    results = []
+    for path in paths:
+        if stop_check and stop_check():
+            break
+        results.append((path, _remove(os.unlink, path)))
+    return results
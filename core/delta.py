@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import shutil
+
+from core.copier import CopyStopped
+from core.manifest import META_DIR
+
+# 超过该大小的已存在文件使用块级差异更新
+DELTA_THRESHOLD = 64 * 1024 * 1024
+DELTA_BLOCK_SIZE = 1024 * 1024
+# 没有缓存的校验和时需要读取目标文件比对；变化比例超过该值后不再读取目标文件，剩余部分直接覆盖写入
+DELTA_MAX_RATIO = 0.5
+# 至少比对这么多块后才判断变化比例
+DELTA_MIN_SAMPLE = 16
+
+BLOCKS_DIR = 'blocks'
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class DeltaCopier:
+    """
+    块级差异复制 (原地修改/追加写入的大文件)
+    按固定块比较源文件与目标文件，只重写发生变化的块。
+    目标文件每块的校验和缓存在 <dst>/.bakui/blocks/ 下的旁路文件中，
+    缓存与目标文件的 大小/修改时间 一致时无需读取目标文件。
+    """
+
+    def __init__(self, dst_root, block_size=DELTA_BLOCK_SIZE, max_ratio=DELTA_MAX_RATIO):
+        self.dst_root = dst_root
+        self.block_size = block_size
+        self.max_ratio = max_ratio
+        self.blocks_dir = os.path.join(dst_root, META_DIR, BLOCKS_DIR)
+
+    def sidecar_path(self, rel_path):
+        key = rel_path.replace(os.sep, '/').encode('utf-8')
+        return os.path.join(self.blocks_dir, hashlib.sha1(key).hexdigest() + '.json')
+
+    def _load_sums(self, rel_path, dst_st):
+        try:
+            with open(self.sidecar_path(rel_path), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (data.get('size') != dst_st.st_size or data.get('mtime') != dst_st.st_mtime
+                or data.get('block_size') != self.block_size):
+            return None
+        return data.get('sums')
+
+    def _save_sums(self, rel_path, dst_path, sums):
+        st = os.stat(dst_path)
+        os.makedirs(self.blocks_dir, exist_ok=True)
+        with open(self.sidecar_path(rel_path), 'w', encoding='utf-8') as f:
+            json.dump({'size': st.st_size, 'mtime': st.st_mtime,
+                       'block_size': self.block_size, 'sums': sums}, f)
+
+    def discard(self, rel_path):
+        """
+        删除文件对应的校验和缓存 (文件被删除或移动时调用)
+        """
+        try:
+            os.remove(self.sidecar_path(rel_path))
+        except OSError:
+            pass
+
+    def copy(self, src_path, dst_path, rel_path, stop_check=None):
+        """
+        把 src_path 的变化写入已存在的 dst_path
+        返回: 实际写入的字节数
+        中途停止或出错时抛出异常，并恢复目标文件原来的访问/修改时间:
+        原地写入会把修改时间更新为当前时间而大小不变，不恢复的话下次备份会按 大小/修改时间 跳过写了一半的文件
+        """
+        dst_st = os.stat(dst_path)
+        sums = self._load_sums(rel_path, dst_st)
+        # 先让缓存失效，避免中途中断后缓存与文件内容不一致
+        self.discard(rel_path)
+        try:
+            written, new_sums = self._write_changes(src_path, dst_path, sums, stop_check)
+        except BaseException:
+            try:
+                os.utime(dst_path, ns=(dst_st.st_atime_ns, dst_st.st_mtime_ns))
+            except OSError:
+                pass
+            raise
+
+        shutil.copystat(src_path, dst_path)
+        self._save_sums(rel_path, dst_path, new_sums)
+        return written
+
+    def _write_changes(self, src_path, dst_path, sums, stop_check):
+        """
+        原地重写变化的块
+        返回: (写入的字节数, 新的块校验和)
+        """
+        # 没有缓存时需读取目标文件比对
+        compare_dst = sums is None
+        new_sums = []
+        written = 0
+        changed = 0
+
+        with open(src_path, 'rb') as fsrc, open(dst_path, 'r+b') as fdst:
+            index = 0
+            while True:
+                if stop_check and stop_check():
+                    raise CopyStopped()
+                block = fsrc.read(self.block_size)
+                if not block:
+                    break
+                offset = index * self.block_size
+                digest = _digest(block)
+
+                if sums is not None:
+                    old = sums[index] if index < len(sums) else None
+                elif compare_dst:
+                    fdst.seek(offset)
+                    old_block = fdst.read(len(block))
+                    old = _digest(old_block) if len(old_block) == len(block) else None
+                else:
+                    old = None
+
+                if digest != old:
+                    fdst.seek(offset)
+                    fdst.write(block)
+                    written += len(block)
+                    changed += 1
+                new_sums.append(digest)
+                index += 1
+
+                # 差异比例过高，继续读取目标文件已无意义，剩余部分按完整复制处理
+                if compare_dst and index >= DELTA_MIN_SAMPLE and changed / index > self.max_ratio:
+                    compare_dst = False
+
+            fdst.truncate(fsrc.tell())
+        return written, new_sums
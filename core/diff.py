@@ -0,0 +1,93 @@
+import os
+
+from core.scanner import scan_dir
+
+DIFF_ENGINE_TREE = 'tree'
+DIFF_ENGINE_MERGE = 'merge'
+
+# merge_walk 产出的记录类型
+DIFF_DIR = 'dir'
+DIFF_FILE = 'file'
+DIFF_DELETE = 'delete'
+DIFF_DELETE_DIR = 'delete_dir'
+
+
+def _key(name):
+    # Windows 上文件名不区分大小写，按 normcase 配对，避免把同一文件当成 新增 + 删除
+    return os.path.normcase(name)
+
+
+def merge_walk(src_root, dst_root, stop_check=None, on_error=None, exclude=()):
+    """
+    逐目录按名称排序归并源目录和目标目录 (先序)，边遍历边产出比对结果:
+      (DIFF_DIR, rel_dir, None, None)          源目录中的子目录 (不含根目录)
+      (DIFF_FILE, rel_path, src_entry, dst_entry)  源文件，dst_entry 为目标中的同名文件或 None
+      (DIFF_DELETE, rel_path, None, dst_entry)  只存在于目标中的文件
+      (DIFF_DELETE_DIR, rel_dir, None, None)   只存在于目标中的目录 (整个子树，不再进入)
+    同一目录中删除先于新增产出 (同名的文件与目录互相替换时需要先删除)。
+    内存只与目录深度和单个目录的条目数有关，与文件总数无关。
+    源目录中无法访问的文件或目录不会产生对应的删除。
+    exclude: 两侧根目录下需要忽略的名称
+    """
+    unreadable = set()
+
+    def src_error(path, e):
+        unreadable.add(_key(os.path.basename(path)))
+        if on_error:
+            on_error(path, e)
+
+    # (rel_dir, 目标中是否存在该目录)
+    stack = [('', True)]
+    while stack:
+        if stop_check and stop_check():
+            return
+        rel_dir, dst_exists = stack.pop()
+        unreadable.clear()
+        src_files, src_subdirs = scan_dir(os.path.join(src_root, rel_dir) if rel_dir else src_root,
+                                          rel_dir, src_error)
+        if src_files is None:
+            # 源目录在遍历过程中消失或无法读取，不能据此删除目标中的内容
+            continue
+        dst_files, dst_subdirs = {}, []
+        if dst_exists:
+            dst_files, dst_subdirs = scan_dir(os.path.join(dst_root, rel_dir) if rel_dir else dst_root,
+                                              rel_dir, on_error)
+            if dst_files is None:
+                dst_files, dst_subdirs = {}, []
+        if not rel_dir and exclude:
+            for name in exclude:
+                src_files.pop(name, None)
+                dst_files.pop(name, None)
+            src_subdirs = [d for d in src_subdirs if d not in exclude]
+            dst_subdirs = [d for d in dst_subdirs if d not in exclude]
+
+        src_file_keys = {_key(name): name for name in src_files}
+        src_dir_keys = {_key(name) for name in src_subdirs}
+        dst_dir_keys = {_key(name) for name in dst_subdirs}
+
+        # 1. 只存在于目标中的文件和目录
+        for name in sorted(dst_files, key=_key):
+            key = _key(name)
+            if key not in src_file_keys and key not in unreadable:
+                yield DIFF_DELETE, dst_files[name].rel_path, None, dst_files[name]
+        for name in sorted(dst_subdirs, key=_key):
+            key = _key(name)
+            if key not in src_dir_keys and key not in unreadable:
+                yield DIFF_DELETE_DIR, name if not rel_dir else rel_dir + os.sep + name, None, None
+
+        # 2. 源文件与目标中的同名文件配对
+        dst_by_key = {_key(name): entry for name, entry in dst_files.items()}
+        for name in sorted(src_files, key=_key):
+            yield DIFF_FILE, src_files[name].rel_path, src_files[name], dst_by_key.get(_key(name))
+
+        # 3. 子目录按名称顺序继续遍历
+        children = []
+        for name in sorted(src_subdirs, key=_key):
+            child = name if not rel_dir else rel_dir + os.sep + name
+            children.append((child, _key(name) in dst_dir_keys))
+        for child, exists in children:
+            if stop_check and stop_check():
+                return
+            yield DIFF_DIR, child, None, None
+        # 逆序入栈以保持名称顺序
+        stack.extend(reversed(children))
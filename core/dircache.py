@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import stat
+import time
+
+from core.manifest import META_DIR
+from core.scanner import FileEntry, scan_dir
+
+DIR_CACHE_NAME = 'dirs.db'
+# 超过该时间强制全量扫描一次源目录，限制跳过目录带来的滞后
+DIR_FULL_SCAN_INTERVAL = 7 * 24 * 3600
+# 修改时间距扫描开始过近的目录下次仍要重新扫描: 同一时间精度内的后续修改无法通过修改时间发现
+RACY_WINDOW = 2.0
+# 记录中表示"下次必须重新扫描"的修改时间
+UNTRUSTED_MTIME = -1.0
+
+
+def _to_key(rel_path):
+    return rel_path.replace(os.sep, '/')
+
+
+class DirCache:
+    """
+    源目录状态缓存 (SQLite，保存在目标目录的 .bakui/dirs.db)
+    记录上次增量备份时每个源目录的 修改时间/inode/子目录列表/文件名列表。
+    目录的修改时间只在其中的条目增删或改名时变化，未变化的目录不再列出 (scandir)，
+    直接按记录的文件名 stat 其中的文件，按记录的子目录列表继续向下检查。
+    原地修改文件内容不会改变目录的修改时间，但会改变文件的大小/修改时间，因此仍能发现；
+    定期的全量扫描 (间隔由 full_scan_interval 限定) 重建全部记录。
+    只在当前备份线程中打开和提交；walk 可以在扫描线程中运行。
+    """
+
+    def __init__(self, dst_dir, full_scan_interval=DIR_FULL_SCAN_INTERVAL):
+        self.path = os.path.join(dst_dir, META_DIR, DIR_CACHE_NAME)
+        self.full_scan_interval = full_scan_interval
+        self.conn = None
+        self.full_scan = True
+        self.pruned_dirs = 0
+        self.scanned_dirs = 0
+        self._src_dir = None
+        self._records = {}
+        self._updates = {}
+        self._failed = set()
+        self._started = 0
+
+    def open(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.conn = sqlite3.connect(self.path)
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS dirs (
+                    path TEXT PRIMARY KEY,
+                    mtime REAL NOT NULL,
+                    ino INTEGER NOT NULL,
+                    subdirs TEXT NOT NULL,
+                    files TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );""")
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(dirs)")}
+            if 'files' not in columns:
+                # 旧版本的记录没有文件名列表，丢弃后所有目录重新扫描
+                self.conn.execute("DROP TABLE dirs")
+                self.conn.commit()
+                self.conn.close()
+                return self.open()
+            self.conn.commit()
+            return True
+        except (OSError, sqlite3.Error):
+            self.conn = None
+            return False
+
+    def _get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def load(self, src_dir, force_reason=None):
+        """
+        读取上次的目录记录 (每个目录保存其文件名列表，内存与文件数成正比)
+        force_reason: 不为 None 时强制全量扫描
+        返回: None 表示可以跳过未变化的目录，否则返回需要全量扫描的原因
+        """
+        self._src_dir = os.path.abspath(src_dir)
+        self._records = {}
+        try:
+            full_scan_at = float(self._get_meta('full_scan_at', 0))
+        except ValueError:
+            full_scan_at = 0
+        if force_reason:
+            reason = force_reason
+        elif self._get_meta('src_dir') != self._src_dir:
+            reason = "没有该源目录的目录记录"
+        elif time.time() - full_scan_at > self.full_scan_interval:
+            reason = "距上次全量扫描时间过长"
+        else:
+            reason = None
+            for path, mtime, ino, subdirs, files in self.conn.execute(
+                    "SELECT path, mtime, ino, subdirs, files FROM dirs"):
+                self._records[path.replace('/', os.sep)] = (
+                    mtime, ino, tuple(subdirs.split('/')) if subdirs else (),
+                    tuple(files.split('/')) if files else ())
+        self.full_scan = reason is not None
+        return reason
+
+    def walk(self, root, stop_check=None, on_error=None, exclude=()):
+        """
+        与 iter_tree 相同的遍历接口: 列表发生变化 (或没有记录) 的目录重新列出，
+        未变化的目录不列出，按记录的文件名逐个 stat，按记录的子目录列表继续向下检查。
+        上次不存在的目录的整个子树都会完整扫描 (目录可能被删除后重建，子目录的旧记录不可信)。
+        """
+        self._started = time.time()
+        stack = [('', True)]
+        while stack:
+            if stop_check and stop_check():
+                return
+            rel_dir, trusted = stack.pop()
+            path = os.path.join(root, rel_dir) if rel_dir else root
+            try:
+                # 先 stat 再列出目录: 列出期间的修改会在下次运行时被发现
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                if on_error:
+                    on_error(path, e)
+                continue
+
+            record = self._records.get(rel_dir) if trusted else None
+            if record is not None and record[0] == st.st_mtime and record[1] == st.st_ino:
+                self.pruned_dirs += 1
+                subdirs = record[2]
+                files, failed = self._stat_files(path, rel_dir, record[3], on_error)
+                if failed:
+                    # 下次重新列出该目录
+                    self._updates[rel_dir] = (UNTRUSTED_MTIME,) + record[1:]
+                yield rel_dir, files, list(subdirs)
+            else:
+                errors = []
+
+                def dir_error(error_path, e):
+                    errors.append(error_path)
+                    if on_error:
+                        on_error(error_path, e)
+
+                files, subdirs = scan_dir(path, rel_dir, dir_error)
+                if files is None:
+                    continue
+                if not rel_dir and exclude:
+                    for name in exclude:
+                        files.pop(name, None)
+                    subdirs = [d for d in subdirs if d not in exclude]
+                self.scanned_dirs += 1
+                # 有无法访问的条目或修改时间过近时仍然记录子目录，但下次重新扫描该目录
+                mtime = st.st_mtime
+                if errors or mtime >= self._started - RACY_WINDOW:
+                    mtime = UNTRUSTED_MTIME
+                self._updates[rel_dir] = (mtime, st.st_ino, tuple(subdirs), tuple(files))
+                yield rel_dir, files, subdirs
+                # 目录被删除后重建 (inode 变化) 时子目录的记录也不可信
+                trusted = record is not None and record[1] == st.st_ino
+
+            # 逆序入栈以保持目录名的自然顺序
+            for name in reversed(subdirs):
+                stack.append((name if not rel_dir else rel_dir + os.sep + name, trusted))
+
+    @staticmethod
+    def _stat_files(path, rel_dir, names, on_error):
+        """
+        stat 未变化目录中记录的文件 (与 scan_dir 一样跟随符号链接，跳过特殊文件)
+        返回: ({文件名: FileEntry}, 是否有无法访问的文件)
+        """
+        files = {}
+        failed = False
+        for name in names:
+            file_path = os.path.join(path, name)
+            try:
+                st = os.stat(file_path)
+            except OSError as e:
+                # 文件被删除会改变目录的修改时间，这里只可能是扫描期间的竞争或权限问题
+                failed = True
+                if on_error and not isinstance(e, FileNotFoundError):
+                    on_error(file_path, e)
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            files[name] = FileEntry.from_stat(name if not rel_dir else rel_dir + os.sep + name, st)
+        return files, failed
+
+    def invalidate(self, rel_dir):
+        """
+        目录中有文件处理失败，下次重新扫描该目录，可在任意线程调用
+        """
+        self._failed.add(rel_dir)
+
+    def commit(self):
+        """
+        备份完整结束后保存本次扫描的目录记录；全量扫描时替换全部记录
+        """
+        if self.conn is None:
+            return
+        if self.full_scan:
+            self.conn.execute("DELETE FROM dirs")
+            self._set_meta('full_scan_at', self._started)
+            self._set_meta('src_dir', self._src_dir)
+        failed = set(self._failed)
+        rows = [(_to_key(rel_dir), UNTRUSTED_MTIME if rel_dir in failed else mtime, ino, '/'.join(subdirs),
+                 '/'.join(files))
+                for rel_dir, (mtime, ino, subdirs, files) in self._updates.items()]
+        self.conn.executemany("INSERT OR REPLACE INTO dirs (path, mtime, ino, subdirs, files) VALUES (?, ?, ?, ?, ?)",
+                              rows)
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,319 @@
+import errno
+import os
+import queue
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from core.copier import CopyStopped, DEFAULT_COPY_WORKERS, MAX_COPY_WORKERS
+from core.fastcopy import check_regular_file
+
+# 读取源文件的块大小
+FANOUT_CHUNK_SIZE = 1024 * 1024
+# 每个目标最多缓存的未写入数据量
+FANOUT_LANE_BUFFER = 64 * 1024 * 1024
+# 目标的缓存已满且在该时间内没有空位时，该目标不再等待共享读取，改为自行读取源文件
+FANOUT_LAG_TIMEOUT = 2.0
+# 每个目标最多排队的文件数 (已提交但未写完)，超出后该目标的新文件推迟到下次备份
+LANE_MAX_PENDING = 256
+# 目标连续失败该次数后停用 (例如设备被拔出)
+LANE_MAX_ERRORS = 20
+# 空间不足、只读等错误立即停用目标
+FATAL_ERRNOS = (errno.ENOSPC, errno.EROFS, errno.ENODEV)
+# 写入中的文件后缀，完成后原子重命名
+PARTIAL_SUFFIX = '.bakui-partial'
+
+# 数据流已与共享读取脱离
+_DETACHED = object()
+
+
+class _Stream:
+    """
+    一个源文件写往一个目标的数据流 (状态由所属目标的条件变量保护)
+    """
+    __slots__ = ('chunks', 'closed', 'detached', 'failed', 'error')
+
+    def __init__(self):
+        self.chunks = deque()
+        self.closed = False
+        self.detached = False
+        self.failed = False
+        self.error = None
+
+
+class FanoutResult:
+    """
+    单个文件写往单个目标的结果
+    source_error: 错误来自读取源文件 (不计入目标的失败次数)
+    detached: 该目标落后于共享读取，文件由目标自行读取源文件复制
+    deferred: 该目标排队的文件过多，本次未写入 (不记入清单，下次备份时复制)
+    """
+    __slots__ = ('lane', 'tag', 'error', 'source_error', 'stopped', 'detached', 'deferred')
+
+    def __init__(self, lane, tag, error=None, source_error=False, stopped=False, detached=False, deferred=False):
+        self.lane = lane
+        self.tag = tag
+        self.error = error
+        self.source_error = source_error
+        self.stopped = stopped
+        self.detached = detached
+        self.deferred = deferred
+
+
+class TargetLane:
+    """
+    单个目标的写入通道: 独立的写入线程、有上限的数据缓存和有上限的文件队列
+    写入慢的目标只会占满自己的缓存，超时后与共享读取脱离，不阻塞其他目标；
+    排队的文件达到 max_pending 后新文件推迟到下次备份，队列和内存不随源文件数增长。
+    """
+
+    def __init__(self, index, dst_dir, workers, copy_func, stop_check, buffer_limit, lag_timeout,
+                 max_pending=LANE_MAX_PENDING):
+        self.index = index
+        self.dst_dir = dst_dir
+        self.copy_func = copy_func
+        self.stop_check = stop_check
+        self.buffer_limit = buffer_limit
+        self.lag_timeout = lag_timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"bakui-fanout-{index}")
+        self._queue_slots = threading.Semaphore(max_pending)
+        self._cond = threading.Condition()
+        self._buffered = 0
+        # 在主线程中维护
+        self.failed = False
+        self.error = None
+        self.consecutive_errors = 0
+        self.detached = 0
+        self.deferred = 0
+
+    def open_stream(self, tag, src_path, dst_path, results):
+        """
+        返回: 数据流，排队的文件已达上限时返回 None
+        """
+        if not self._queue_slots.acquire(blocking=False):
+            return None
+        stream = _Stream()
+        self._pool.submit(self._write, stream, tag, src_path, dst_path, results)
+        return stream
+
+    def put(self, stream, chunk):
+        """
+        把一块数据交给目标 (读取线程调用)，缓存超时未腾出空间时脱离共享读取
+        返回: 是否仍在共享读取
+        """
+        deadline = time.monotonic() + self.lag_timeout
+        with self._cond:
+            while (not stream.detached and not stream.failed and self._buffered > 0
+                   and self._buffered + len(chunk) > self.buffer_limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._detach(stream)
+                    break
+                self._cond.wait(remaining)
+            if stream.detached or stream.failed:
+                return False
+            stream.chunks.append(chunk)
+            self._buffered += len(chunk)
+            self._cond.notify_all()
+            return True
+
+    def close_stream(self, stream, error=None):
+        """
+        源文件读取结束 (error 为读取错误)
+        """
+        with self._cond:
+            stream.closed = True
+            stream.error = error
+            self._cond.notify_all()
+
+    def _detach(self, stream):
+        # 丢弃已缓存的数据，写入线程改为自行复制
+        stream.detached = True
+        self._buffered -= sum(len(c) for c in stream.chunks)
+        stream.chunks.clear()
+        self._cond.notify_all()
+
+    def _next(self, stream):
+        with self._cond:
+            while True:
+                if stream.detached:
+                    return _DETACHED
+                if stream.chunks:
+                    chunk = stream.chunks.popleft()
+                    self._buffered -= len(chunk)
+                    self._cond.notify_all()
+                    return chunk
+                if stream.closed:
+                    if stream.error is not None:
+                        raise stream.error
+                    return None
+                self._cond.wait()
+
+    def _write(self, stream, tag, src_path, dst_path, results):
+        tmp_path = dst_path + PARTIAL_SUFFIX
+        detached = False
+        try:
+            if self.stop_check():
+                raise CopyStopped()
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = self._next(stream)
+                    if chunk is None:
+                        break
+                    if chunk is _DETACHED:
+                        detached = True
+                        break
+                    f.write(chunk)
+            if detached:
+                os.unlink(tmp_path)
+                self.copy_func(src_path, dst_path)
+            else:
+                os.replace(tmp_path, dst_path)
+                shutil.copystat(src_path, dst_path)
+            result = FanoutResult(self, tag, detached=detached)
+        except CopyStopped:
+            result = FanoutResult(self, tag, stopped=True)
+        except Exception as e:
+            result = FanoutResult(self, tag, error=e, source_error=e is stream.error)
+        if result.error is not None or result.stopped:
+            with self._cond:
+                stream.failed = True
+                self._buffered -= sum(len(c) for c in stream.chunks)
+                stream.chunks.clear()
+                self._cond.notify_all()
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        self._queue_slots.release()
+        results.put(result)
+
+    def record(self, result):
+        """
+        在主线程中登记结果，连续失败或遇到致命错误时停用目标
+        返回: 本次是否导致目标停用
+        """
+        if result.deferred:
+            self.deferred += 1
+            return False
+        if result.error is None:
+            self.consecutive_errors = 0
+            if result.detached:
+                self.detached += 1
+            return False
+        if result.source_error:
+            return False
+        self.consecutive_errors += 1
+        fatal = isinstance(result.error, OSError) and result.error.errno in FATAL_ERRNOS
+        if not self.failed and (fatal or self.consecutive_errors >= LANE_MAX_ERRORS):
+            self.failed = True
+            self.error = result.error
+            return True
+        return False
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+class FanoutCopier:
+    """
+    多目标复制: 每个源文件只读取一次，数据块同时交给所有需要它的目标
+    读取线程和各目标的写入线程相互独立，结果通过队列回传给调用线程。
+    """
+
+    def __init__(self, dst_dirs, copy_func, workers=DEFAULT_COPY_WORKERS, stop_check=None,
+                 chunk_size=FANOUT_CHUNK_SIZE, buffer_limit=FANOUT_LANE_BUFFER, lag_timeout=FANOUT_LAG_TIMEOUT,
+                 max_pending=LANE_MAX_PENDING):
+        self.workers = max(1, min(int(workers), MAX_COPY_WORKERS))
+        self.stop_check = stop_check or (lambda: False)
+        self.chunk_size = chunk_size
+        self.lanes = [TargetLane(i, d, self.workers, copy_func, self.stop_check, buffer_limit, lag_timeout,
+                                 max_pending)
+                      for i, d in enumerate(dst_dirs)]
+        self._readers = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bakui-fanout-read")
+        # 每个已提交的文件都有读取线程在运行，写入线程不会等待排队中的读取
+        self._slots = threading.Semaphore(self.workers)
+        self._results = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+        return False
+
+    def submit(self, tag, src_path, targets):
+        """
+        提交一个源文件，targets 为 [(TargetLane, 目标路径)]；读取通道已满时阻塞
+        排队已满的目标不等待，直接得到 deferred 结果
+        """
+        self._slots.acquire()
+        with self._lock:
+            self._pending += len(targets)
+        streams = []
+        for lane, dst_path in targets:
+            stream = lane.open_stream(tag, src_path, dst_path, self._results)
+            if stream is None:
+                self._results.put(FanoutResult(lane, tag, deferred=True))
+            else:
+                streams.append((lane, stream))
+        if streams:
+            self._readers.submit(self._read, src_path, streams)
+        else:
+            self._slots.release()
+
+    def _read(self, src_path, streams):
+        try:
+            check_regular_file(src_path)
+            with open(src_path, 'rb', buffering=0) as f:
+                while True:
+                    if self.stop_check():
+                        raise CopyStopped()
+                    live = [(lane, s) for lane, s in streams if not s.detached and not s.failed]
+                    if not live:
+                        # 所有目标都已脱离，不再读取
+                        return
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    for lane, stream in live:
+                        lane.put(stream, chunk)
+            for lane, stream in streams:
+                lane.close_stream(stream)
+        except BaseException as e:
+            for lane, stream in streams:
+                lane.close_stream(stream, e)
+        finally:
+            self._slots.release()
+
+    def _take(self, block):
+        try:
+            result = self._results.get(block=block)
+        except queue.Empty:
+            return None
+        with self._lock:
+            self._pending -= 1
+        return result
+
+    def completed(self):
+        while True:
+            result = self._take(block=False)
+            if result is None:
+                return
+            yield result
+
+    def drain(self):
+        while True:
+            with self._lock:
+                if self._pending == 0:
+                    return
+            yield self._take(block=True)
+
+    def shutdown(self):
+        self._readers.shutdown(wait=True)
+        for lane in self.lanes:
+            lane.shutdown()
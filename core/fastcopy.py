@@ -0,0 +1,163 @@
+import errno
+import os
+import shutil
+import stat
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+# 用户态复制的缓冲区大小
+COPY_BUFSIZE = 1024 * 1024
+
+METHOD_REFLINK = 'reflink'
+METHOD_COPY_FILE_RANGE = 'copy_file_range'
+METHOD_SENDFILE = 'sendfile'
+METHOD_PORTABLE = 'portable'
+
+# 表示"当前文件系统不支持该方式"的错误码，出现时降级到下一种方式
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EOPNOTSUPP,
+    getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP), errno.EBADF, errno.ENOTSOCK,
+}
+
+
+def _available_methods():
+    methods = []
+    if sys.platform.startswith('linux'):
+        if fcntl is not None:
+            methods.append(METHOD_REFLINK)
+        if hasattr(os, 'copy_file_range'):
+            methods.append(METHOD_COPY_FILE_RANGE)
+        if hasattr(os, 'sendfile'):
+            methods.append(METHOD_SENDFILE)
+    methods.append(METHOD_PORTABLE)
+    return tuple(methods)
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def check_regular_file(path):
+    """
+    源文件不是普通文件 (命名管道、套接字、设备等) 时抛出 shutil.SpecialFileError (同 shutil.copyfile)，
+    避免 open 在命名管道上永久阻塞
+    """
+    st = os.stat(path)
+    if not stat.S_ISREG(st.st_mode):
+        raise shutil.SpecialFileError(f"不是普通文件: {path}")
+
+
+class FastCopier:
+    """
+    内核加速的文件复制
+    按 reflink (FICLONE) -> copy_file_range -> sendfile -> 用户态循环 的顺序尝试，
+    每对 (源设备, 目标设备) 只探测一次，之后直接使用可用的方式；
+    非 Linux 平台只使用用户态循环。线程安全。
+    """
+
+    def __init__(self, methods=None):
+        self.methods = tuple(methods) if methods else _available_methods()
+        self._lock = threading.Lock()
+        # (src_dev, dst_dev) -> 仍可尝试的方式列表
+        self._candidates = {}
+        # (src_dev, dst_dev) -> 已确认可用的方式
+        self._working = {}
+        # 各方式完成的文件数
+        self.stats = {}
+
+    def copy2(self, src, dst):
+        """
+        等价于 shutil.copy2: 复制内容并保留修改时间等元数据
+        返回: 实际使用的复制方式
+        """
+        method = self.copyfile(src, dst)
+        shutil.copystat(src, dst)
+        return method
+
+    def copyfile(self, src, dst):
+        check_regular_file(src)
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            src_st = os.fstat(fsrc.fileno())
+            key = (src_st.st_dev, os.fstat(fdst.fileno()).st_dev)
+            size = src_st.st_size
+
+            for method in self._methods_for(key):
+                try:
+                    self._copy_with(method, fsrc, fdst, size)
+                except _Unsupported:
+                    self._disable(key, method)
+                    # 丢弃已写入的部分，用下一种方式重新复制
+                    fsrc.seek(0)
+                    fdst.seek(0)
+                    fdst.truncate()
+                    continue
+                with self._lock:
+                    self._working[key] = method
+                    self.stats[method] = self.stats.get(method, 0) + 1
+                return method
+
+        # 用户态循环不会被禁用，理论上不会到达这里
+        raise OSError(f"没有可用的复制方式: {src}")
+
+    def _methods_for(self, key):
+        with self._lock:
+            candidates = self._candidates.get(key)
+            if candidates is None:
+                candidates = self._candidates[key] = list(self.methods)
+            return list(candidates)
+
+    def _disable(self, key, method):
+        if method == METHOD_PORTABLE:
+            return
+        with self._lock:
+            candidates = self._candidates.get(key)
+            if candidates and method in candidates:
+                candidates.remove(method)
+
+    def method_for(self, src_dev, dst_dev):
+        """
+        返回已确认可用的复制方式，尚未探测时返回 None
+        """
+        with self._lock:
+            return self._working.get((src_dev, dst_dev))
+
+    def _copy_with(self, method, fsrc, fdst, size):
+        if method == METHOD_PORTABLE:
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+            return
+
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        try:
+            if method == METHOD_REFLINK:
+                fcntl.ioctl(outfd, FICLONE, infd)
+            elif method == METHOD_COPY_FILE_RANGE:
+                self._kernel_loop(lambda offset, count: os.copy_file_range(infd, outfd, count, offset, offset),
+                                  size, infd)
+            elif method == METHOD_SENDFILE:
+                self._kernel_loop(lambda offset, count: os.sendfile(outfd, infd, offset, count), size, infd)
+        except OSError as e:
+            if e.errno in _UNSUPPORTED_ERRNOS:
+                raise _Unsupported() from e
+            raise
+
+    @staticmethod
+    def _kernel_loop(copy_chunk, size, src_fd):
+        offset = 0
+        while True:
+            # 文件在复制过程中变大时继续复制直到 EOF
+            count = max(size - offset, COPY_BUFSIZE)
+            sent = copy_chunk(offset, count)
+            if sent == 0:
+                # 部分文件系统 (FUSE、NFS、procfs 等) 未到文件末尾就返回 0，
+                # 只有源文件确实已缩短时才视为完成，否则降级到下一种方式
+                if offset < size and offset < os.fstat(src_fd).st_size:
+                    raise _Unsupported()
+                break
+            offset += sent
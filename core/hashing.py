@@ -0,0 +1,262 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from core.manifest import META_DIR
+
+HASH_CACHE_NAME = 'hashes.db'
+HASH_CHUNK_SIZE = 1024 * 1024
+# 批量提交的记录条数
+COMMIT_INTERVAL = 500
+
+COMPARE_METADATA = 'metadata'
+COMPARE_CONTENT = 'content'
+COMPARE_VERIFY = 'verify'
+
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    计算文件内容哈希 (blake2b-160)
+    """
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_pair(src_path, dst_path):
+    """
+    在工作进程中执行: 计算源文件和/或目标文件的哈希 (路径为 None 时跳过)
+    返回: (src_hash, dst_hash, src_error, dst_error, hashed_bytes)
+    """
+    result = [None, None, None, None, 0]
+    for index, path in ((0, src_path), (1, dst_path)):
+        if path is None:
+            continue
+        try:
+            result[index] = hash_file(path)
+            result[4] += os.path.getsize(path)
+        except OSError as e:
+            result[index + 2] = str(e)
+    return tuple(result)
+
+
+class HashCache:
+    """
+    源文件内容哈希缓存 (SQLite，保存在目标目录的 .bakui/hashes.db)
+    以 (路径, 大小, 修改时间, inode, ctime) 为键，文件未变化时不会重复计算哈希。
+    ctime 无法被工具回设，因此可以发现"保留修改时间"的内容变化。
+    只在当前备份线程中使用。
+    """
+
+    def __init__(self, dst_dir):
+        self.path = os.path.join(dst_dir, META_DIR, HASH_CACHE_NAME)
+        self.conn = None
+        self._pending = 0
+        self.hits = 0
+        self.misses = 0
+
+    def open(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS src_hashes (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    ino INTEGER,
+                    ctime REAL,
+                    hash TEXT NOT NULL
+                )""")
+            self.conn.commit()
+            return True
+        except (OSError, sqlite3.Error):
+            self.conn = None
+            return False
+
+    def get(self, entry):
+        if self.conn is None:
+            return None
+        row = self.conn.execute(
+            "SELECT size, mtime, ino, ctime, hash FROM src_hashes WHERE path = ?",
+            (entry.rel_path.replace(os.sep, '/'),)).fetchone()
+        if row is not None and tuple(row[:4]) == (entry.size, entry.mtime, entry.ino, entry.ctime):
+            self.hits += 1
+            return row[4]
+        self.misses += 1
+        return None
+
+    def put(self, entry, file_hash):
+        if self.conn is None:
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO src_hashes (path, size, mtime, ino, ctime, hash) VALUES (?, ?, ?, ?, ?, ?)",
+            (entry.rel_path.replace(os.sep, '/'), entry.size, entry.mtime, entry.ino, entry.ctime, file_hash))
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self.conn.commit()
+            self._pending = 0
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+
+class HashJob:
+    __slots__ = ('tag', 'src_hash', 'dst_hash', 'src_error', 'dst_error')
+
+    def __init__(self, tag, src_hash=None, dst_hash=None, src_error=None, dst_error=None):
+        self.tag = tag
+        self.src_hash = src_hash
+        self.dst_hash = dst_hash
+        self.src_error = src_error
+        self.dst_error = dst_error
+
+
+class ParallelHasher:
+    """
+    多进程哈希计算
+    任务分发到进程池以利用多核，在途任务数受限；结果通过队列回传给调用线程。
+    进程池不可用时 (受限环境) 回退到线程池。
+    """
+
+    def __init__(self, workers=None, use_processes=True):
+        self.workers = workers or os.cpu_count() or 2
+        self._executor = None
+        if use_processes:
+            # 备份时扫描线程和复制线程都在运行，fork 子进程可能继承持有中的锁
+            methods = multiprocessing.get_all_start_methods()
+            method = 'forkserver' if 'forkserver' in methods else 'spawn'
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context(method))
+            except (OSError, NotImplementedError, ImportError, ValueError):
+                self._executor = None
+        if self._executor is None:
+            self._executor = self._thread_pool()
+        self._slots = threading.Semaphore(self.workers * 4)
+        self._results = queue.Queue()
+        self._futures = set()
+        self._lock = threading.Lock()
+        self.files_hashed = 0
+        self.bytes_hashed = 0
+        # 第一个任务提交到最后一个任务完成的时间，用于计算吞吐
+        self._first_submit = None
+        self._last_done = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+        return False
+
+    def _thread_pool(self):
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bakui-hash")
+
+    def _fallback(self, broken):
+        """
+        进程池异常退出 (子进程被杀、无法启动等) 时改用线程池
+        """
+        with self._lock:
+            if self._executor is broken:
+                self._executor = self._thread_pool()
+                broken.shutdown(wait=False)
+
+    def submit(self, tag, src_path, dst_path, src_hash=None, dst_hash=None):
+        """
+        提交哈希任务；src_hash/dst_hash 为已知的哈希 (对应路径传 None)
+        通道已满时阻塞直到有空位
+        """
+        self._slots.acquire()
+        with self._lock:
+            if self._first_submit is None:
+                self._first_submit = time.time()
+        self._dispatch(tag, src_path, dst_path, src_hash, dst_hash)
+
+    def _dispatch(self, tag, src_path, dst_path, src_hash, dst_hash):
+        executor = self._executor
+        try:
+            future = executor.submit(hash_pair, src_path, dst_path)
+        except (BrokenProcessPool, RuntimeError):
+            self._fallback(executor)
+            future = self._executor.submit(hash_pair, src_path, dst_path)
+        with self._lock:
+            self._futures.add(future)
+
+        def done(f):
+            if not f.cancelled():
+                try:
+                    s_hash, d_hash, s_err, d_err, hashed = f.result()
+                except BrokenProcessPool:
+                    # 在线程池中重新计算，新任务先加入在途集合再移出旧任务
+                    self._fallback(executor)
+                    self._dispatch(tag, src_path, dst_path, src_hash, dst_hash)
+                    with self._lock:
+                        self._futures.discard(f)
+                    return
+                except Exception as e:
+                    s_hash, d_hash, s_err, d_err, hashed = None, None, str(e), None, 0
+                with self._lock:
+                    self.files_hashed += 1
+                    self.bytes_hashed += hashed
+                    self._last_done = time.time()
+                # 先放入结果再移出在途集合，drain 不会漏取
+                self._results.put(HashJob(tag, s_hash or src_hash, d_hash or dst_hash, s_err, d_err))
+            with self._lock:
+                self._futures.discard(f)
+            self._slots.release()
+
+        future.add_done_callback(done)
+
+    def completed(self):
+        while True:
+            try:
+                yield self._results.get_nowait()
+            except queue.Empty:
+                return
+
+    def drain(self):
+        """
+        等待并取出所有剩余结果
+        """
+        while True:
+            with self._lock:
+                idle = not self._futures
+            if idle and self._results.empty():
+                return
+            try:
+                yield self._results.get(timeout=0.05)
+            except queue.Empty:
+                continue
+
+    def throughput(self):
+        """
+        返回: (文件数, 字节数, 字节/秒)
+        """
+        with self._lock:
+            if self._first_submit is None or self._last_done is None:
+                return self.files_hashed, self.bytes_hashed, 0.0
+            elapsed = max(self._last_done - self._first_submit, 1e-6)
+            return self.files_hashed, self.bytes_hashed, self.bytes_hashed / elapsed
+
+    def shutdown(self, cancel=False):
+        if cancel:
+            with self._lock:
+                futures = list(self._futures)
+            for future in futures:
+                future.cancel()
+        self._executor.shutdown(wait=True)
@@ -1,43 +1,261 @@
+import atexit
+import itertools
+import json
 import logging
+import logging.handlers
+import os
+import queue
 import sys
+import threading
+import uuid
+from datetime import datetime
+
+
+def app_data_dir():
+    """
+    应用数据目录 (不依赖当前工作目录): Windows 为 %APPDATA%\\BakUI，
+    其他系统为 $XDG_DATA_HOME/bakui (默认 ~/.local/share/bakui)
+    """
+    if sys.platform == 'win32' and os.environ.get('APPDATA'):
+        return os.path.join(os.environ['APPDATA'], 'BakUI')
+    base = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(base, 'bakui')
+
+
+# 结构化日志文件 (JSON Lines)，按大小轮转
+LOG_FILE = os.path.join(app_data_dir(), 'bakui_log.jsonl')
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# 日志类别: 逐文件的记录 (复制/删除/移动/单个文件的错误) 与运行摘要分开控制
+CATEGORY_GENERAL = 'general'
+CATEGORY_FILE = 'file'
+CATEGORY_SUMMARY = 'summary'
+
+_GUI_TAGS = {logging.INFO: "INFO", logging.WARNING: "WARN", logging.ERROR: "ERROR"}
+
+
+class _CategoryControl:
+    """
+    单个类别的级别和采样: 低于 level 的记录丢弃；sample > 1 时警告以下的记录每 sample 条保留一条
+    文本行和结构化记录分别计数 (同一文件通常两者各有一条)
+    """
+    __slots__ = ('level', 'sample', 'counters', 'suppressed')
+
+    def __init__(self, level=logging.INFO, sample=1):
+        self.level = level
+        self.sample = max(1, int(sample))
+        self.counters = (itertools.count(), itertools.count())
+        self.suppressed = 0
+
+    def accept(self, level, structured):
+        if level < self.level:
+            self.suppressed += 1
+            return False
+        if self.sample > 1 and level < logging.WARNING and next(self.counters[structured]) % self.sample:
+            self.suppressed += 1
+            return False
+        return True
+
+
+class _SkipStructured(logging.Filter):
+    """
+    控制台和界面只显示文本日志，逐文件的结构化记录只写入日志文件
+    """
+
+    def filter(self, record):
+        return not getattr(record, 'structured', False)
+
+
+class _SkipFileText(logging.Filter):
+    """
+    日志文件中逐文件的内容由结构化记录提供，不再重复写入对应的文本行
+    """
+
+    def filter(self, record):
+        return getattr(record, 'structured', False) or getattr(record, 'category', None) != CATEGORY_FILE
+
+
+class _GuiHandler(logging.Handler):
+    def __init__(self, owner):
+        super().__init__()
+        self.owner = owner
+
+    def emit(self, record):
+        callback = self.owner.gui_callback
+        if callback:
+            callback(f"[{_GUI_TAGS.get(record.levelno, record.levelname)}] {record.getMessage()}")
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    每条记录一行 JSON: ts, level, category, run_id, message 以及存在的结构化字段
+    """
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'category': getattr(record, 'category', CATEGORY_GENERAL),
+            'run_id': getattr(record, 'run_id', None),
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            data.update(fields)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # 消息在后台线程中格式化，这里只去掉不能跨线程保存的部分
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
 
 class Logger:
+    """
+    日志单例
+    调用线程只把记录放入队列，控制台、界面和日志文件的写入都在后台线程 (QueueListener) 中完成。
+    """
     _instance = None
-    
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(Logger, cls).__new__(cls)
             cls._instance._init_logger()
         return cls._instance
-    
+
     def _init_logger(self):
         self.logger = logging.getLogger("BakUI")
         self.logger.setLevel(logging.INFO)
-        
+        self.logger.propagate = False
+
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        
+
         # Console handler
         ch = logging.StreamHandler(sys.stdout)
         ch.setFormatter(formatter)
-        self.logger.addHandler(ch)
-        
+        ch.addFilter(_SkipStructured())
+
+        gui = _GuiHandler(self)
+        gui.addFilter(_SkipStructured())
+
         self.gui_callback = None
+        self.file_handler = None
+        self.run_id = None
+        self._categories = {}
+        self._lock = threading.Lock()
+
+        self._queue = queue.SimpleQueue()
+        self.logger.addHandler(_QueueHandler(self._queue))
+        self._listener = logging.handlers.QueueListener(self._queue, ch, gui, respect_handler_level=True)
+        self._listener.start()
+        atexit.register(self._listener.stop)
 
     def set_gui_callback(self, callback):
         self.gui_callback = callback
 
-    def info(self, msg):
-        self.logger.info(msg)
-        if self.gui_callback:
-            self.gui_callback(f"[INFO] {msg}")
+    def set_log_file(self, path, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+        """
+        启用 (path 为 None 时关闭) 按大小轮转的 JSON Lines 日志文件，所在目录不存在时创建
+        无法创建目录时抛出 OSError，原有的日志文件保持不变
+        """
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._lock:
+            self._listener.stop()
+            old = self.file_handler
+            handlers = [h for h in self._listener.handlers if h is not old]
+            if old is not None:
+                old.close()
+            self.file_handler = None
+            if path is not None:
+                handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                               encoding='utf-8', delay=True)
+                handler.setFormatter(JsonLinesFormatter())
+                handler.addFilter(_SkipFileText())
+                handlers.append(handler)
+                self.file_handler = handler
+            self._listener.handlers = tuple(handlers)
+            self._listener.start()
+
+    def set_category(self, category, level=logging.INFO, sample=1):
+        """
+        设置类别的最低级别和采样间隔，例如 set_category(CATEGORY_FILE, sample=100) 只保留 1% 的逐文件记录
+        """
+        self._categories[category] = _CategoryControl(level, sample)
+
+    def suppressed(self, category):
+        control = self._categories.get(category)
+        return control.suppressed if control is not None else 0
+
+    def begin_run(self):
+        """
+        开始一次备份任务，之后的记录带有该任务的 run_id
+        """
+        self.run_id = uuid.uuid4().hex[:12]
+        for control in self._categories.values():
+            control.suppressed = 0
+        return self.run_id
+
+    def end_run(self):
+        """
+        结束备份任务: 报告被级别或采样省略的记录数
+        """
+        for category, control in self._categories.items():
+            if control.suppressed:
+                self.info(f"按日志设置省略了 {control.suppressed} 条 {category} 类日志", category=CATEGORY_SUMMARY)
+        self.run_id = None
+
+    def flush(self):
+        """
+        等待队列中的记录全部写出
+        """
+        with self._lock:
+            self._listener.stop()
+            if self.file_handler is not None:
+                self.file_handler.flush()
+            self._listener.start()
+
+    def _log(self, level, msg, category, fields, structured=False):
+        control = self._categories.get(category)
+        if control is not None and not control.accept(level, structured):
+            return
+        extra = {'category': category, 'run_id': self.run_id, 'structured': structured}
+        if fields:
+            extra['fields'] = {k: v for k, v in fields.items() if v is not None}
+        self.logger.log(level, msg, extra=extra)
+
+    def record(self, action, rel_path, size=None, duration=None, error=None):
+        """
+        逐文件的结构化记录，只写入日志文件 (未启用日志文件时直接返回)
+        """
+        if self.file_handler is None:
+            return
+        level = logging.INFO if error is None else logging.ERROR
+        self._log(level, f"{action}: {rel_path}", CATEGORY_FILE,
+                  {'action': action, 'rel_path': rel_path, 'bytes': size, 'duration': duration,
+                   'error': None if error is None else str(error)},
+                  structured=True)
+
+    def summary(self, message, summary, duration, stopped=False):
+        """
+        一次任务的结构化摘要 (计数、字节数和用时)，只写入日志文件
+        """
+        if self.file_handler is None:
+            return
+        self._log(logging.INFO, message, CATEGORY_SUMMARY,
+                  {'action': 'stopped' if stopped else 'done', 'bytes': summary.get('bytes_copied'),
+                   'duration': round(duration, 3), 'summary': summary},
+                  structured=True)
 
-    def error(self, msg):
-        self.logger.error(msg)
-        if self.gui_callback:
-            self.gui_callback(f"[ERROR] {msg}")
+    def info(self, msg, category=CATEGORY_GENERAL, **fields):
+        self._log(logging.INFO, msg, category, fields)
 
-    def warning(self, msg):
-        self.logger.warning(msg)
-        if self.gui_callback:
-            self.gui_callback(f"[WARN] {msg}")
+    def error(self, msg, category=CATEGORY_GENERAL, **fields):
+        self._log(logging.ERROR, msg, category, fields)
 
+    def warning(self, msg, category=CATEGORY_GENERAL, **fields):
+        self._log(logging.WARNING, msg, category, fields)
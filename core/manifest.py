@@ -0,0 +1,249 @@
+import os
+import sqlite3
+import time
+import uuid
+from urllib.request import pathname2url
+
+from core.scanner import FileEntry
+from core.tree import FileTree
+
+# 备份元数据目录 (位于目标目录根部，扫描和同步时忽略)
+META_DIR = '.bakui'
+MANIFEST_NAME = 'manifest.db'
+# 清单超过该时间未做全量校验时视为可能过期
+MANIFEST_MAX_AGE = 7 * 24 * 3600
+# 批量提交的记录条数
+COMMIT_INTERVAL = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT,
+    verified REAL,
+    src_ino INTEGER
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _to_key(rel_path):
+    # 统一使用 '/'，U 盘在 Windows/Linux 之间移动时清单仍然有效
+    return rel_path.replace(os.sep, '/')
+
+
+def _from_key(key):
+    return key.replace('/', os.sep)
+
+
+class Manifest:
+    """
+    目标目录清单 (SQLite)
+    记录每个已备份文件的 大小/修改时间/哈希/最后校验时间，
+    使增量和同步备份可以直接与清单比对，而无需重新扫描目标设备。
+    清单只在当前备份线程中使用。
+    """
+
+    def __init__(self, dst_dir, max_age=MANIFEST_MAX_AGE):
+        self.dst_dir = dst_dir
+        self.path = os.path.join(dst_dir, META_DIR, MANIFEST_NAME)
+        self.max_age = max_age
+        self.conn = None
+        self._pending = 0
+
+    def open(self, readonly=False):
+        """
+        打开 (或创建) 清单，返回是否成功
+        readonly: 只读打开已存在的清单 (预演时使用，不在目标目录中写入任何内容)
+        """
+        if readonly:
+            if not os.path.isfile(self.path):
+                return False
+            try:
+                self.conn = sqlite3.connect(f"file:{pathname2url(self.path)}?mode=ro", uri=True)
+                self.conn.execute("SELECT src_ino FROM files LIMIT 1")
+                return True
+            except sqlite3.Error:
+                # 旧版本清单缺少 src_ino 列，只读时无法迁移
+                self.close(clean=False)
+                return False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.conn = sqlite3.connect(self.path)
+            self.conn.executescript(_SCHEMA)
+            self._migrate()
+            self.conn.commit()
+            return True
+        except (OSError, sqlite3.Error):
+            self.conn = None
+            return False
+
+    def _migrate(self):
+        # 旧版本清单没有 src_ino 列
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+        if 'src_ino' not in columns:
+            self.conn.execute("ALTER TABLE files ADD COLUMN src_ino INTEGER")
+
+    def _get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def stale_reason(self):
+        """
+        判断清单是否可信，可信时返回 None，否则返回原因
+        """
+        if self._get_meta('complete') != '1':
+            return "清单不存在或不完整"
+        if self._get_meta('state') != 'clean':
+            return "上次备份未正常结束"
+        try:
+            verified_at = float(self._get_meta('verified_at', 0))
+        except ValueError:
+            verified_at = 0
+        if time.time() - verified_at > self.max_age:
+            return "清单距上次全量校验时间过长"
+        return None
+
+    def begin_run(self):
+        """
+        标记备份开始；若进程异常退出，下次运行会因状态非 clean 而回退到全量扫描
+        """
+        self._set_meta('state', 'running')
+        self._set_meta('run_id', uuid.uuid4().hex)
+        self.conn.commit()
+
+    def rebuild(self, entries, dirs):
+        """
+        用全量扫描结果重建清单
+        """
+        now = time.time()
+        self.conn.execute("DELETE FROM files")
+        self.conn.execute("DELETE FROM dirs")
+        self.conn.executemany(
+            "INSERT INTO files (path, size, mtime, verified) VALUES (?, ?, ?, ?)",
+            ((_to_key(e.rel_path), e.size, e.mtime, now) for e in entries))
+        self.conn.executemany("INSERT INTO dirs (path) VALUES (?)", ((_to_key(d),) for d in dirs))
+        self._set_meta('complete', '1')
+        self._set_meta('verified_at', now)
+        self.conn.commit()
+        self._pending = 0
+
+    def load(self):
+        """
+        读取完整清单
+        返回: (files, dirs)，与 scan_tree 的返回格式一致；
+        FileEntry.ino 为复制时记录的源文件 inode (未知时为 0)
+        """
+        files = {}
+        for path, size, mtime, src_ino in self.conn.execute("SELECT path, size, mtime, src_ino FROM files"):
+            rel_path = _from_key(path)
+            files[rel_path] = FileEntry(rel_path, size, mtime, src_ino or 0)
+        dirs = {_from_key(row[0]) for row in self.conn.execute("SELECT path FROM dirs")}
+        return files, dirs
+
+    def load_tree(self):
+        """
+        以紧凑目录树的形式读取完整清单 (同步比对使用)
+        FileTree 中的 ino 为复制时记录的源文件 inode (未知时为 0)
+        """
+        tree = FileTree()
+        for (path,) in self.conn.execute("SELECT path FROM dirs"):
+            tree.add_dir(_from_key(path))
+        for path, size, mtime, src_ino in self.conn.execute("SELECT path, size, mtime, src_ino FROM files"):
+            tree.add_file(_from_key(path), size, mtime, src_ino)
+        return tree
+
+    def lookup(self, rel_path):
+        row = self.conn.execute(
+            "SELECT size, mtime FROM files WHERE path = ?", (_to_key(rel_path),)).fetchone()
+        if row is None:
+            return None
+        return FileEntry(rel_path, row[0], row[1])
+
+    def get_hash(self, rel_path):
+        """
+        返回记录的目标文件内容哈希，未记录时返回 None
+        """
+        row = self.conn.execute("SELECT hash FROM files WHERE path = ?", (_to_key(rel_path),)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_hash(self, rel_path, file_hash):
+        """
+        记录目标文件内容哈希 (内容比对时校验过的文件)
+        """
+        self.conn.execute("UPDATE files SET hash = ?, verified = ? WHERE path = ?",
+                          (file_hash, time.time(), _to_key(rel_path)))
+        self._tick()
+
+    def has_dir(self, rel_dir):
+        if not rel_dir:
+            return True
+        row = self.conn.execute("SELECT 1 FROM dirs WHERE path = ?", (_to_key(rel_dir),)).fetchone()
+        return row is not None
+
+    def _tick(self):
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def record_file(self, entry, file_hash=None):
+        """
+        记录已复制的文件 (entry 为源文件的 FileEntry，同时记录源 inode 用于移动检测)
+        """
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime, hash, verified, src_ino) VALUES (?, ?, ?, ?, ?, ?)",
+            (_to_key(entry.rel_path), entry.size, entry.mtime, file_hash, time.time(), entry.ino or None))
+        self._tick()
+
+    def record_dir(self, rel_dir):
+        """
+        记录目录及其所有父目录
+        """
+        while rel_dir:
+            self.conn.execute("INSERT OR IGNORE INTO dirs (path) VALUES (?)", (_to_key(rel_dir),))
+            rel_dir = os.path.dirname(rel_dir)
+        self._tick()
+
+    def remove_file(self, rel_path):
+        self.conn.execute("DELETE FROM files WHERE path = ?", (_to_key(rel_path),))
+        self._tick()
+
+    def remove_tree(self, rel_dir):
+        """
+        删除目录及其下所有记录
+        """
+        key = _to_key(rel_dir)
+        # 按字典序区间匹配 "key/" 前缀 ('0' 是 '/' 的下一个字符)，避免 LIKE 大小写不敏感
+        lo, hi = key + '/', key + '0'
+        self.conn.execute("DELETE FROM files WHERE path >= ? AND path < ?", (lo, hi))
+        self.conn.execute("DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", (key, lo, hi))
+        self._tick()
+
+    def commit(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self._pending = 0
+
+    def close(self, clean=True):
+        """
+        提交并关闭清单；clean=True 表示清单与目标目录一致
+        """
+        if self.conn is None:
+            return
+        try:
+            if clean:
+                self._set_meta('state', 'clean')
+            self.conn.commit()
+        finally:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,293 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# 阶段 (流水线中各阶段相互重叠，记录的是各自从开始到结束的墙钟时间)
+PHASE_SCAN_SOURCE = 'scan_source'
+PHASE_SCAN_DESTINATION = 'scan_destination'
+PHASE_DIFF = 'diff'
+PHASE_DELETE = 'delete'
+PHASE_CREATE = 'create'
+PHASE_COPY = 'copy'
+
+# 写入数据的操作 (计入吞吐量)
+TRANSFER_ACTIONS = frozenset(('copied', 'updated', 'stored', 'restored', 'packed', 'compressed'))
+# 操作所属的阶段
+ACTION_PHASES = {
+    'deleted': PHASE_DELETE, 'deleted_dir': PHASE_DELETE, 'created_dir': PHASE_CREATE,
+    **{action: PHASE_COPY for action in TRANSFER_ACTIONS},
+}
+
+# 速率采样间隔和窗口 (秒): 瞬时速率取最近 1 秒，平均速率取最近 30 秒
+SAMPLE_INTERVAL = 0.1
+INSTANT_WINDOW = 1.0
+AVERAGE_WINDOW = 30.0
+
+# Prometheus 文本文件 (node exporter textfile collector) 的指标前缀
+PROMETHEUS_PREFIX = 'bakui_backup'
+
+
+class RunMetrics:
+    """
+    单次备份任务的运行指标: 吞吐量 (瞬时/滑动平均)、按字节的进度、预计剩余时间、各阶段耗时和各操作计数
+    在备份线程中更新，snapshot() 可在其他线程 (界面) 中读取: 阶段字典新增键和复制时持有 _lock。
+    tracer: 性能分析时的 core.profiler.Profiler，阶段同时记录为 trace 中的 span
+    """
+
+    def __init__(self, clock=time.monotonic, tracer=None):
+        self._clock = clock
+        self.tracer = tracer
+        self._lock = threading.Lock()
+        self.start_time = clock()
+        self.started_at = time.time()
+        self.end_time = None
+        self.stopped = False
+        self.files = 0
+        self.failed = 0
+        self.bytes_processed = 0
+        self.bytes_transferred = 0
+        self.total_files = 0
+        self.total_bytes = 0
+        self.scan_done = False
+        self.actions = {}
+        # 阶段: 累计耗时 (phase) 与 首次开始 ~ 最后结束 的区间 (mark)
+        self._phase_totals = {}
+        self._spans = {}
+        self._open = set()
+        # 已通过 begin/end 记录到 tracer 的阶段
+        self._traced = set()
+        self._samples = deque([(self.start_time, 0, 0)])
+
+    def phase(self, name):
+        """
+        累计一段代码的耗时: with metrics.phase(PHASE_SCAN_DESTINATION): ...
+        """
+        return _PhaseTimer(self, name)
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            self._phase_totals[name] = self._phase_totals.get(name, 0.0) + seconds
+
+    def mark(self, name, now=None):
+        """
+        记录阶段的活动时刻，阶段耗时为第一次到最后一次活动之间的时间
+        """
+        if now is None:
+            now = self._clock()
+        span = self._spans.get(name)
+        if span is None:
+            with self._lock:
+                self._spans[name] = [now, now]
+        else:
+            span[1] = now
+
+    def begin(self, name):
+        """
+        阶段开始 (与 end 配对，未调用 end 的阶段在 finish 时结束)
+        """
+        self._open.add(name)
+        self.mark(name)
+        if self.tracer is not None:
+            self._traced.add(name)
+            self.tracer.begin(name)
+
+    def end(self, name):
+        if name in self._open:
+            self._open.discard(name)
+            self.mark(name)
+            if self.tracer is not None:
+                self.tracer.end(name)
+
+    def file_done(self, stats, action, size=0):
+        """
+        登记一个完成的操作 (stats 为所属任务的 BackupStats，提供总数)
+        """
+        now = self._clock()
+        self.files += 1
+        self.bytes_processed += size
+        if action in TRANSFER_ACTIONS:
+            self.bytes_transferred += size
+        self.actions[action] = self.actions.get(action, 0) + 1
+        phase = ACTION_PHASES.get(action)
+        if phase is not None:
+            self.mark(phase, now)
+        self._update_totals(stats)
+        self._sample(now)
+
+    def file_failed(self, stats, action):
+        self.files += 1
+        self.failed += 1
+        self.actions[action] = self.actions.get(action, 0) + 1
+        self._update_totals(stats)
+
+    def _update_totals(self, stats):
+        self.total_files = stats.total
+        self.total_bytes = stats.total_bytes
+        self.scan_done = stats.scan_done
+
+    def _sample(self, now):
+        if now - self._samples[-1][0] < SAMPLE_INTERVAL:
+            return
+        with self._lock:
+            self._samples.append((now, self.bytes_transferred, self.bytes_processed))
+            while len(self._samples) > 2 and now - self._samples[1][0] > AVERAGE_WINDOW:
+                self._samples.popleft()
+
+    def finish(self, stopped=False):
+        now = self._clock()
+        self.end_time = now
+        self.stopped = stopped
+        # 未结束的阶段 (例如扫描被中止) 记到任务结束
+        for name in list(self._open):
+            self.end(name)
+        if self.tracer is not None:
+            # 按操作标记的阶段 (复制、删除、创建目录) 记为第一次到最后一次操作之间的 span
+            for name, (first, last) in self._spans.items():
+                if name not in self._traced:
+                    self.tracer.add_phase(name, first, last, now)
+
+    @staticmethod
+    def _rate(samples, now, window, current, index):
+        """
+        最近 window 秒内的速率 (字节/秒): 以窗口起点之前最近的采样为基准
+        """
+        base = samples[0]
+        for sample in samples:
+            if now - sample[0] < window:
+                break
+            base = sample
+        elapsed = now - base[0]
+        return (current - base[index]) / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        """
+        当前指标 (可在其他线程中调用)
+        """
+        now = self.end_time if self.end_time is not None else self._clock()
+        with self._lock:
+            samples = list(self._samples)
+        elapsed = now - self.start_time
+        average = self._rate(samples, now, AVERAGE_WINDOW, self.bytes_processed, 2)
+        remaining = max(0, self.total_bytes - self.bytes_processed)
+        eta = None
+        if self.scan_done and self.end_time is None and average > 0:
+            eta = remaining / average
+        return {
+            'elapsed': elapsed,
+            'files': self.files,
+            'failed': self.failed,
+            'total_files': self.total_files,
+            'bytes_processed': self.bytes_processed,
+            'bytes_transferred': self.bytes_transferred,
+            'total_bytes': self.total_bytes,
+            'byte_percent': (self.bytes_processed / self.total_bytes * 100) if self.total_bytes else 0.0,
+            'bytes_per_sec': self._rate(samples, now, INSTANT_WINDOW, self.bytes_transferred, 1),
+            'bytes_per_sec_avg': self._rate(samples, now, AVERAGE_WINDOW, self.bytes_transferred, 1),
+            'files_per_sec': self.files / elapsed if elapsed > 0 else 0.0,
+            'eta': eta,
+            'phases': self.phases(),
+            'actions': dict(self.actions),
+        }
+
+    def phases(self):
+        with self._lock:
+            phases = dict(self._phase_totals)
+            spans = [(name, tuple(span)) for name, span in self._spans.items()]
+        for name, (first, last) in spans:
+            phases[name] = phases.get(name, 0.0) + (last - first)
+        return phases
+
+    def report(self):
+        """
+        任务结束后的完整报告 (可序列化为 JSON)
+        """
+        report = self.snapshot()
+        elapsed = report['elapsed']
+        report.update({
+            'started_at': self.started_at,
+            'stopped': self.stopped,
+            'throughput': self.bytes_transferred / elapsed if elapsed > 0 else 0.0,
+        })
+        return report
+
+    def write_json(self, path):
+        _atomic_write(path, json.dumps(self.report(), ensure_ascii=False, indent=2))
+
+    def prometheus_text(self, labels=None):
+        """
+        Prometheus 文本格式的指标
+        """
+        report = self.report()
+        base = ','.join(f'{k}="{_escape(v)}"' for k, v in sorted((labels or {}).items()))
+
+        def fmt(extra=None):
+            parts = [base] if base else []
+            if extra:
+                parts.append(extra)
+            return '{' + ','.join(parts) + '}' if parts else ''
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            full = f"{PROMETHEUS_PREFIX}_{name}"
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            for extra, value in samples:
+                lines.append(f"{full}{fmt(extra)} {value}")
+
+        metric('last_run_timestamp_seconds', 'gauge', "Start time of the last backup run.",
+               [(None, float(self.started_at))])
+        metric('last_run_success', 'gauge', "1 if the last run finished without being stopped or failing.",
+               [(None, int(not self.stopped and not self.failed))])
+        metric('duration_seconds', 'gauge', "Wall time of the last run.", [(None, float(report['elapsed']))])
+        metric('files', 'gauge', "Files processed in the last run.", [(None, self.files)])
+        metric('failed_files', 'gauge', "Operations that failed in the last run.", [(None, self.failed)])
+        metric('bytes_processed', 'gauge', "Source bytes compared or copied in the last run.",
+               [(None, self.bytes_processed)])
+        metric('bytes_transferred', 'gauge', "Bytes written in the last run.", [(None, self.bytes_transferred)])
+        metric('throughput_bytes_per_second', 'gauge', "Average write throughput of the last run.",
+               [(None, float(report['throughput']))])
+        metric('phase_seconds', 'gauge', "Wall time per phase of the last run (phases overlap).",
+               [(f'phase="{name}"', float(seconds)) for name, seconds in sorted(report['phases'].items())])
+        metric('actions', 'gauge', "Operations per action in the last run.",
+               [(f'action="{name}"', count) for name, count in sorted(report['actions'].items())])
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, labels=None):
+        """
+        写入 node exporter 的 textfile collector 目录 (先写临时文件再重命名，避免读到一半的文件)
+        """
+        _atomic_write(path, self.prometheus_text(labels))
+
+
+class _PhaseTimer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.metrics._clock()
+        if self.metrics.tracer is not None:
+            self.metrics.tracer.begin(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.add_phase(self.name, self.metrics._clock() - self.start)
+        if self.metrics.tracer is not None:
+            self.metrics.tracer.end(self.name)
+        return False
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _atomic_write(path, text):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
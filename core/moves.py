@@ -0,0 +1,84 @@
+import os
+from collections import defaultdict
+
+from core.hashing import hash_file
+
+# 小于该大小的文件直接复制，不参与移动检测
+MOVE_MIN_SIZE = 64 * 1024
+# 修改时间比对允许的误差 (与 _needs_copy 一致)
+MTIME_TOLERANCE = 2
+
+MOVE_DETECTION_OFF = 'off'
+MOVE_DETECTION_METADATA = 'metadata'
+MOVE_DETECTION_HASH = 'hash'
+
+
+class MoveDetector:
+    """
+    同步模式的重命名/移动检测
+    把源目录中"新增"的文件与目标目录中"将被删除"的文件按 (大小, 修改时间) 配对，
+    配对成功时在目标目录内直接 os.rename。只有大小和修改时间相同不足以确认是同一文件:
+    metadata 模式要求上次备份记录的源文件 inode 相同，否则比对内容哈希；hash 模式总是比对内容哈希。
+    dst_entries: 目标目录文件 (可迭代的 FileEntry)
+    source_inodes: dst_entries 中的 ino 是否为上次备份记录的源文件 inode (来自清单)
+    """
+
+    def __init__(self, dst_entries, mode=MOVE_DETECTION_METADATA, source_inodes=False,
+                 min_size=MOVE_MIN_SIZE):
+        self.mode = mode
+        self.source_inodes = source_inodes
+        self.min_size = min_size
+        self._by_size = defaultdict(list)
+        for entry in dst_entries:
+            if entry.size >= min_size:
+                self._by_size[entry.size].append(entry)
+        self._used = set()
+
+    def _candidates(self, src_entry):
+        for dst_entry in self._by_size.get(src_entry.size, ()):
+            if dst_entry.rel_path == src_entry.rel_path or dst_entry.rel_path in self._used:
+                continue
+            if abs(dst_entry.mtime - src_entry.mtime) <= MTIME_TOLERANCE:
+                yield dst_entry
+
+    def is_candidate(self, src_entry):
+        """
+        扫描阶段: 新文件是否可能来自目标目录中的某个文件 (是则暂缓复制)
+        """
+        if self.mode == MOVE_DETECTION_OFF or src_entry.size < self.min_size:
+            return False
+        return next(self._candidates(src_entry), None) is not None
+
+    def match(self, src_entry, deleted, src_path, dst_root):
+        """
+        扫描结束后: 在将被删除的目标文件中寻找 src_entry 的原位置
+        deleted: 将被删除的目标文件相对路径集合
+        返回: 目标目录中的原相对路径，或 None
+        """
+        candidates = [c for c in self._candidates(src_entry) if c.rel_path in deleted]
+        if not candidates:
+            return None
+
+        name = os.path.basename(src_entry.rel_path)
+
+        def rank(c):
+            # 优先: 清单记录的源 inode 相同 > 文件名相同 > 路径顺序
+            same_inode = bool(self.source_inodes and c.ino and c.ino == src_entry.ino)
+            return (not same_inode, os.path.basename(c.rel_path) != name, c.rel_path)
+
+        candidates.sort(key=rank)
+
+        src_digest = None
+        for candidate in candidates:
+            same_inode = bool(self.source_inodes and candidate.ino and candidate.ino == src_entry.ino)
+            if self.mode == MOVE_DETECTION_HASH or not same_inode:
+                try:
+                    if src_digest is None:
+                        src_digest = hash_file(src_path)
+                    if hash_file(os.path.join(dst_root, candidate.rel_path)) != src_digest:
+                        continue
+                except OSError:
+                    continue
+            self._used.add(candidate.rel_path)
+            return candidate.rel_path
+        return None
@@ -0,0 +1,254 @@
+import os
+import sqlite3
+import zlib
+
+from core.manifest import META_DIR
+
+# 打包数据目录 (位于目标目录的 .bakui 中): 段文件 NNNNNN.seg 和偏移索引 index.db
+PACK_DIR = 'packs'
+PACK_INDEX_NAME = 'index.db'
+# 小于该大小的文件打包进段文件，其余文件按原样复制
+PACK_THRESHOLD = 256 * 1024
+# 单个段文件的大小上限 (远小于 FAT32 的 4 GB 限制)
+SEGMENT_SIZE = 256 * 1024 * 1024
+# 段文件中失效数据超过该比例时，把仍有效的记录搬到当前段并删除旧段
+COMPACT_RATIO = 0.5
+SEGMENT_BUFFER = 1024 * 1024
+# 批量提交的记录条数
+COMMIT_INTERVAL = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    mode INTEGER NOT NULL,
+    crc INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_segment ON files (segment);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    size INTEGER NOT NULL,
+    dead INTEGER NOT NULL
+);
+"""
+
+
+def _to_key(rel_path):
+    return rel_path.replace(os.sep, '/')
+
+
+class PackedFile:
+    """
+    索引中的打包文件记录 (size/mtime 与 FileEntry 含义相同，可直接参与比对)
+    """
+    __slots__ = ('rel_path', 'segment', 'offset', 'size', 'mtime', 'mode', 'crc')
+
+    def __init__(self, rel_path, segment, offset, size, mtime, mode, crc):
+        self.rel_path = rel_path
+        self.segment = segment
+        self.offset = offset
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.crc = crc
+
+
+class PackStore:
+    """
+    小文件打包存储
+    小文件的内容依次追加到段文件 (只追加，不原地修改)，索引 (SQLite) 记录每个文件所在的段和偏移。
+    大量小文件的备份因此变为少量大文件的顺序写入，避免 FAT32/exFAT 上逐文件的目录项和分配表写入。
+    文件变化时追加新内容并更新索引，旧内容成为失效数据，由 compact 回收。
+    段数据先于索引落盘，中断时段尾多出的数据不会被索引引用。只在当前备份线程中使用。
+    """
+
+    def __init__(self, dst_dir, segment_size=SEGMENT_SIZE):
+        self.dir = os.path.join(dst_dir, META_DIR, PACK_DIR)
+        self.path = os.path.join(self.dir, PACK_INDEX_NAME)
+        self.segment_size = segment_size
+        self.conn = None
+        self._segment = None
+        self._segment_size = 0
+        self._f = None
+        self._pending = 0
+
+    def open(self):
+        """
+        打开 (或创建) 打包索引，返回是否成功
+        """
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            self.conn = sqlite3.connect(self.path)
+            self.conn.executescript(_SCHEMA)
+            self.conn.commit()
+            return True
+        except (OSError, sqlite3.Error):
+            self.conn = None
+            return False
+
+    def segment_path(self, segment):
+        return os.path.join(self.dir, f"{segment:06d}.seg")
+
+    def get(self, rel_path):
+        row = self.conn.execute(
+            "SELECT segment, offset, size, mtime, mode, crc FROM files WHERE path = ?",
+            (_to_key(rel_path),)).fetchone()
+        return PackedFile(rel_path, *row) if row is not None else None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def _append(self, data):
+        """
+        把数据追加到当前写入的段 (写满时换新段)，返回: (段号, 偏移)
+        """
+        if self._f is not None and self._segment_size > 0 and self._segment_size + len(data) > self.segment_size:
+            self._close_segment()
+        if self._f is None:
+            row = self.conn.execute("SELECT id, size FROM segments ORDER BY id DESC LIMIT 1").fetchone()
+            if row is not None and row[1] < self.segment_size:
+                self._open_segment(row[0])
+            else:
+                self._new_segment()
+        offset = self._segment_size
+        self._f.write(data)
+        self._segment_size += len(data)
+        self.conn.execute("UPDATE segments SET size = ? WHERE id = ?", (self._segment_size, self._segment))
+        return self._segment, offset
+
+    def _new_segment(self):
+        self._close_segment()
+        last = self.conn.execute("SELECT MAX(id) FROM segments").fetchone()[0]
+        segment = (last or 0) + 1
+        self.conn.execute("INSERT INTO segments (id, size, dead) VALUES (?, 0, 0)", (segment,))
+        self._open_segment(segment)
+
+    def _open_segment(self, segment):
+        f = open(self.segment_path(segment), 'ab', buffering=SEGMENT_BUFFER)
+        f.seek(0, os.SEEK_END)
+        # 上次中断时段尾可能有未被索引引用的数据
+        actual = f.tell()
+        self.conn.execute("UPDATE segments SET dead = dead + ? - size, size = ? WHERE id = ? AND size < ?",
+                          (actual, actual, segment, actual))
+        self._f, self._segment, self._segment_size = f, segment, actual
+
+    def _close_segment(self):
+        if self._f is not None:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._f.close()
+            self._f = None
+            self._segment = None
+
+    def _release(self, record):
+        if record is not None:
+            self.conn.execute("UPDATE segments SET dead = dead + ? WHERE id = ?", (record.size, record.segment))
+
+    def add(self, entry, data):
+        """
+        追加文件内容并更新索引 (entry 为源文件的 FileEntry)
+        """
+        self._release(self.get(entry.rel_path))
+        segment, offset = self._append(data)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, segment, offset, size, mtime, mode, crc) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (_to_key(entry.rel_path), segment, offset, len(data), entry.mtime, entry.mode & 0o7777,
+             zlib.crc32(data)))
+        self._tick()
+
+    def remove(self, rel_path):
+        """
+        从索引中移除文件 (例如文件变大后改为按原样复制)，返回是否存在
+        """
+        record = self.get(rel_path)
+        if record is None:
+            return False
+        self._release(record)
+        self.conn.execute("DELETE FROM files WHERE path = ?", (_to_key(rel_path),))
+        self._tick()
+        return True
+
+    def _tick(self):
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def read(self, rel_path):
+        """
+        直接从段文件读取单个文件的内容
+        """
+        record = self.get(rel_path)
+        if record is None:
+            raise FileNotFoundError(f"打包索引中没有该文件: {rel_path}")
+        if record.segment == self._segment and self._f is not None:
+            self._f.flush()
+        with open(self.segment_path(record.segment), 'rb') as f:
+            f.seek(record.offset)
+            data = f.read(record.size)
+        if len(data) != record.size or zlib.crc32(data) != record.crc:
+            raise OSError(f"打包数据损坏: {rel_path} (段 {record.segment})")
+        return data
+
+    def extract(self, rel_path, out_path):
+        """
+        把单个文件还原到 out_path (内容、修改时间和权限)
+        """
+        record = self.get(rel_path)
+        data = self.read(rel_path)
+        parent = os.path.dirname(out_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        with open(out_path, 'wb') as f:
+            f.write(data)
+        os.utime(out_path, (record.mtime, record.mtime))
+        os.chmod(out_path, record.mode)
+
+    def compact(self, ratio=COMPACT_RATIO, stop_check=None):
+        """
+        回收失效数据过多的段: 有效记录追加到当前段，索引提交后删除旧段
+        返回: (回收的段数, 释放的字节数)
+        """
+        rows = self.conn.execute("SELECT id, size, dead FROM segments WHERE size > 0 AND dead >= size * ?",
+                                 (ratio,)).fetchall()
+        if not rows:
+            return 0, 0
+        # 有效记录写入新段，不会写回待回收的段
+        self._new_segment()
+        compacted, freed = 0, 0
+        for segment, size, dead in rows:
+            if stop_check and stop_check():
+                break
+            records = self.conn.execute(
+                "SELECT path, offset, size FROM files WHERE segment = ?", (segment,)).fetchall()
+            with open(self.segment_path(segment), 'rb') as src:
+                for path, offset, length in records:
+                    src.seek(offset)
+                    new_segment, new_offset = self._append(src.read(length))
+                    self.conn.execute("UPDATE files SET segment = ?, offset = ? WHERE path = ?",
+                                      (new_segment, new_offset, path))
+            self.conn.execute("DELETE FROM segments WHERE id = ?", (segment,))
+            self.commit()
+            os.unlink(self.segment_path(segment))
+            compacted += 1
+            freed += dead
+        return compacted, freed
+
+    def commit(self):
+        """
+        段数据落盘后再提交索引
+        """
+        if self._f is not None:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self):
+        if self.conn is not None:
+            self.commit()
+            self._close_segment()
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,170 @@
+import json
+import os
+import time
+
+PLAN_VERSION = 1
+
+PLAN_COPY = 'copy'
+PLAN_UPDATE = 'update'
+PLAN_MOVE = 'move'
+PLAN_CREATE_DIR = 'create_dir'
+PLAN_DELETE = 'delete'
+PLAN_DELETE_DIR = 'delete_dir'
+
+# 执行顺序: 先建目录和移动，再复制，最后删除 (目录从深到浅)
+PLAN_ACTIONS = (PLAN_CREATE_DIR, PLAN_MOVE, PLAN_COPY, PLAN_UPDATE, PLAN_DELETE, PLAN_DELETE_DIR)
+
+
+def _to_key(rel_path):
+    # 计划文件中统一使用 '/'，可以跨平台保存和加载
+    return rel_path.replace(os.sep, '/')
+
+
+def _from_key(key):
+    """
+    计划文件中的路径转换为本地相对路径
+    计划文件可能被修改过: 拒绝绝对路径、盘符和 '..'，执行时不会访问目标目录之外的位置
+    """
+    if not isinstance(key, str) or not key:
+        raise ValueError(f"计划中的路径无效: {key!r}")
+    parts = key.replace('\\', '/').split('/')
+    drive = len(key) >= 2 and key[1] == ':' and key[0].isalpha()
+    if key.startswith(('/', '\\')) or drive or '..' in parts:
+        raise ValueError(f"计划中的路径不是目标目录内的相对路径: {key}")
+    return key.replace('/', os.sep)
+
+
+class PlanItem:
+    """
+    计划中的单个操作
+    size/mtime 为规划时的源文件信息 (删除操作为目标文件信息)；from_path 仅用于移动
+    """
+    __slots__ = ('action', 'rel_path', 'size', 'mtime', 'from_path')
+
+    def __init__(self, action, rel_path, size=0, mtime=0, from_path=None):
+        self.action = action
+        self.rel_path = rel_path
+        self.size = size
+        self.mtime = mtime
+        self.from_path = from_path
+
+    def to_dict(self):
+        item = {'action': self.action, 'path': _to_key(self.rel_path)}
+        if self.action not in (PLAN_CREATE_DIR, PLAN_DELETE_DIR):
+            item['size'] = self.size
+            item['mtime'] = self.mtime
+        if self.from_path is not None:
+            item['from'] = _to_key(self.from_path)
+        return item
+
+    @classmethod
+    def from_dict(cls, data):
+        from_path = data.get('from')
+        return cls(data['action'], _from_key(data['path']), data.get('size', 0), data.get('mtime', 0),
+                   _from_key(from_path) if from_path is not None else None)
+
+    def __repr__(self):
+        return f"PlanItem({self.action!r}, {self.rel_path!r})"
+
+
+class BackupPlan:
+    """
+    备份计划 (预演结果)
+    记录一次备份将执行的全部操作，不修改目标目录；可保存为 JSON，之后按原样执行。
+    unchanged: 无需处理的文件数
+    """
+
+    def __init__(self, src_dir, dst_dir, sync_mode=False, created_at=None):
+        self.src_dir = src_dir
+        self.dst_dir = dst_dir
+        self.sync_mode = sync_mode
+        self.created_at = created_at if created_at is not None else time.time()
+        self.items = []
+        self.unchanged = 0
+        self.unreadable = []
+
+    def add(self, action, rel_path, size=0, mtime=0, from_path=None):
+        self.items.append(PlanItem(action, rel_path, size, mtime, from_path))
+
+    def ordered(self):
+        """
+        按执行顺序返回操作
+        """
+        order = {action: index for index, action in enumerate(PLAN_ACTIONS)}
+
+        def key(item):
+            if item.action == PLAN_DELETE_DIR:
+                return order[item.action], -item.rel_path.count(os.sep), item.rel_path
+            if item.action == PLAN_CREATE_DIR:
+                return order[item.action], item.rel_path.count(os.sep), item.rel_path
+            return order[item.action], 0, ''
+
+        return sorted(self.items, key=key)
+
+    def totals(self):
+        """
+        各类操作的数量和字节数
+        transfer_bytes: 需要写入目标设备的字节数 (复制 + 更新)
+        """
+        totals = {action: 0 for action in PLAN_ACTIONS}
+        totals.update(copy_bytes=0, update_bytes=0, move_bytes=0, delete_bytes=0)
+        for item in self.items:
+            totals[item.action] += 1
+            if item.action == PLAN_COPY:
+                totals['copy_bytes'] += item.size
+            elif item.action == PLAN_UPDATE:
+                totals['update_bytes'] += item.size
+            elif item.action == PLAN_MOVE:
+                totals['move_bytes'] += item.size
+            elif item.action == PLAN_DELETE:
+                totals['delete_bytes'] += item.size
+        totals['transfer_bytes'] = totals['copy_bytes'] + totals['update_bytes']
+        totals['unchanged'] = self.unchanged
+        return totals
+
+    def summary(self):
+        t = self.totals()
+        mb = 1024 * 1024
+        text = (f"复制 {t[PLAN_COPY]} 个文件 ({t['copy_bytes'] / mb:.1f} MB), "
+                f"更新 {t[PLAN_UPDATE]} 个文件 ({t['update_bytes'] / mb:.1f} MB), "
+                f"无变化 {t['unchanged']} 个文件")
+        if self.sync_mode:
+            text += (f", 移动 {t[PLAN_MOVE]}, 创建 {t[PLAN_CREATE_DIR]} 目录, "
+                     f"删除 {t[PLAN_DELETE]} 文件 ({t['delete_bytes'] / mb:.1f} MB), {t[PLAN_DELETE_DIR]} 目录")
+        return text
+
+    def to_dict(self):
+        return {
+            'version': PLAN_VERSION,
+            'src_dir': self.src_dir,
+            'dst_dir': self.dst_dir,
+            'sync_mode': self.sync_mode,
+            'created_at': self.created_at,
+            'totals': self.totals(),
+            'unreadable': [_to_key(p) for p in self.unreadable],
+            'items': [item.to_dict() for item in self.ordered()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != PLAN_VERSION:
+            raise ValueError(f"不支持的计划版本: {data.get('version')}")
+        plan = cls(data['src_dir'], data['dst_dir'], data.get('sync_mode', False), data.get('created_at'))
+        plan.unchanged = data.get('totals', {}).get('unchanged', 0)
+        plan.unreadable = [_from_key(p) for p in data.get('unreadable', [])]
+        for item in data.get('items', []):
+            if item.get('action') not in PLAN_ACTIONS:
+                raise ValueError(f"未知的计划操作: {item.get('action')}")
+            plan.items.append(PlanItem.from_dict(item))
+        return plan
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
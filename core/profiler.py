@@ -0,0 +1,330 @@
+import cProfile
+import heapq
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from datetime import datetime
+
+from core.logger import app_data_dir
+
+# 设置后启用性能分析，值为输出目录
+PROFILE_ENV = 'BAKUI_PROFILE'
+# 额外的采样方式: cprofile=在执行备份的线程中运行 cProfile, sample=定时采样所有线程的调用栈
+PROFILE_SAMPLER_ENV = 'BAKUI_PROFILE_SAMPLER'
+# 设为 0 时不记录逐文件的 span (只记录阶段)
+PROFILE_FILES_ENV = 'BAKUI_PROFILE_FILES'
+# 界面中启用时的默认输出目录 (应用数据目录下)
+PROFILE_DIR = os.path.join(app_data_dir(), 'bakui_profile')
+
+SAMPLER_CPROFILE = 'cprofile'
+SAMPLER_STACK = 'sample'
+SAMPLERS = (SAMPLER_CPROFILE, SAMPLER_STACK)
+
+# 最慢文件报告的条数
+TOP_FILES = 20
+# 调用栈采样间隔 (秒)
+STACK_SAMPLE_INTERVAL = 0.005
+# trace 文件中逐文件 span 的上限，超出后只计入最慢文件报告
+MAX_FILE_SPANS = 200000
+# cProfile 文本报告的函数数
+PSTATS_LIMIT = 60
+
+
+class Profiler:
+    """
+    一次备份任务的性能分析: 阶段和逐文件操作的计时 span (Chrome trace-event JSON，
+    可在 chrome://tracing 或 Perfetto 中打开)、最慢文件报告，以及可选的 cProfile / 调用栈采样。
+    span 可在任意线程中记录。
+    """
+
+    def __init__(self, file_spans=True, sampler=None, top_n=TOP_FILES, clock=time.perf_counter):
+        if sampler is not None and sampler not in SAMPLERS:
+            raise ValueError(f"未知的采样方式: {sampler}")
+        self.file_spans = file_spans
+        self.sampler = sampler
+        self.top_n = top_n
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._origin = clock()
+        self._events = []
+        self._threads = {}
+        # 阶段画在各自的虚拟线程上 (流水线中的阶段相互重叠)
+        self._phase_tids = {}
+        self._open_phases = {}
+        self._slowest = []
+        self._seq = 0
+        self.file_count = 0
+        self.dropped_spans = 0
+        self._cprofile = None
+        self._stack_sampler = None
+
+    def start(self):
+        """
+        开始采样 (cProfile 只分析调用 start 的线程)
+        """
+        if self.sampler == SAMPLER_CPROFILE:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        elif self.sampler == SAMPLER_STACK:
+            self._stack_sampler = StackSampler()
+            self._stack_sampler.start()
+
+    def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self._stack_sampler is not None:
+            self._stack_sampler.stop()
+        for name in list(self._open_phases):
+            self.end(name)
+
+    def _us(self, t):
+        return (t - self._origin) * 1e6
+
+    def _tid(self):
+        thread = threading.current_thread()
+        tid = thread.ident
+        if tid not in self._threads:
+            with self._lock:
+                self._threads.setdefault(tid, thread.name)
+        return tid
+
+    def _add(self, name, cat, start, duration, tid, args=None):
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'ts': self._us(start), 'dur': duration * 1e6,
+                 'pid': os.getpid(), 'tid': tid}
+        if args:
+            event['args'] = args
+        self._events.append(event)
+
+    def span(self, name, cat='phase', **args):
+        """
+        在当前线程中记录一段代码: with profiler.span('load_manifest'): ...
+        """
+        return _Span(self, name, cat, args)
+
+    def begin(self, name):
+        """
+        阶段开始 (可在不同的调用位置结束，见 end)
+        """
+        if name not in self._open_phases:
+            self._open_phases[name] = self._clock()
+
+    def end(self, name):
+        start = self._open_phases.pop(name, None)
+        if start is not None:
+            self._add_phase(name, start, self._clock())
+
+    def add_phase(self, name, start, end, now):
+        """
+        记录已结束的阶段，start/end 为另一个时钟上的时刻，now 为该时钟的当前时刻
+        """
+        base = self._clock() - now
+        self._add_phase(name, base + start, base + end)
+
+    def _add_phase(self, name, start, end):
+        with self._lock:
+            tid = self._phase_tids.get(name)
+            if tid is None:
+                tid = self._phase_tids[name] = len(self._phase_tids) + 1
+            self._add(name, 'phase', start, end - start, tid)
+
+    def operation(self, item, size=0, cat='copy'):
+        """
+        记录单个文件操作 (复制、删除等)，item 为 FileEntry 或路径
+        未启用逐文件 span 时不计时
+        """
+        if not self.file_spans:
+            return _NULL_SPAN
+        return _Operation(self, getattr(item, 'rel_path', item), size, cat)
+
+    def _operation_done(self, rel_path, size, cat, start, duration, error):
+        tid = self._tid()
+        with self._lock:
+            self.file_count += 1
+            if len(self._events) < MAX_FILE_SPANS:
+                args = {'bytes': size}
+                if error is not None:
+                    args['error'] = error
+                self._add(rel_path, cat, start, duration, tid, args)
+            else:
+                self.dropped_spans += 1
+            self._seq += 1
+            record = (duration, self._seq, cat, rel_path, size)
+            if len(self._slowest) < self.top_n:
+                heapq.heappush(self._slowest, record)
+            elif duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, record)
+
+    def slowest(self):
+        """
+        最慢的文件操作，按耗时从长到短: [{'path', 'action', 'bytes', 'duration'}]
+        """
+        with self._lock:
+            records = sorted(self._slowest, reverse=True)
+        return [{'path': rel_path, 'action': cat, 'bytes': size, 'duration': duration}
+                for duration, _seq, cat, rel_path, size in records]
+
+    def trace(self):
+        """
+        Chrome trace-event 格式的数据
+        """
+        pid = os.getpid()
+        with self._lock:
+            threads = list(self._threads.items())
+            phase_tids = list(self._phase_tids.items())
+            events = list(self._events)
+            file_count, dropped_spans = self.file_count, self.dropped_spans
+        meta = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'BakUI'}}]
+        for tid, name in threads:
+            meta.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+        for name, tid in phase_tids:
+            meta.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': f"阶段 {name}"}})
+            meta.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'sort_index': -100 + tid}})
+        return {
+            'traceEvents': meta + events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'file_operations': file_count, 'dropped_spans': dropped_spans},
+        }
+
+    def slowest_text(self):
+        lines = [f"最慢的 {self.top_n} 个文件操作 (共 {self.file_count} 个):",
+                 f"{'耗时(s)':>10}  {'操作':<8} {'大小(字节)':>14}  路径"]
+        for record in self.slowest():
+            lines.append(f"{record['duration']:10.3f}  {record['action']:<8} {record['bytes']:>14}  {record['path']}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, output_dir, run_id=None):
+        """
+        写入分析结果 (文件名为 bakui-profile-<时间>[-<run_id>])，返回写入的文件路径
+        <name>.trace.json: 阶段和文件操作的 span
+        <name>.slowest.txt: 最慢文件报告
+        <name>.prof / <name>.pstats.txt: cProfile 结果 (pstats 格式及按累计耗时排序的文本)
+        <name>.folded: 调用栈采样 (flamegraph.pl / speedscope 使用的折叠格式)
+        """
+        name = f"bakui-profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        if run_id:
+            name += f"-{run_id}"
+        os.makedirs(output_dir, exist_ok=True)
+        base = os.path.join(output_dir, name)
+        paths = []
+
+        def write_text(suffix, text):
+            path = base + suffix
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            paths.append(path)
+
+        write_text('.trace.json', json.dumps(self.trace(), ensure_ascii=False))
+        if self.file_spans:
+            write_text('.slowest.txt', self.slowest_text())
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(base + '.prof')
+            paths.append(base + '.prof')
+            out = io.StringIO()
+            pstats.Stats(self._cprofile, stream=out).sort_stats('cumulative').print_stats(PSTATS_LIMIT)
+            write_text('.pstats.txt', out.getvalue())
+        if self._stack_sampler is not None:
+            write_text('.folded', self._stack_sampler.folded())
+        return paths
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, profiler, name, cat, args):
+        self.profiler = profiler
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = self.profiler._clock()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        profiler = self.profiler
+        duration = profiler._clock() - self.start
+        tid = profiler._tid()
+        with profiler._lock:
+            profiler._add(self.name, self.cat, self.start, duration, tid, self.args)
+        return False
+
+
+class _Operation:
+    __slots__ = ('profiler', 'rel_path', 'size', 'cat', 'start')
+
+    def __init__(self, profiler, rel_path, size, cat):
+        self.profiler = profiler
+        self.rel_path = rel_path
+        self.size = size
+        self.cat = cat
+
+    def __enter__(self):
+        self.start = self.profiler._clock()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = self.profiler._clock() - self.start
+        error = None if exc is None else f"{exc_type.__name__}: {exc}"
+        self.profiler._operation_done(self.rel_path, self.size, self.cat, self.start, duration, error)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class StackSampler:
+    """
+    定时采样所有线程的 Python 调用栈 (后台线程)，开销与文件数无关，适合长时间任务
+    线程池中的线程按名称前缀合并 (bakui-copy_0、bakui-copy_1 -> bakui-copy)
+    """
+
+    def __init__(self, interval=STACK_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self._counts = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bakui-profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name.rsplit('_', 1)[0] for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(tid, str(tid)))
+                key = ';'.join(reversed(stack))
+                self._counts[key] = self._counts.get(key, 0) + 1
+            self.samples += 1
+
+    def folded(self):
+        """
+        折叠格式: 每行 "线程;外层函数;...;内层函数 次数"
+        """
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self._counts.items()))
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from core.copier import CopyStopped
+from core.manifest import META_DIR
+
+# 超过该大小的文件使用可续传的分块复制
+RESUME_THRESHOLD = 64 * 1024 * 1024
+RESUME_CHUNK_SIZE = 8 * 1024 * 1024
+# 每写入这么多字节落盘一次并更新进度日志
+JOURNAL_INTERVAL = 64 * 1024 * 1024
+# 超过该时间未续传的临时文件会被清理
+PARTIAL_MAX_AGE = 7 * 24 * 3600
+
+PARTIAL_DIR = 'partial'
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ResumableCopier:
+    """
+    可续传的分块复制
+    数据先写入 <dst>/.bakui/partial/ 下的 .part 临时文件，并在旁边的 .json 进度日志中
+    记录 源文件大小/修改时间/已落盘偏移/最后一块校验和；中断后下次从最后校验通过的偏移继续。
+    每块之间检查停止标志，完成后原子重命名到目标路径。
+    """
+
+    def __init__(self, dst_root, chunk_size=RESUME_CHUNK_SIZE, journal_interval=JOURNAL_INTERVAL):
+        self.dst_root = dst_root
+        self.chunk_size = chunk_size
+        self.journal_interval = journal_interval
+        self.partial_dir = os.path.join(dst_root, META_DIR, PARTIAL_DIR)
+
+    def _paths(self, rel_path):
+        key = hashlib.sha1(rel_path.replace(os.sep, '/').encode('utf-8')).hexdigest()
+        base = os.path.join(self.partial_dir, key)
+        return base + '.part', base + '.json'
+
+    def _load_journal(self, journal_path):
+        try:
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_journal(self, journal_path, journal):
+        tmp_path = journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(journal, f)
+        os.replace(tmp_path, journal_path)
+
+    def _resume_offset(self, journal, src_st, fsrc, part_path):
+        """
+        校验进度日志，返回可以继续的偏移 (不可续传时返回 0)
+        """
+        if (journal is None or journal.get('size') != src_st.st_size
+                or journal.get('mtime') != src_st.st_mtime
+                or journal.get('chunk_size') != self.chunk_size):
+            return 0
+        offset = journal.get('offset', 0)
+        last_len = journal.get('last_len', 0)
+        try:
+            if offset <= 0 or os.path.getsize(part_path) < offset:
+                return 0
+            # 比对最后一块，确认临时文件内容可信
+            with open(part_path, 'rb') as fpart:
+                fpart.seek(offset - last_len)
+                if _digest(fpart.read(last_len)) != journal.get('last_digest'):
+                    return 0
+            fsrc.seek(offset - last_len)
+            if _digest(fsrc.read(last_len)) != journal.get('last_digest'):
+                return 0
+        except OSError:
+            return 0
+        return offset
+
+    def copy(self, src_path, dst_path, rel_path, stop_check=None):
+        """
+        分块复制 src_path 到 dst_path
+        返回: 本次实际写入的字节数 (续传时小于文件大小)
+        中途停止时抛出 CopyStopped，临时文件和进度日志保留用于下次续传
+        """
+        part_path, journal_path = self._paths(rel_path)
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+        with open(src_path, 'rb') as fsrc:
+            src_st = os.fstat(fsrc.fileno())
+            previous = self._load_journal(journal_path)
+            offset = self._resume_offset(previous, src_st, fsrc, part_path)
+            start_offset = offset
+            journal = {'rel_path': rel_path, 'size': src_st.st_size, 'mtime': src_st.st_mtime,
+                       'chunk_size': self.chunk_size, 'offset': offset, 'last_len': 0, 'last_digest': None}
+            if offset:
+                journal['last_len'] = previous['last_len']
+                journal['last_digest'] = previous['last_digest']
+
+            mode = 'r+b' if offset else 'wb'
+            with open(part_path, mode) as fpart:
+                fpart.truncate(offset)
+                fsrc.seek(offset)
+                fpart.seek(offset)
+                unsynced = 0
+                while True:
+                    if stop_check and stop_check():
+                        self._checkpoint(fpart, journal_path, journal)
+                        raise CopyStopped()
+                    chunk = fsrc.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    fpart.write(chunk)
+                    offset += len(chunk)
+                    unsynced += len(chunk)
+                    journal['offset'] = offset
+                    journal['last_len'] = len(chunk)
+                    journal['last_digest'] = _digest(chunk)
+                    if unsynced >= self.journal_interval:
+                        self._checkpoint(fpart, journal_path, journal)
+                        unsynced = 0
+
+        shutil.copystat(src_path, part_path)
+        os.replace(part_path, dst_path)
+        try:
+            os.remove(journal_path)
+        except OSError:
+            pass
+        return offset - start_offset
+
+    def _checkpoint(self, fpart, journal_path, journal):
+        # 先让数据落盘，再记录偏移，保证日志中的偏移之前的数据都已写入
+        fpart.flush()
+        os.fsync(fpart.fileno())
+        self._save_journal(journal_path, journal)
+
+    def discard(self, rel_path):
+        for path in self._paths(rel_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def cleanup(self, max_age=PARTIAL_MAX_AGE):
+        """
+        清理长时间未续传的临时文件
+        返回: 清理的文件数
+        """
+        removed = 0
+        try:
+            entries = list(os.scandir(self.partial_dir))
+        except OSError:
+            return 0
+        now = time.time()
+        for entry in entries:
+            try:
+                if now - entry.stat().st_mtime > max_age:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
@@ -0,0 +1,146 @@
+import os
+import stat
+from collections import OrderedDict
+
+
+class FileEntry:
+    """
+    扫描得到的文件记录，stat 结果只取一次并在后续比对中复用
+    """
+    __slots__ = ('rel_path', 'size', 'mtime', 'ino', 'mode', 'ctime')
+
+    def __init__(self, rel_path, size, mtime, ino=0, mode=0, ctime=0):
+        self.rel_path = rel_path
+        self.size = size
+        self.mtime = mtime
+        self.ino = ino
+        self.mode = mode
+        self.ctime = ctime
+
+    @classmethod
+    def from_stat(cls, rel_path, st):
+        return cls(rel_path, st.st_size, st.st_mtime, st.st_ino, st.st_mode, st.st_ctime)
+
+    def __repr__(self):
+        return f"FileEntry({self.rel_path!r}, size={self.size}, mtime={self.mtime})"
+
+
+def _join(rel_dir, name):
+    return name if not rel_dir else rel_dir + os.sep + name
+
+
+def scan_dir(path, rel_dir='', on_error=None):
+    """
+    扫描单个目录 (不递归)
+    返回: (files, subdirs)，files 为 {文件名: FileEntry}，subdirs 为子目录名列表；
+    目录不存在时返回 (None, None)
+    只记录普通文件 (及指向普通文件的符号链接)，命名管道、套接字、设备等特殊文件不备份
+    """
+    files = {}
+    subdirs = []
+    try:
+        it = os.scandir(path)
+    except FileNotFoundError:
+        return None, None
+    except OSError as e:
+        if on_error:
+            on_error(path, e)
+        return None, None
+
+    with it:
+        for entry in it:
+            try:
+                # 不跟随符号链接: 指向目录的符号链接既不记录也不进入
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirs.append(entry.name)
+                    continue
+                st = entry.stat()
+            except OSError as e:
+                if on_error:
+                    on_error(entry.path, e)
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            files[entry.name] = FileEntry.from_stat(_join(rel_dir, entry.name), st)
+    return files, subdirs
+
+
+def iter_tree(root, stop_check=None, on_error=None, exclude=()):
+    """
+    基于 os.scandir 的目录遍历 (先序)
+    逐目录产出 (rel_dir, files, subdirs)，根目录的 rel_dir 为 ''
+    exclude: 根目录下需要忽略的名称 (例如备份元数据目录)
+    """
+    stack = ['']
+    while stack:
+        if stop_check and stop_check():
+            return
+        rel_dir = stack.pop()
+        path = os.path.join(root, rel_dir) if rel_dir else root
+        files, subdirs = scan_dir(path, rel_dir, on_error)
+        if files is None:
+            continue
+        if not rel_dir and exclude:
+            for name in exclude:
+                files.pop(name, None)
+            subdirs = [d for d in subdirs if d not in exclude]
+        yield rel_dir, files, subdirs
+        # 逆序入栈以保持目录名的自然顺序
+        for name in reversed(subdirs):
+            stack.append(_join(rel_dir, name))
+
+
+def scan_tree(root, stop_check=None, on_error=None, exclude=()):
+    """
+    扫描整个目录树
+    返回: (files, dirs)，files 为 {相对路径: FileEntry}，dirs 为相对目录路径集合 (不含根目录)
+    """
+    all_files = {}
+    all_dirs = set()
+    for rel_dir, files, subdirs in iter_tree(root, stop_check, on_error, exclude):
+        if rel_dir:
+            all_dirs.add(rel_dir)
+        for entry in files.values():
+            all_files[entry.rel_path] = entry
+    return all_files, all_dirs
+
+
+class DirectoryLookup:
+    """
+    按目录懒加载目标目录的文件列表
+    同一目录只 scandir 一次，比对阶段不再对单个文件调用 stat/exists
+    """
+
+    def __init__(self, root, max_dirs=64, on_error=None):
+        self.root = root
+        self.max_dirs = max_dirs
+        self.on_error = on_error
+        self._cache = OrderedDict()
+
+    def _listing(self, rel_dir):
+        files = self._cache.get(rel_dir)
+        if files is not None or rel_dir in self._cache:
+            self._cache.move_to_end(rel_dir)
+            return files
+        path = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        files, _ = scan_dir(path, rel_dir, self.on_error)
+        self._cache[rel_dir] = files
+        if len(self._cache) > self.max_dirs:
+            self._cache.popitem(last=False)
+        return files
+
+    def dir_exists(self, rel_dir):
+        return self._listing(rel_dir) is not None
+
+    def mark_created(self, rel_dir):
+        """目录已由调用方创建，视为空目录 (已列出的目录保留缓存的列表)"""
+        if self._cache.get(rel_dir) is None:
+            self._cache[rel_dir] = {}
+
+    def get(self, rel_path):
+        rel_dir, name = os.path.split(rel_path)
+        files = self._listing(rel_dir)
+        if files is None:
+            return None
+        return files.get(name)
@@ -0,0 +1,114 @@
+import os
+import time
+
+# 快照目录名 (目标目录根部)，按名称排序即按时间排序
+SNAPSHOT_FORMAT = '%Y-%m-%d_%H%M%S'
+# 尚未完成的快照目录后缀，完成后原子重命名去掉
+PARTIAL_SUFFIX = '.partial'
+# 默认保留策略: 最近 3 个快照，最近 7 个有快照的日期各保留一个，最近 4 个有快照的周各保留一个
+KEEP_LAST = 3
+KEEP_DAILY = 7
+KEEP_WEEKLY = 4
+
+
+def parse_snapshot_name(name):
+    """
+    返回快照名称对应的 struct_time，不是快照目录时返回 None
+    """
+    parts = name.split('_', 2)
+    if len(parts) > 2:
+        # 同一秒内的多次快照带有序号后缀
+        if not parts[2].isdigit():
+            return None
+        name = parts[0] + '_' + parts[1]
+    try:
+        return time.strptime(name, SNAPSHOT_FORMAT)
+    except ValueError:
+        return None
+
+
+def expired_snapshots(names, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY, keep_last=KEEP_LAST):
+    """
+    按保留策略选出需要删除的快照 (names 为快照名称)
+    最新的 keep_last 个快照 (至少一个) 总是保留，此外每个日期/ISO 周保留其中最新的快照
+    """
+    names = sorted(names)
+    if not names:
+        return []
+    keep = set(names[-max(keep_last, 1):])
+    days, weeks = set(), set()
+    for name in reversed(names):
+        t = parse_snapshot_name(name)
+        day = (t.tm_year, t.tm_yday)
+        week = time.strftime('%G-%V', t)
+        if day not in days and len(days) < keep_daily:
+            days.add(day)
+            keep.add(name)
+        if week not in weeks and len(weeks) < keep_weekly:
+            weeks.add(week)
+            keep.add(name)
+    return [name for name in names if name not in keep]
+
+
+class SnapshotStore:
+    """
+    目标目录中的时间点快照
+    每次备份创建一个以时间命名的快照目录，未变化的文件硬链接到上一个快照 (不占额外空间)，
+    变化的文件重新复制；快照中的文件只会被整体替换，不会被原地修改 (硬链接共享同一份数据)。
+    删除快照只是减少链接数，文件数据在最后一个链接删除时才被释放。
+    """
+
+    def __init__(self, dst_dir):
+        self.dst_dir = dst_dir
+
+    def snapshots(self):
+        """
+        已完成的快照名称 (从旧到新)
+        """
+        try:
+            names = [e.name for e in os.scandir(self.dst_dir) if e.is_dir(follow_symlinks=False)]
+        except FileNotFoundError:
+            return []
+        return sorted(n for n in names if parse_snapshot_name(n) is not None)
+
+    def partials(self):
+        """
+        未完成的快照目录名称 (上次备份被中断)
+        """
+        try:
+            names = [e.name for e in os.scandir(self.dst_dir) if e.is_dir(follow_symlinks=False)]
+        except FileNotFoundError:
+            return []
+        return sorted(n for n in names if n.endswith(PARTIAL_SUFFIX)
+                      and parse_snapshot_name(n[:-len(PARTIAL_SUFFIX)]) is not None)
+
+    def latest(self):
+        names = self.snapshots()
+        return names[-1] if names else None
+
+    def path(self, name):
+        return os.path.join(self.dst_dir, name)
+
+    def begin(self):
+        """
+        返回本次写入的快照目录名称: 续用最新的未完成快照 (已写入的文件不再复制)，否则新建
+        """
+        partials = self.partials()
+        if partials:
+            return partials[-1]
+        name = time.strftime(SNAPSHOT_FORMAT) + PARTIAL_SUFFIX
+        os.makedirs(self.path(name), exist_ok=True)
+        return name
+
+    def commit(self, partial):
+        """
+        把完成的快照重命名为正式名称 (以完成时间命名)，返回快照名称
+        """
+        base = time.strftime(SNAPSHOT_FORMAT)
+        name, seq = base, 1
+        existing = set(self.snapshots())
+        while name in existing:
+            seq += 1
+            name = f"{base}_{seq}"
+        os.rename(self.path(partial), self.path(name))
+        return name
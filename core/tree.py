@@ -0,0 +1,220 @@
+import os
+import sys
+from array import array
+from bisect import bisect_left
+
+from core.scanner import FileEntry, iter_tree
+
+
+class DirNode:
+    """
+    目录节点
+    文件按名称排序后存放在列式数组中 (名称/大小/修改时间/inode)，不为每个文件保存完整路径；
+    父目录通过 parent 指针获得，无需拼接路径字符串。
+    seen/marked: 比对时标记源目录中仍存在的文件/目录
+    """
+    __slots__ = ('name', 'parent', 'children', 'names', 'sizes', 'mtimes', 'inos', 'seen', 'marked', 'dirty')
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.children = None
+        self.names = []
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        self.inos = array('Q')
+        self.seen = bytearray()
+        self.marked = False
+        self.dirty = False
+
+    def append(self, name, size, mtime, ino):
+        self.names.append(sys.intern(name))
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+        self.inos.append(ino or 0)
+        self.seen.append(0)
+        self.dirty = True
+
+    def _sort(self):
+        # 按名称重排各列，之后可以二分查找
+        order = sorted(range(len(self.names)), key=self.names.__getitem__)
+        self.names[:] = [self.names[i] for i in order]
+        self.sizes[:] = array('q', (self.sizes[i] for i in order))
+        self.mtimes[:] = array('d', (self.mtimes[i] for i in order))
+        self.inos[:] = array('Q', (self.inos[i] for i in order))
+        self.seen[:] = bytearray(self.seen[i] for i in order)
+        self.dirty = False
+
+    def index(self, name):
+        if self.dirty:
+            self._sort()
+        i = bisect_left(self.names, name)
+        if i < len(self.names) and self.names[i] == name:
+            return i
+        return -1
+
+    def child(self, name, create=False):
+        if self.children is None:
+            if not create:
+                return None
+            self.children = {}
+        node = self.children.get(name)
+        if node is None and create:
+            name = sys.intern(name)
+            node = self.children[name] = DirNode(name, self)
+        return node
+
+    def rel_path(self):
+        parts = []
+        node = self
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return os.sep.join(reversed(parts))
+
+
+class FileTree:
+    """
+    紧凑的目录树 (同步比对时的目标目录索引)
+    内存占用取决于文件名字节数而不是完整路径的副本，相同的文件名只保存一份。
+    get() 按需生成 FileEntry；源目录扫描时用 mark()/mark_dir() 标记仍存在的路径，
+    未标记的即为需要删除的内容，不再需要源路径集合。
+    """
+
+    def __init__(self):
+        self.root = DirNode('')
+        self.file_count = 0
+        self.dir_count = 0
+
+    def __len__(self):
+        return self.file_count
+
+    @classmethod
+    def scan(cls, root, stop_check=None, on_error=None, exclude=()):
+        """
+        扫描目录树 (参数同 iter_tree)
+        """
+        tree = cls()
+        for rel_dir, files, subdirs in iter_tree(root, stop_check, on_error, exclude):
+            node = tree.add_dir(rel_dir)
+            for name, entry in files.items():
+                node.append(name, entry.size, entry.mtime, entry.ino)
+            tree.file_count += len(files)
+        return tree
+
+    def _node(self, rel_dir):
+        node = self.root
+        if not rel_dir:
+            return node
+        for name in rel_dir.split(os.sep):
+            node = node.child(name)
+            if node is None:
+                return None
+        return node
+
+    def add_dir(self, rel_dir):
+        """
+        添加目录 (父目录自动添加)，返回目录节点
+        """
+        node = self.root
+        if not rel_dir:
+            return node
+        for name in rel_dir.split(os.sep):
+            child = node.child(name)
+            if child is None:
+                child = node.child(name, create=True)
+                self.dir_count += 1
+            node = child
+        return node
+
+    def add_file(self, rel_path, size, mtime, ino=0):
+        rel_dir, name = os.path.split(rel_path)
+        self.add_dir(rel_dir).append(name, size, mtime, ino)
+        self.file_count += 1
+
+    def has_dir(self, rel_dir):
+        return self._node(rel_dir) is not None
+
+    def _locate(self, rel_path):
+        rel_dir, name = os.path.split(rel_path)
+        node = self._node(rel_dir)
+        if node is None:
+            return None, -1
+        return node, node.index(name)
+
+    def get(self, rel_path):
+        """
+        返回文件的 FileEntry，不存在时返回 None
+        """
+        node, i = self._locate(rel_path)
+        if i < 0:
+            return None
+        return FileEntry(rel_path, node.sizes[i], node.mtimes[i], node.inos[i])
+
+    def __contains__(self, rel_path):
+        return self._locate(rel_path)[1] >= 0
+
+    def mark(self, rel_path):
+        """
+        标记文件在源目录中存在，返回目标中是否有该文件
+        """
+        node, i = self._locate(rel_path)
+        if i < 0:
+            return False
+        node.seen[i] = 1
+        return True
+
+    def mark_dir(self, rel_dir):
+        """
+        标记目录及其所有父目录在源目录中存在
+        """
+        node = self._node(rel_dir)
+        while node is not None and not node.marked:
+            node.marked = True
+            node = node.parent
+
+    def _walk(self):
+        # 先序遍历，产出 (节点, 相对路径)
+        stack = [(self.root, '')]
+        while stack:
+            node, rel_dir = stack.pop()
+            yield node, rel_dir
+            if node.children:
+                for name in sorted(node.children, reverse=True):
+                    stack.append((node.children[name], name if not rel_dir else rel_dir + os.sep + name))
+
+    def _files(self, node, rel_dir, unseen_only=False):
+        if node.dirty:
+            node._sort()
+        prefix = rel_dir + os.sep if rel_dir else ''
+        for i, name in enumerate(node.names):
+            if unseen_only and node.seen[i]:
+                continue
+            yield FileEntry(prefix + name, node.sizes[i], node.mtimes[i], node.inos[i])
+
+    def iter_files(self):
+        for node, rel_dir in self._walk():
+            yield from self._files(node, rel_dir)
+
+    def iter_dirs(self):
+        """
+        产出所有目录的相对路径 (不含根目录)
+        """
+        for node, rel_dir in self._walk():
+            if rel_dir:
+                yield rel_dir
+
+    def unmarked_files(self):
+        """
+        产出未被标记的文件 (源目录中已不存在)
+        """
+        for node, rel_dir in self._walk():
+            yield from self._files(node, rel_dir, unseen_only=True)
+
+    def unmarked_dirs(self):
+        """
+        产出未被标记的目录 (源目录中已不存在，不含根目录)
+        """
+        for node, rel_dir in self._walk():
+            if rel_dir and not node.marked:
+                yield rel_dir
@@ -0,0 +1,251 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from core.scanner import scan_dir, iter_tree
+
+# 变化平静该时间后才处理 (同一文件连续写入只复制一次)
+WATCH_DEBOUNCE = 1.0
+# 持续变化时最长等待时间，避免一直推迟备份
+WATCH_MAX_DELAY = 10.0
+# 轮询回退的扫描间隔
+POLL_INTERVAL = 5.0
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_ONLYDIR | IN_DONT_FOLLOW)
+_EVENT = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+
+def _join(rel_dir, name):
+    return name if not rel_dir else rel_dir + os.sep + name
+
+
+class InotifyWatcher:
+    """
+    基于 inotify 的目录树监视 (Linux，通过 ctypes 调用 libc)
+    每个目录一个监视；新建或移入的目录会立即加入监视，并把其中已有的内容报告为变化
+    (目录创建与加入监视之间写入的文件不会产生事件)。
+    监视数量超过系统上限 (fs.inotify.max_user_watches) 时抛出 OSError，由调用方改为轮询。
+    """
+
+    def __init__(self, root, exclude=()):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify 仅在 Linux 上可用")
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 失败: {os.strerror(err)}")
+        self.root = root
+        self.exclude = set(exclude)
+        self._paths = {}
+        self._wds = {}
+        try:
+            self._add_tree('')
+        except OSError:
+            self.close()
+            raise
+
+    @property
+    def watch_count(self):
+        return len(self._paths)
+
+    def _watch(self, rel_dir):
+        path = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise OSError(err, f"无法监视目录 {path}: {os.strerror(err)}")
+        self._paths[wd] = rel_dir
+        self._wds[rel_dir] = wd
+        return True
+
+    def _add_tree(self, rel_dir):
+        """
+        监视目录及其所有子目录，返回其中已有的文件和子目录 (相对路径)
+        """
+        found = []
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            # 先加入监视再列出目录，两者之间新建的文件不会遗漏
+            if not self._watch(current):
+                continue
+            files, subdirs = scan_dir(os.path.join(self.root, current) if current else self.root, current)
+            if files is None:
+                continue
+            if not current:
+                subdirs = [d for d in subdirs if d not in self.exclude]
+                files = {name: entry for name, entry in files.items() if name not in self.exclude}
+            found.extend(entry.rel_path for entry in files.values())
+            for name in subdirs:
+                child = _join(current, name)
+                found.append(child)
+                stack.append(child)
+        return found
+
+    def _remove_tree(self, rel_dir):
+        # 目录被移走后其监视仍然有效但路径已过期，移除整个子树的监视
+        prefix = rel_dir + os.sep
+        for path in [p for p in self._wds if p == rel_dir or p.startswith(prefix)]:
+            wd = self._wds.pop(path)
+            self._paths.pop(wd, None)
+            self._rm_watch(self.fd, wd)
+
+    def changes(self, timeout):
+        """
+        等待最多 timeout 秒，返回: (变化的相对路径集合, 是否发生事件溢出)
+        """
+        paths = set()
+        overflow = False
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return paths, overflow
+        while True:
+            try:
+                data = os.read(self.fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0')
+                offset += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & IN_IGNORED:
+                    rel_dir = self._paths.pop(wd, None)
+                    if rel_dir is not None and self._wds.get(rel_dir) == wd:
+                        del self._wds[rel_dir]
+                    continue
+                rel_dir = self._paths.get(wd)
+                if rel_dir is None or not name:
+                    continue
+                name = os.fsdecode(name)
+                if not rel_dir and name in self.exclude:
+                    continue
+                rel_path = _join(rel_dir, name)
+                paths.add(rel_path)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        paths.update(self._add_tree(rel_path))
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._remove_tree(rel_path)
+        return paths, overflow
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """
+    轮询监视 (inotify 不可用时的回退)
+    定期扫描整个目录树并与上次的快照比较，快照内存与文件数成正比。
+    """
+
+    def __init__(self, root, exclude=(), interval=POLL_INTERVAL):
+        self.root = root
+        self.exclude = tuple(exclude)
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._next = time.monotonic() + interval
+
+    def _scan(self):
+        snapshot = {}
+        for rel_dir, files, subdirs in iter_tree(self.root, exclude=self.exclude):
+            for name in subdirs:
+                snapshot[_join(rel_dir, name)] = None
+            for entry in files.values():
+                snapshot[entry.rel_path] = (entry.size, entry.mtime, entry.ino)
+        return snapshot
+
+    def changes(self, timeout):
+        wait = self._next - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set(), False
+        time.sleep(max(wait, 0))
+        snapshot = self._scan()
+        old = self._snapshot
+        paths = {p for p in snapshot if p not in old or old[p] != snapshot[p]}
+        paths.update(p for p in old if p not in snapshot)
+        self._snapshot = snapshot
+        self._next = time.monotonic() + self.interval
+        return paths, False
+
+    def close(self):
+        self._snapshot = {}
+
+
+class DirtySet:
+    """
+    待备份路径集合 (防抖)
+    最后一次变化后平静 debounce 秒，或第一次变化后已等待 max_delay 秒时可以取出
+    """
+
+    def __init__(self, debounce=WATCH_DEBOUNCE, max_delay=WATCH_MAX_DELAY):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._paths = set()
+        self._first = 0
+        self._last = 0
+
+    def __len__(self):
+        return len(self._paths)
+
+    def add(self, paths):
+        if not paths:
+            return
+        now = time.monotonic()
+        if not self._paths:
+            self._first = now
+        self._last = now
+        self._paths.update(paths)
+
+    def ready(self):
+        if not self._paths:
+            return False
+        now = time.monotonic()
+        return now - self._last >= self.debounce or now - self._first >= self.max_delay
+
+    def take(self):
+        """
+        取出所有路径 (排序后父目录在前)
+        """
+        paths = sorted(self._paths)
+        self._paths = set()
+        return paths
+
+    def clear(self):
+        self._paths = set()
@@ -0,0 +1,49 @@
+from collections import deque
+
+# GUI 线程处理事件的间隔 (毫秒)
+PUMP_INTERVAL_MS = 50
+# 日志窗口最多保留的行数
+LOG_MAX_LINES = 5000
+
+
+class EventPump:
+    """
+    后台线程与 GUI 线程之间的事件队列 (不依赖 Tk)
+    后台线程只向 deque 追加 (append/popleft 是原子操作，无需加锁)，GUI 线程按固定间隔统一取出:
+    进度只保留最新的一条，日志合并为一次插入，超出上限的旧日志在入队时即被丢弃。
+    """
+
+    def __init__(self, max_lines=LOG_MAX_LINES):
+        self._progress = deque(maxlen=1)
+        self._lines = deque(maxlen=max_lines)
+        self._calls = deque()
+
+    def post_progress(self, percent, total, message):
+        self._progress.append((percent, total, message))
+
+    def post_log(self, message):
+        self._lines.append(message)
+
+    def call(self, func):
+        """
+        在 GUI 线程中执行 func (替代在后台线程中调用 root.after)
+        """
+        self._calls.append(func)
+
+    @staticmethod
+    def _take(items):
+        taken = []
+        for _ in range(len(items)):
+            try:
+                taken.append(items.popleft())
+            except IndexError:
+                break
+        return taken
+
+    def drain(self):
+        """
+        取出积累的事件 (GUI 线程调用)
+        返回: (最新进度 (percent, total, message) 或 None, 日志行列表, 待执行的回调列表)
+        """
+        progress = self._take(self._progress)
+        return (progress[0] if progress else None), self._take(self._lines), self._take(self._calls)
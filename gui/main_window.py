@@ -1,15 +1,34 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, simpledialog
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
+import logging
 import threading
 import os
 
-from core.logger import Logger
+from core.logger import Logger, LOG_FILE, CATEGORY_FILE
 from core.history import HistoryManager
 from core.backup import BackupManager
+from core.compress import COMPRESS_GZIP, COMPRESS_BZ2, COMPRESS_XZ
+from core.copier import DEFAULT_COPY_WORKERS, MAX_COPY_WORKERS
+from core.hashing import COMPARE_METADATA, COMPARE_CONTENT, COMPARE_VERIFY
+from core.pack import PackStore
+from core.plan import BackupPlan
+from core.profiler import PROFILE_DIR, SAMPLER_CPROFILE, SAMPLER_STACK
 from core.updater import Updater
 from core.version import VERSION
+from gui.event_pump import EventPump, LOG_MAX_LINES, PUMP_INTERVAL_MS
+
+# 预览窗口最多列出的操作数
+PLAN_PREVIEW_LIMIT = 2000
+
+PLAN_ACTION_LABELS = {
+    'copy': "复制", 'update': "更新", 'move': "移动",
+    'create_dir': "创建目录", 'delete': "删除", 'delete_dir': "删除目录",
+}
+
+# 性能分析的采样方式 (阶段和逐文件计时总是记录)
+PROFILE_SAMPLER_LABELS = {"仅计时": None, "cProfile": SAMPLER_CPROFILE, "调用栈采样": SAMPLER_STACK}
 
 class MainWindow:
     def __init__(self):
@@ -17,21 +36,36 @@ class MainWindow:
         self.history_manager = HistoryManager()
         self.backup_manager = BackupManager()
         self.updater = Updater()
+        # 后台线程的进度、日志和回调统一经由事件队列交给 GUI 线程
+        self.pump = EventPump()
         
         self.root = ttk.Window(themename="cosmo")
         self.root.title(f"BakUI - 备份工具 {VERSION}")
-        self.root.geometry("700x500")
+        self.root.geometry("820x620")
         
         # 连接日志回调
         self.logger.set_gui_callback(self.append_log)
+        # 结构化日志文件 (逐文件记录和每次任务的摘要)
+        try:
+            self.logger.set_log_file(LOG_FILE)
+        except OSError as e:
+            self.logger.warning(f"无法创建日志文件 {LOG_FILE}: {e}")
         
         self._init_ui()
         self._init_menu()
+        self.root.after(PUMP_INTERVAL_MS, self._pump_events)
         
     def _init_menu(self):
         menubar = tk.Menu(self.root)
         self.root.config(menu=menubar)
         
+        file_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="文件", menu=file_menu)
+        file_menu.add_command(label="打开备份计划...", command=self._open_plan)
+        file_menu.add_command(label="从去重存储恢复...", command=self._restore_dedup)
+        file_menu.add_command(label="从打包备份提取文件...", command=self._extract_packed)
+        file_menu.add_command(label="导出运行报告...", command=self._export_report)
+        
         help_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="帮助", menu=help_menu)
         help_menu.add_command(label=f"版本: {VERSION}", state="disabled")
@@ -74,16 +108,72 @@ class MainWindow:
         
         # 备份模式选择
         mode_frame = ttk.Frame(path_frame)
-        mode_frame.grid(row=2, column=0, columnspan=3, sticky=W, pady=10)
+        mode_frame.grid(row=2, column=0, columnspan=3, sticky=W, pady=(10, 0))
         
         ttk.Label(mode_frame, text="备份模式:").pack(side=LEFT, padx=(0, 10))
         self.backup_mode_var = tk.StringVar(value="incremental")
         ttk.Radiobutton(mode_frame, text="增量备份", variable=self.backup_mode_var, value="incremental").pack(side=LEFT, padx=5)
         ttk.Radiobutton(mode_frame, text="同步备份", variable=self.backup_mode_var, value="sync").pack(side=LEFT, padx=5)
+        # 实时备份 (增量/同步): 完整备份后持续监视源目录，只备份变化的文件，直到点击停止
+        self.watch_var = tk.BooleanVar(value=False)
+        self.watch_check = ttk.Checkbutton(mode_frame, text="实时监视", variable=self.watch_var)
+        self.watch_check.pack(side=LEFT, padx=(0, 10))
+        self.backup_mode_var.trace_add("write", lambda *args: self._update_watch_state())
+        ttk.Radiobutton(mode_frame, text="快照备份", variable=self.backup_mode_var, value="snapshot").pack(side=LEFT, padx=5)
+        ttk.Radiobutton(mode_frame, text="去重存储", variable=self.backup_mode_var, value="dedup").pack(side=LEFT, padx=5)
+        ttk.Radiobutton(mode_frame, text="打包小文件", variable=self.backup_mode_var, value="packed").pack(side=LEFT, padx=5)
+        ttk.Radiobutton(mode_frame, text="压缩备份", variable=self.backup_mode_var, value="compressed").pack(side=LEFT, padx=5)
+        # 压缩备份使用的算法
+        self.compress_algo_var = tk.StringVar(value=COMPRESS_GZIP)
+        ttk.Combobox(mode_frame, textvariable=self.compress_algo_var, values=(COMPRESS_GZIP, COMPRESS_BZ2, COMPRESS_XZ),
+                     width=5, state="readonly").pack(side=LEFT)
         
         # 模式说明
-        mode_info = ttk.Label(mode_frame, text="(增量:仅复制变更 | 同步:完全一致)", font=("微软雅黑", 8), foreground="gray")
-        mode_info.pack(side=LEFT, padx=10)
+        mode_info = ttk.Label(path_frame, text="(增量:仅复制变更 | 同步:完全一致 | 快照:保留历史版本)", font=("微软雅黑", 8), foreground="gray")
+        mode_info.grid(row=3, column=0, columnspan=3, sticky=W)
+        
+        # 备份选项 (两行，窗口宽度内完整显示)
+        option_frame = ttk.Labelframe(path_frame, text="选项", padding=5)
+        option_frame.grid(row=4, column=0, columnspan=3, sticky=EW, pady=(5, 0))
+        
+        # 并行复制线程数
+        workers_frame = ttk.Frame(option_frame)
+        workers_frame.grid(row=0, column=0, sticky=W, padx=5, pady=2)
+        ttk.Label(workers_frame, text="并行线程:").pack(side=LEFT, padx=(0, 5))
+        self.workers_var = tk.IntVar(value=DEFAULT_COPY_WORKERS)
+        ttk.Spinbox(workers_frame, from_=1, to=MAX_COPY_WORKERS, textvariable=self.workers_var, width=4).pack(side=LEFT)
+        
+        # 忽略目标清单，全量扫描目标目录
+        self.verify_dst_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(option_frame, text="全量校验目标", variable=self.verify_dst_var).grid(row=0, column=1, sticky=W, padx=5)
+        
+        # 大小和修改时间一致时再比较内容哈希 (与全量校验同时勾选时重新读取目标文件)
+        self.compare_content_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(option_frame, text="比较内容", variable=self.compare_content_var).grid(row=0, column=2, sticky=W, padx=5)
+        
+        # 增量模式不再列出条目未变化的目录，只按记录的文件名 stat 其中的文件
+        self.dir_pruning_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(option_frame, text="跳过未变化目录", variable=self.dir_pruning_var).grid(row=0, column=3, sticky=W, padx=5)
+        
+        # 逐文件日志 (复制/删除/移动)；关闭后只保留警告、错误和摘要
+        self.file_log_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(option_frame, text="逐文件日志", variable=self.file_log_var,
+                        command=self._apply_log_settings).grid(row=1, column=0, sticky=W, padx=5, pady=2)
+        
+        # 性能分析: 每次任务结束后把 trace、最慢文件报告等写入输出目录 (也可通过环境变量 BAKUI_PROFILE 启用)
+        self.profile_dir = self.backup_manager.profile_dir or PROFILE_DIR
+        self.profile_var = tk.BooleanVar(value=bool(self.backup_manager.profile_dir))
+        profile_frame = ttk.Frame(option_frame)
+        profile_frame.grid(row=1, column=1, columnspan=2, sticky=W, padx=5)
+        ttk.Checkbutton(profile_frame, text="性能分析", variable=self.profile_var,
+                        command=self._apply_profile_settings).pack(side=LEFT, padx=(0, 5))
+        sampler_label = next((label for label, sampler in PROFILE_SAMPLER_LABELS.items()
+                              if sampler == self.backup_manager.profile_sampler), "仅计时")
+        self.profile_sampler_var = tk.StringVar(value=sampler_label)
+        sampler_combo = ttk.Combobox(profile_frame, textvariable=self.profile_sampler_var,
+                                     values=tuple(PROFILE_SAMPLER_LABELS), width=10, state="readonly")
+        sampler_combo.pack(side=LEFT)
+        sampler_combo.bind("<<ComboboxSelected>>", lambda e: self._apply_profile_settings())
         
         # 3. 操作按钮
         btn_frame = ttk.Frame(main_frame, padding=10)
@@ -92,6 +182,10 @@ class MainWindow:
         self.start_btn = ttk.Button(btn_frame, text="开始备份", command=self._start_backup, bootstyle=SUCCESS, width=15)
         self.start_btn.pack(side=LEFT, padx=20)
         
+        # 预演: 列出将要执行的操作，不修改目标目录
+        self.preview_btn = ttk.Button(btn_frame, text="预览", command=self._preview_backup, bootstyle=INFO, width=10)
+        self.preview_btn.pack(side=LEFT)
+        
         self.stop_btn = ttk.Button(btn_frame, text="停止", command=self._stop_backup, bootstyle=DANGER, state="disabled", width=15)
         self.stop_btn.pack(side=RIGHT, padx=20)
         
@@ -139,51 +233,314 @@ class MainWindow:
             self.history_combo.set('')
             self._refresh_history_combo()
 
-    def _start_backup(self):
+    def _selected_paths(self):
+        """
+        校验并返回 (源目录, 目标目录)，无效时提示并返回 None
+        """
         src = self.src_var.get()
         dst = self.dst_var.get()
         
         if not src or not dst:
             messagebox.showwarning("提示", "请选择源目录和目标目录")
-            return
+            return None
             
         if not os.path.exists(src):
             messagebox.showerror("错误", "源目录不存在")
+            return None
+        return src, dst
+
+    @staticmethod
+    def _dst_dirs(dst):
+        # 目标目录可填写多个，以 ';' 分隔
+        return [d.strip() for d in dst.split(';') if d.strip()]
+
+    def _start_backup(self):
+        paths = self._selected_paths()
+        if paths is None:
+            return
+        src, dst = paths
+        if len(self._dst_dirs(dst)) > 1 and (self.backup_mode_var.get() != "incremental" or self.watch_var.get()):
+            messagebox.showwarning("提示", "多个目标目录只支持增量备份")
             return
 
         # 保存历史
         self.history_manager.add_record(src, dst)
         self._refresh_history_combo()
         
-        # UI 状态
+        self._set_running()
+        
+        # 启动线程
+        threading.Thread(target=self._run_backup_thread, args=(src, dst), daemon=True).start()
+
+    def _set_running(self):
         self.start_btn.configure(state="disabled")
+        self.preview_btn.configure(state="disabled")
         self.stop_btn.configure(state="normal")
         self.progress_var.set(0)
         self.log_text.configure(state="normal")
         self.log_text.delete(1.0, END)
         self.log_text.configure(state="disabled")
-        
-        # 启动线程
-        threading.Thread(target=self._run_backup_thread, args=(src, dst), daemon=True).start()
+
+    def _update_watch_state(self):
+        # 实时监视只用于增量和同步备份，其他模式下禁用
+        if self.backup_mode_var.get() in ("incremental", "sync"):
+            self.watch_check.configure(state="normal")
+        else:
+            self.watch_var.set(False)
+            self.watch_check.configure(state="disabled")
+
+    def _apply_log_settings(self):
+        self.logger.set_category(CATEGORY_FILE, level=logging.INFO if self.file_log_var.get() else logging.WARNING)
+
+    def _apply_profile_settings(self):
+        self.backup_manager.profile_dir = self.profile_dir if self.profile_var.get() else None
+        self.backup_manager.profile_sampler = PROFILE_SAMPLER_LABELS.get(self.profile_sampler_var.get())
+
+    def _workers(self):
+        try:
+            return int(self.workers_var.get())
+        except (tk.TclError, ValueError):
+            return DEFAULT_COPY_WORKERS
 
     def _run_backup_thread(self, src, dst):
         sync_mode = (self.backup_mode_var.get() == "sync")
-        self.backup_manager.start_backup(src, dst, self._update_progress, sync_mode=sync_mode)
+        workers = self._workers()
+        verify_destination = self.verify_dst_var.get()
+        compare_mode = COMPARE_METADATA
+        if self.compare_content_var.get():
+            compare_mode = COMPARE_VERIFY if verify_destination else COMPARE_CONTENT
+        dst_dirs = self._dst_dirs(dst)
+        if len(dst_dirs) > 1:
+            self.backup_manager.start_fanout(src, dst_dirs, self._update_progress, workers=workers)
+        elif self.backup_mode_var.get() == "snapshot":
+            self.backup_manager.start_snapshot(src, dst, self._update_progress, workers=workers)
+        elif self.backup_mode_var.get() == "dedup":
+            self.backup_manager.start_dedup(src, dst, self._update_progress, workers=workers)
+        elif self.backup_mode_var.get() == "packed":
+            self.backup_manager.start_packed(src, dst, self._update_progress, workers=workers)
+        elif self.backup_mode_var.get() == "compressed":
+            self.backup_manager.start_compressed(src, dst, self._update_progress, workers=workers,
+                                                 algorithm=self.compress_algo_var.get())
+        elif self.watch_var.get():
+            self.backup_manager.start_watch(src, dst, self._update_progress, sync_mode=sync_mode, workers=workers)
+        else:
+            self.backup_manager.start_backup(src, dst, self._update_progress, sync_mode=sync_mode, workers=workers,
+                                             verify_destination=verify_destination, compare_mode=compare_mode,
+                                             dir_pruning=self.dir_pruning_var.get())
         
         # 结束后恢复 UI
-        self.root.after(0, self._on_backup_finished)
+        self.pump.call(self._on_backup_finished)
 
     def _update_progress(self, percent, total, message):
-        self.progress_var.set(percent)
-        self.status_label.configure(text=message)
+        # 在后台线程中调用，只入队
+        self.pump.post_progress(percent, total, message)
         
     def append_log(self, message):
-        def _do():
-            self.log_text.configure(state="normal")
-            self.log_text.insert(END, message + "\n")
-            self.log_text.see(END)
-            self.log_text.configure(state="disabled")
-        self.root.after(0, _do)
+        self.pump.post_log(message)
+
+    def _pump_events(self):
+        # 先安排下一次处理，回调中弹出的模态对话框不会暂停事件处理
+        self.root.after(PUMP_INTERVAL_MS, self._pump_events)
+        progress, lines, calls = self.pump.drain()
+        if progress is not None:
+            percent, _, message = progress
+            self.progress_var.set(percent)
+            self.status_label.configure(text=message + self._rate_text())
+        if lines:
+            self._append_log_lines(lines)
+        for func in calls:
+            func()
+
+    def _rate_text(self):
+        # 运行中的任务附加吞吐量和预计剩余时间
+        snap = self.backup_manager.metrics.snapshot()
+        if snap['files'] == 0 or self.backup_manager.metrics.end_time is not None:
+            return ""
+        text = f"  |  {snap['bytes_per_sec_avg'] / (1024 * 1024):.1f} MB/s, {snap['files_per_sec']:.0f} 文件/s"
+        if snap['eta'] is not None:
+            minutes, seconds = divmod(int(snap['eta']), 60)
+            hours, minutes = divmod(minutes, 60)
+            text += f", 剩余 {hours}:{minutes:02d}:{seconds:02d}"
+        return text
+
+    def _append_log_lines(self, lines):
+        self.log_text.configure(state="normal")
+        self.log_text.insert(END, "\n".join(lines) + "\n")
+        # 只保留最后 LOG_MAX_LINES 行
+        excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - LOG_MAX_LINES
+        if excess > 0:
+            self.log_text.delete("1.0", f"{excess + 1}.0")
+        self.log_text.see(END)
+        self.log_text.configure(state="disabled")
+
+    def _preview_backup(self):
+        if self.backup_mode_var.get() in ("snapshot", "dedup", "packed", "compressed"):
+            messagebox.showinfo("提示", "快照、去重、打包和压缩备份不支持预览")
+            return
+        paths = self._selected_paths()
+        if paths is None:
+            return
+        src, dst = paths
+        if len(self._dst_dirs(dst)) > 1:
+            messagebox.showinfo("提示", "多个目标目录时不支持预览")
+            return
+        self._set_running()
+        self.status_label.configure(text="正在预演...")
+        sync_mode = (self.backup_mode_var.get() == "sync")
+        verify_destination = self.verify_dst_var.get()
+
+        def _run():
+            plan = self.backup_manager.plan_backup(src, dst, sync_mode=sync_mode,
+                                                   verify_destination=verify_destination)
+
+            def _done():
+                self.start_btn.configure(state="normal")
+                self.preview_btn.configure(state="normal")
+                self.stop_btn.configure(state="disabled")
+                if plan is None:
+                    self.status_label.configure(text="预演已中止")
+                    return
+                self.status_label.configure(text=plan.summary())
+                self._show_plan(plan)
+            self.pump.call(_done)
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def _open_plan(self):
+        path = filedialog.askopenfilename(filetypes=[("备份计划", "*.json"), ("所有文件", "*.*")])
+        if not path:
+            return
+        try:
+            plan = BackupPlan.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("错误", f"无法读取备份计划: {e}")
+            return
+        self._show_plan(plan)
+
+    def _show_plan(self, plan):
+        window = ttk.Toplevel(self.root)
+        window.title("备份计划预览")
+        window.geometry("640x420")
+
+        mode_name = "同步备份" if plan.sync_mode else "增量备份"
+        ttk.Label(window, text=f"{mode_name}: {plan.src_dir} -> {plan.dst_dir}", padding=(10, 10, 10, 0)).pack(anchor=W)
+        ttk.Label(window, text=plan.summary(), padding=(10, 5), wraplength=600).pack(anchor=W)
+
+        text_frame = ttk.Frame(window, padding=(10, 0))
+        text_frame.pack(fill=BOTH, expand=YES)
+        text = tk.Text(text_frame, height=12, font=("Consolas", 9))
+        scroll = ttk.Scrollbar(text_frame, orient="vertical", command=text.yview)
+        scroll.pack(side=RIGHT, fill=Y)
+        text.pack(fill=BOTH, expand=YES)
+        text.configure(yscrollcommand=scroll.set)
+
+        items = plan.ordered()
+        lines = []
+        for item in items[:PLAN_PREVIEW_LIMIT]:
+            line = f"{PLAN_ACTION_LABELS[item.action]}: {item.rel_path}"
+            if item.from_path is not None:
+                line += f" (来自 {item.from_path})"
+            lines.append(line)
+        if len(items) > PLAN_PREVIEW_LIMIT:
+            lines.append(f"... 另有 {len(items) - PLAN_PREVIEW_LIMIT} 项未列出")
+        if not items:
+            lines.append("没有需要执行的操作")
+        text.insert(END, "\n".join(lines))
+        text.configure(state="disabled")
+
+        btn_frame = ttk.Frame(window, padding=10)
+        btn_frame.pack(fill=X)
+        ttk.Button(btn_frame, text="执行计划", bootstyle=SUCCESS,
+                   command=lambda: self._run_plan(plan, window)).pack(side=LEFT)
+        ttk.Button(btn_frame, text="保存计划...", bootstyle=INFO,
+                   command=lambda: self._save_plan(plan)).pack(side=LEFT, padx=10)
+        ttk.Button(btn_frame, text="关闭", bootstyle=SECONDARY, command=window.destroy).pack(side=RIGHT)
+
+    def _save_plan(self, plan):
+        path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("备份计划", "*.json")])
+        if not path:
+            return
+        try:
+            plan.save(path)
+        except OSError as e:
+            messagebox.showerror("错误", f"保存备份计划失败: {e}")
+            return
+        self.logger.info(f"备份计划已保存: {path}")
+
+    def _run_plan(self, plan, window):
+        if str(self.start_btn.cget("state")) == "disabled":
+            messagebox.showwarning("提示", "已有任务正在运行")
+            return
+        window.destroy()
+        self._set_running()
+        workers = self._workers()
+
+        def _run():
+            self.backup_manager.execute_plan(plan, self._update_progress, workers=workers)
+            self.pump.call(self._on_backup_finished)
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def _restore_dedup(self):
+        if str(self.start_btn.cget("state")) == "disabled":
+            messagebox.showwarning("提示", "已有任务正在运行")
+            return
+        store_dir = filedialog.askdirectory(title="选择去重存储目录")
+        if not store_dir:
+            return
+        target_dir = filedialog.askdirectory(title="选择恢复到的目录")
+        if not target_dir:
+            return
+        self._set_running()
+        workers = self._workers()
+
+        def _run():
+            self.backup_manager.start_restore(store_dir, target_dir, self._update_progress, workers=workers)
+            self.pump.call(self._on_backup_finished)
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def _extract_packed(self):
+        dst_dir = filedialog.askdirectory(title="选择打包备份的目标目录")
+        if not dst_dir:
+            return
+        rel_path = simpledialog.askstring("提取文件", "文件在源目录中的相对路径:", parent=self.root)
+        if not rel_path:
+            return
+        rel_path = os.path.normpath(rel_path.strip().lstrip('/\\'))
+        out_path = filedialog.asksaveasfilename(title="保存到", initialfile=os.path.basename(rel_path))
+        if not out_path:
+            return
+        pack = PackStore(dst_dir)
+        if not os.path.isfile(pack.path) or not pack.open():
+            messagebox.showerror("错误", f"无法打开打包索引: {pack.path}")
+            return
+        try:
+            pack.extract(rel_path, out_path)
+        except FileNotFoundError:
+            plain = os.path.join(dst_dir, rel_path)
+            if os.path.isfile(plain):
+                messagebox.showinfo("提示", f"该文件未打包，直接保存在: {plain}")
+            else:
+                messagebox.showerror("错误", f"备份中没有该文件: {rel_path}")
+            return
+        except OSError as e:
+            messagebox.showerror("错误", f"提取失败: {e}")
+            return
+        finally:
+            pack.close()
+        self.logger.info(f"已提取 {rel_path} 到: {out_path}")
+
+    def _export_report(self):
+        path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("运行报告", "*.json")])
+        if not path:
+            return
+        try:
+            self.backup_manager.metrics.write_json(path)
+        except OSError as e:
+            messagebox.showerror("错误", f"保存运行报告失败: {e}")
+            return
+        self.logger.info(f"运行报告已保存: {path}")
 
     def _stop_backup(self):
         self.backup_manager.stop()
@@ -191,6 +548,7 @@ class MainWindow:
 
     def _on_backup_finished(self):
         self.start_btn.configure(state="normal")
+        self.preview_btn.configure(state="normal")
         self.stop_btn.configure(state="disabled")
         if not self.backup_manager.stop_flag:
              messagebox.showinfo("完成", "备份任务已结束")
@@ -213,7 +571,7 @@ class MainWindow:
                 messagebox.showinfo("检查更新", f"当前已是最新版本 ({VERSION})")
                 self.logger.info("当前已是最新版本。")
                 
-        self.root.after(0, _show_result)
+        self.pump.call(_show_result)
 
     def run(self):
         self.root.mainloop()
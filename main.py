@@ -1,3 +1,4 @@
+import multiprocessing
 import sys
 import os
 
@@ -7,6 +8,8 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from gui.main_window import MainWindow
 
 if __name__ == "__main__":
+    # 打包为可执行文件时，内容哈希进程池的子进程需要
+    multiprocessing.freeze_support()
     try:
         app = MainWindow()
         app.run()
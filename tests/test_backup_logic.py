@@ -3,7 +3,7 @@ import os
 import shutil
 import time
 import tempfile
-from backup_core import BackupManager
+from core.backup import BackupManager
 
 class TestBackupManager(unittest.TestCase):
     def setUp(self):
@@ -75,6 +75,100 @@ class TestBackupManager(unittest.TestCase):
         self.assertIn('skipped', actions)
         self.assertNotIn('copied', actions)
 
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), "需要命名管道")
+    def test_special_files_are_not_copied(self):
+        self.create_file(os.path.join(self.src_dir, 'a.txt'), 'a')
+        os.mkfifo(os.path.join(self.src_dir, 'pipe'))
+        events = list(self.manager.backup_generator(self.src_dir, self.dst_dir))
+        self.assertEqual([(e['action'], e['rel_path']) for e in events if e.get('type') in ('progress', 'error')],
+                         [('copied', 'a.txt')])
+        self.assertFalse(os.path.exists(os.path.join(self.dst_dir, 'pipe')))
+
+    def test_sync_detects_moves(self):
+        old_dir = os.path.join(self.src_dir, 'photos')
+        os.makedirs(old_dir)
+        for i in range(3):
+            self.create_file(os.path.join(old_dir, f'img{i}.jpg'), str(i) * 100000)
+        for _ in self.manager.backup_generator(self.src_dir, self.dst_dir, sync_mode=True): pass
+
+        os.rename(old_dir, os.path.join(self.src_dir, 'album'))
+        actions = []
+        for msg in self.manager.backup_generator(self.src_dir, self.dst_dir, sync_mode=True):
+            if msg.get('type') == 'progress':
+                actions.append(msg['action'])
+
+        self.assertEqual(actions.count('moved'), 3)
+        self.assertNotIn('updated', actions)
+        self.assertFalse(os.path.exists(os.path.join(self.dst_dir, 'photos')))
+        with open(os.path.join(self.dst_dir, 'album', 'img2.jpg')) as f:
+            self.assertEqual(f.read(), '2' * 100000)
+
+    def test_sync_move_detection_rejects_different_content(self):
+        for move_detection in ('metadata', 'hash'):
+            with self.subTest(move_detection=move_detection):
+                self.create_file(os.path.join(self.src_dir, 'a.bin'), 'x' * 100000)
+                for _ in self.manager.backup_generator(self.src_dir, self.dst_dir, sync_mode=True): pass
+
+                # 相同大小和修改时间，但内容不同 (先创建新文件，避免复用旧文件的 inode)
+                src_file = os.path.join(self.src_dir, 'a.bin')
+                st = os.stat(src_file)
+                new_file = os.path.join(self.src_dir, 'b.bin')
+                self.create_file(new_file, 'y' * 100000)
+                os.utime(new_file, (st.st_atime, st.st_mtime))
+                os.remove(src_file)
+
+                actions = []
+                for msg in self.manager.backup_generator(self.src_dir, self.dst_dir, sync_mode=True,
+                                                         move_detection=move_detection):
+                    if msg.get('type') == 'progress':
+                        actions.append(msg['action'])
+
+                self.assertNotIn('moved', actions)
+                with open(os.path.join(self.dst_dir, 'b.bin')) as f:
+                    self.assertEqual(f.read(), 'y' * 100000)
+                os.remove(new_file)
+
+    def test_sync_merge_diff(self):
+        os.makedirs(os.path.join(self.src_dir, 'sub'))
+        self.create_file(os.path.join(self.src_dir, 'sub', 'a.txt'), 'a')
+        self.create_file(os.path.join(self.src_dir, 'b.txt'), 'b')
+        os.makedirs(os.path.join(self.dst_dir, 'stale', 'deep'))
+        self.create_file(os.path.join(self.dst_dir, 'stale', 'deep', 'x.txt'), 'x')
+        self.create_file(os.path.join(self.dst_dir, 'extra.txt'), 'extra')
+
+        events = list(self.manager.backup_generator(self.src_dir, self.dst_dir, sync_mode=True,
+                                                    diff_engine='merge'))
+        actions = sorted(e['action'] for e in events if e.get('type') == 'progress')
+        self.assertEqual(actions, ['created_dir', 'deleted', 'deleted_dir', 'updated', 'updated'])
+        self.assertEqual(sorted(os.listdir(self.dst_dir)), ['.bakui', 'b.txt', 'sub'])
+
+        events = list(self.manager.backup_generator(self.src_dir, self.dst_dir, sync_mode=True,
+                                                    diff_engine='merge'))
+        self.assertEqual([e['action'] for e in events if e.get('type') == 'progress'], ['synced', 'synced'])
+
+    def test_content_compare_recopies_same_metadata(self):
+        src_file = os.path.join(self.src_dir, 'a.txt')
+        self.create_file(src_file, 'original')
+        for _ in self.manager.backup_generator(self.src_dir, self.dst_dir, compare_mode='content'): pass
+
+        # 内容变化但大小和修改时间被回设
+        st = os.stat(src_file)
+        self.create_file(src_file, 'modified')
+        os.utime(src_file, (st.st_atime, st.st_mtime))
+
+        events = list(self.manager.backup_generator(self.src_dir, self.dst_dir))
+        self.assertNotIn('copied', [e.get('action') for e in events])
+
+        events = list(self.manager.backup_generator(self.src_dir, self.dst_dir, compare_mode='content'))
+        copied = [e for e in events if e.get('action') == 'copied']
+        self.assertEqual(len(copied), 1)
+        self.assertTrue(copied[0]['content_mismatch'])
+        with open(os.path.join(self.dst_dir, 'a.txt')) as f:
+            self.assertEqual(f.read(), 'modified')
+
+        events = list(self.manager.backup_generator(self.src_dir, self.dst_dir, compare_mode='content'))
+        self.assertEqual([e['action'] for e in events if e.get('type') == 'progress'], ['skipped'])
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,53 @@
+import unittest
+import os
+import shutil
+import tempfile
+from benchmarks.probes import SyscallCounter
+from benchmarks.run import run_case, RUNS
+from benchmarks.trees import build_tree, churn, list_files, TREE_MIXED, TREE_TINY
+
+class TestBenchmarks(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_trees_are_reproducible(self):
+        first, second = os.path.join(self.test_dir, 'a'), os.path.join(self.test_dir, 'b')
+        for root in (first, second):
+            build_tree(root, TREE_MIXED, seed=3, scale=0.01)
+        self.assertEqual(list_files(first), list_files(second))
+        with open(os.path.join(first, 'media', 'archive.bin'), 'rb') as f1, \
+                open(os.path.join(second, 'media', 'archive.bin'), 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+        changes = [churn(root, seed=3) for root in (first, second)]
+        self.assertEqual(changes[0], changes[1])
+        self.assertEqual(changes[0]['deleted_dirs'], 1)
+        self.assertEqual(list_files(first), list_files(second))
+
+    def test_syscall_counter_restores_functions(self):
+        stat = os.stat
+        with SyscallCounter() as counter:
+            os.stat(self.test_dir)
+            os.listdir(self.test_dir)
+        self.assertIs(os.stat, stat)
+        self.assertEqual(counter.counts['stat'], 1)
+        self.assertEqual(counter.counts['listdir'], 1)
+
+    def test_run_case(self):
+        results = run_case(self.test_dir, TREE_TINY, 'sync', seed=0, scale=0.005, workers=2, count_syscalls=True)
+        self.assertEqual([r['run'] for r in results], list(RUNS))
+        cold, warm, churned = results
+        self.assertEqual(cold['actions'], {'updated': 100, 'created_dir': 150})
+        self.assertEqual(warm['actions'], {'synced': 100})
+        self.assertGreater(churned['changes']['renamed'], 0)
+        self.assertEqual(churned['actions']['deleted_dir'], 1)
+        self.assertGreater(cold['syscalls']['open_file'], 0)
+        self.assertIn('copy', cold['phases'])
+        # 生成的目录树在测量后删除
+        self.assertEqual(os.listdir(self.test_dir), [])
+
+if __name__ == '__main__':
+    unittest.main()
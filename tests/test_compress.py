@@ -0,0 +1,74 @@
+import unittest
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+import time
+from core.backup import BackupManager
+from core.compress import ParallelCompressor, decompress_file, is_compressible, COMPRESS_BZ2
+
+class TestCompressedBackup(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.test_dir, 'src')
+        self.dst_dir = os.path.join(self.test_dir, 'dst')
+        os.makedirs(os.path.join(self.src_dir, 'logs'))
+        self.manager = BackupManager()
+        self.text = ''.join(f"line {i}: backup log entry\n" for i in range(5000))
+        self.create_file(os.path.join(self.src_dir, 'logs', 'app.log'), self.text.encode())
+        self.random = os.urandom(200 * 1024)
+        self.create_file(os.path.join(self.src_dir, 'random.bin'), self.random)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def create_file(self, path, content):
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def run_compressed(self, **kwargs):
+        events = list(self.manager.compressed_generator(self.src_dir, self.dst_dir, **kwargs))
+        actions = sorted((e['action'], e['rel_path']) for e in events if e.get('type') == 'progress')
+        return actions, events[-1]
+
+    def test_compressible_files_compressed_random_stored_raw(self):
+        actions, done = self.run_compressed()
+        self.assertEqual(actions, [('compressed', os.path.join('logs', 'app.log')), ('copied', 'random.bin')])
+        stored = os.path.join(self.dst_dir, 'logs', 'app.log.gz')
+        with gzip.open(stored, 'rb') as f:
+            self.assertEqual(f.read(), self.text.encode())
+        self.assertLess(os.path.getsize(stored), len(self.text) // 5)
+        with open(os.path.join(self.dst_dir, 'random.bin'), 'rb') as f:
+            self.assertEqual(f.read(), self.random)
+        self.assertFalse(is_compressible(os.path.join(self.src_dir, 'random.bin'), len(self.random)))
+
+    def test_incremental_compares_original_metadata(self):
+        self.run_compressed()
+        actions, done = self.run_compressed()
+        self.assertEqual({a for a, _ in actions}, {'skipped'})
+
+        # 内容变得不可压缩时改为按原样保存，删除旧的压缩文件
+        time.sleep(1.1)
+        self.create_file(os.path.join(self.src_dir, 'logs', 'app.log'), self.random)
+        actions, done = self.run_compressed()
+        self.assertIn(('copied', os.path.join('logs', 'app.log')), actions)
+        self.assertEqual(os.listdir(os.path.join(self.dst_dir, 'logs')), ['app.log'])
+
+    def test_chunked_compression_is_valid_stream(self):
+        src = os.path.join(self.test_dir, 'big.txt')
+        data = (self.text * 4).encode()
+        self.create_file(src, data)
+        dst = os.path.join(self.test_dir, 'big.txt.bz2')
+        with ParallelCompressor(COMPRESS_BZ2, workers=2, use_processes=False, chunk_size=64 * 1024) as compressor:
+            compressor.compress_file(src, dst)
+        # 多个独立压缩的块首尾相连，标准解压器可以直接读取
+        with open(dst, 'rb') as f:
+            self.assertEqual(bz2.decompress(f.read()), data)
+        out = os.path.join(self.test_dir, 'out.txt')
+        decompress_file(dst, out, COMPRESS_BZ2)
+        with open(out, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import threading
+import time
+from core.copier import ParallelCopier
+
+class TestParallelCopier(unittest.TestCase):
+    def test_all_results_returned(self):
+        with ParallelCopier(workers=4) as copier:
+            for i in range(50):
+                copier.submit(lambda x: x * 2, i, size=i, tag=i)
+            results = list(copier.completed()) + list(copier.drain())
+
+        self.assertEqual(len(results), 50)
+        self.assertEqual(sorted(r.value for r in results), [i * 2 for i in range(50)])
+
+    def test_errors_are_captured(self):
+        def fail():
+            raise OSError("boom")
+
+        with ParallelCopier(workers=2) as copier:
+            copier.submit(fail, tag='bad')
+            results = list(copier.drain())
+
+        self.assertEqual(results[0].tag, 'bad')
+        self.assertIsInstance(results[0].error, OSError)
+
+    def test_large_file_lane_does_not_block_small_files(self):
+        release = threading.Event()
+        with ParallelCopier(workers=2, large_workers=1, large_file_threshold=100) as copier:
+            copier.submit(release.wait, 5, size=1000, tag='large')
+            for i in range(10):
+                copier.submit(time.sleep, 0, size=1, tag=i)
+            small_done = []
+            deadline = time.time() + 5
+            while len(small_done) < 10 and time.time() < deadline:
+                small_done.extend(r for r in copier.completed() if r.tag != 'large')
+                time.sleep(0.01)
+            release.set()
+            list(copier.drain())
+
+        self.assertEqual(len(small_done), 10)
+
+    def test_stop_skips_pending_tasks(self):
+        stop = threading.Event()
+        stop.set()
+        with ParallelCopier(workers=1, stop_check=stop.is_set) as copier:
+            copier.submit(lambda: 1, tag='a')
+            results = list(copier.drain())
+
+        self.assertTrue(results[0].stopped)
+
+if __name__ == '__main__':
+    unittest.main()
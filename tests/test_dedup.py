@@ -0,0 +1,89 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from core.backup import BackupManager
+from core.dedup import DedupStore
+
+class TestDedupStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.test_dir, 'src')
+        self.dst_dir = os.path.join(self.test_dir, 'dst')
+        self.restore_dir = os.path.join(self.test_dir, 'restore')
+        os.makedirs(os.path.join(self.src_dir, 'a'))
+        os.makedirs(os.path.join(self.src_dir, 'b', 'empty'))
+        self.manager = BackupManager()
+        self.store = DedupStore(self.dst_dir)
+        self.create_file(os.path.join(self.src_dir, 'a', 'setup.exe'), 'installer' * 100)
+        self.create_file(os.path.join(self.src_dir, 'b', 'setup-copy.exe'), 'installer' * 100)
+        self.create_file(os.path.join(self.src_dir, 'unique.txt'), 'unique')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def create_file(self, path, content='content'):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def run_dedup(self):
+        events = list(self.manager.dedup_generator(self.src_dir, self.dst_dir))
+        actions = sorted((e['action'], e['rel_path']) for e in events if e.get('type') == 'progress')
+        return actions, events[-1]
+
+    def count_objects(self):
+        return sum(len(files) for path, _, files in os.walk(self.store.objects_dir)
+                   if os.path.basename(path) != 'tmp')
+
+    def test_duplicate_content_written_once(self):
+        actions, done = self.run_dedup()
+        self.assertEqual([a for a, _ in actions].count('stored'), 2)
+        self.assertEqual([a for a, _ in actions].count('deduped'), 1)
+        self.assertEqual(done['summary']['bytes_copied'], 900 + 6)
+        self.assertEqual(self.count_objects(), 2)
+        self.assertEqual(len(self.store.runs()), 1)
+
+        # 第二次备份: 未变化的文件命中哈希缓存，新增的重复内容也不再写入
+        time.sleep(1.1)
+        self.create_file(os.path.join(self.src_dir, 'a', 'dataset.bin'), 'unique')
+        actions, done = self.run_dedup()
+        self.assertEqual({a for a, _ in actions}, {'deduped'})
+        self.assertEqual(done['summary']['bytes_copied'], 0)
+        self.assertEqual(self.count_objects(), 2)
+        self.assertEqual(len(self.store.runs()), 2)
+
+    def test_restore_materializes_tree(self):
+        os.utime(os.path.join(self.src_dir, 'unique.txt'), (1000000000, 1000000000))
+        self.run_dedup()
+        first = self.store.latest_run()
+        time.sleep(1.1)
+        self.create_file(os.path.join(self.src_dir, 'unique.txt'), 'changed')
+        self.run_dedup()
+
+        events = list(self.manager.restore_generator(self.dst_dir, self.restore_dir, run=first))
+        self.assertFalse(events[-1]['stopped'])
+        self.assertEqual(events[-1]['summary']['copied'], 3)
+        with open(os.path.join(self.restore_dir, 'unique.txt')) as f:
+            self.assertEqual(f.read(), 'unique')
+        with open(os.path.join(self.restore_dir, 'b', 'setup-copy.exe')) as f:
+            self.assertEqual(f.read(), 'installer' * 100)
+        self.assertEqual(os.path.getmtime(os.path.join(self.restore_dir, 'unique.txt')), 1000000000)
+        self.assertTrue(os.path.isdir(os.path.join(self.restore_dir, 'b', 'empty')))
+
+        # 重新恢复时跳过已一致的文件
+        events = list(self.manager.restore_generator(self.dst_dir, self.restore_dir, run=first))
+        actions = {e['action'] for e in events if e.get('type') == 'progress'}
+        self.assertEqual(actions, {'skipped'})
+
+    def test_stopped_backup_leaves_no_index(self):
+        events = self.manager.dedup_generator(self.src_dir, self.dst_dir)
+        for event in events:
+            if event.get('type') == 'progress':
+                self.manager.stop()
+        self.assertTrue(event['stopped'])
+        self.assertEqual(self.store.runs(), [])
+        self.assertEqual(os.listdir(self.store.index_dir), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import errno
+import os
+import shutil
+import tempfile
+from unittest import mock
+from core.backup import BackupManager
+from core.deletion import DeletionPlan, remove_tree
+from core.scanner import FileEntry
+
+class TestDeletion(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def create_file(self, rel_path, content='x'):
+        path = os.path.join(self.test_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_plan_collapses_to_topmost_dirs(self):
+        entries = [FileEntry(p, 1, 0) for p in ('loose.txt', os.path.join('a', 'f.txt'),
+                                                 os.path.join('a', 'b', 'g.txt'), os.path.join('c', 'h.txt'))]
+        plan = DeletionPlan(entries, ['a', os.path.join('a', 'b'), 'd'])
+        self.assertEqual(plan.roots, ['a', 'd'])
+        self.assertEqual([e.rel_path for e in plan.files], [os.path.join('c', 'h.txt'), 'loose.txt'])
+        self.assertEqual(len(plan.nested['a']), 2)
+        self.assertEqual(len(plan), 4)
+
+    def test_remove_tree_reports_failures_per_item(self):
+        for rel_path in (os.path.join('t', 'ok.txt'), os.path.join('t', 'sub', 'locked.txt'),
+                         os.path.join('t', 'other', 'ok.txt')):
+            self.create_file(rel_path)
+        outside = os.path.join(self.test_dir, 'outside')
+        os.makedirs(outside)
+        os.symlink(outside, os.path.join(self.test_dir, 't', 'link'))
+        real_unlink = os.unlink
+
+        def unlink(path):
+            if path.endswith('locked.txt'):
+                raise OSError(errno.EIO, "I/O error")
+            real_unlink(path)
+
+        with mock.patch('os.unlink', side_effect=unlink):
+            files, dirs, failures, stopped = remove_tree(os.path.join(self.test_dir, 't'))
+        self.assertFalse(stopped)
+        self.assertEqual((files, dirs), (3, 1))
+        self.assertEqual([os.path.basename(p) for p, _ in failures], ['locked.txt'])
+        # 包含失败条目的目录保留，符号链接指向的目录不受影响
+        self.assertTrue(os.path.exists(os.path.join(self.test_dir, 't', 'sub', 'locked.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, 't', 'other')))
+        self.assertTrue(os.path.isdir(outside))
+
+    def test_sync_deletes_subtree_once(self):
+        src_dir = os.path.join(self.test_dir, 'src')
+        dst_dir = os.path.join(self.test_dir, 'dst')
+        os.makedirs(src_dir)
+        for i in range(20):
+            self.create_file(os.path.join('dst', 'old', f'd{i % 4}', f'{i}.txt'))
+        self.create_file(os.path.join('dst', 'stale.txt'))
+
+        events = list(BackupManager().backup_generator(src_dir, dst_dir, sync_mode=True))
+        progress = [e for e in events if e.get('type') == 'progress']
+        self.assertEqual(sorted((e['action'], e['rel_path']) for e in progress),
+                         [('deleted', 'stale.txt'), ('deleted_dir', 'old')])
+        self.assertEqual(progress[-1]['processed'], progress[-1]['total'])
+        summary = events[-1]['summary']
+        self.assertEqual((summary['deleted_files'], summary['deleted_dirs']), (21, 5))
+        self.assertEqual(os.listdir(dst_dir), ['.bakui'])
+
+if __name__ == '__main__':
+    unittest.main()
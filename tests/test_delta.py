@@ -0,0 +1,80 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.backup import BackupManager
+from core.copier import CopyStopped
+from core.delta import DeltaCopier
+
+BLOCK = 64 * 1024
+
+class TestDeltaCopier(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.test_dir, 'src.db')
+        self.dst_root = os.path.join(self.test_dir, 'dst')
+        os.makedirs(self.dst_root)
+        self.dst = os.path.join(self.dst_root, 'src.db')
+        self.data = bytearray(os.urandom(BLOCK * 20))
+        self.write_src(self.data)
+        shutil.copy2(self.src, self.dst)
+        self.delta = DeltaCopier(self.dst_root, block_size=BLOCK)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def write_src(self, data):
+        with open(self.src, 'wb') as f:
+            f.write(data)
+
+    def assert_same(self):
+        with open(self.src, 'rb') as a, open(self.dst, 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_only_changed_block_is_written(self):
+        self.data[BLOCK * 5 + 10] ^= 0xFF
+        self.write_src(self.data)
+        written = self.delta.copy(self.src, self.dst, 'src.db')
+        self.assertEqual(written, BLOCK)
+        self.assert_same()
+        self.assertTrue(os.path.exists(self.delta.sidecar_path('src.db')))
+
+    def test_append_uses_cached_sums(self):
+        self.delta.copy(self.src, self.dst, 'src.db')
+        sums = self.delta._load_sums('src.db', os.stat(self.dst))
+        self.assertEqual(len(sums), 20)
+
+        self.write_src(bytes(self.data) + b'tail' * 100)
+        written = self.delta.copy(self.src, self.dst, 'src.db')
+        self.assertEqual(written, 400)
+        self.assert_same()
+
+    def test_shrunk_source_truncates(self):
+        self.write_src(bytes(self.data[:BLOCK * 3]))
+        self.delta.copy(self.src, self.dst, 'src.db')
+        self.assert_same()
+
+    def test_stopped_copy_is_redone(self):
+        src_dir = os.path.join(self.test_dir, 'src')
+        os.makedirs(src_dir)
+        self.src = os.path.join(src_dir, 'src.db')
+        self.data[BLOCK * 2] ^= 0xFF
+        self.data[BLOCK * 15] ^= 0xFF
+        self.write_src(self.data)
+        os.utime(self.src, (1e9, 1e9 + 100))
+        os.utime(self.dst, (1e9, 1e9))
+        dst_mtime = os.stat(self.dst).st_mtime_ns
+
+        # 写入第 2 块后停止: 目标文件大小不变，修改时间必须恢复
+        checks = iter(range(100))
+        with self.assertRaises(CopyStopped):
+            self.delta.copy(self.src, self.dst, 'src.db', stop_check=lambda: next(checks) >= 5)
+        self.assertEqual(os.stat(self.dst).st_mtime_ns, dst_mtime)
+
+        manager = BackupManager()
+        events = list(manager.backup_generator(src_dir, self.dst_root, use_manifest=False, delta_threshold=BLOCK))
+        self.assertEqual([e['rel_path'] for e in events if e.get('action') == 'copied'], ['src.db'])
+        self.assert_same()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.diff import merge_walk, DIFF_DIR, DIFF_FILE, DIFF_DELETE, DIFF_DELETE_DIR
+
+class TestMergeWalk(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.test_dir, 'src')
+        self.dst = os.path.join(self.test_dir, 'dst')
+        for rel_path in ('same.txt', 'new.txt', os.path.join('d', 'x.txt'), os.path.join('newdir', 'y.txt')):
+            self.create_file(self.src, rel_path)
+        for rel_path in ('same.txt', 'old.txt', os.path.join('d', 'x.txt'), os.path.join('d', 'gone.txt'),
+                         os.path.join('olddir', 'z.txt'), os.path.join('.bakui', 'manifest.db')):
+            self.create_file(self.dst, rel_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def create_file(self, root, rel_path):
+        path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write('data')
+
+    def test_merge_walk(self):
+        results = [(kind, rel_path, dst is not None)
+                   for kind, rel_path, src, dst in merge_walk(self.src, self.dst, exclude=('.bakui',))]
+        self.assertEqual(results, [
+            (DIFF_DELETE, 'old.txt', True),
+            (DIFF_DELETE_DIR, 'olddir', False),
+            (DIFF_FILE, 'new.txt', False),
+            (DIFF_FILE, 'same.txt', True),
+            (DIFF_DIR, 'd', False),
+            (DIFF_DIR, 'newdir', False),
+            (DIFF_DELETE, os.path.join('d', 'gone.txt'), True),
+            (DIFF_FILE, os.path.join('d', 'x.txt'), True),
+            (DIFF_FILE, os.path.join('newdir', 'y.txt'), False),
+        ])
+
+    def test_file_replaced_by_directory(self):
+        shutil.rmtree(os.path.join(self.dst, 'd'))
+        self.create_file(self.dst, 'd')
+        results = [(kind, rel_path) for kind, rel_path, src, dst in merge_walk(self.src, self.dst)]
+        # 目标中的同名文件先删除，再创建目录
+        self.assertLess(results.index((DIFF_DELETE, 'd')), results.index((DIFF_DIR, 'd')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from core.backup import BackupManager
+from core.dircache import DirCache
+
+class TestDirPruning(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.test_dir, 'src')
+        self.dst_dir = os.path.join(self.test_dir, 'dst')
+        os.makedirs(os.path.join(self.src_dir, 'a', 'b'))
+        os.makedirs(os.path.join(self.src_dir, 'c'))
+        os.makedirs(self.dst_dir)
+        self.manager = BackupManager()
+        for rel_path in ('top.txt', os.path.join('a', 'x.txt'), os.path.join('a', 'b', 'y.txt'),
+                         os.path.join('c', 'z.txt')):
+            self.create_file(os.path.join(self.src_dir, rel_path), rel_path)
+        self.age_dirs()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def create_file(self, path, content='content'):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def age_dirs(self):
+        # 修改时间过近的目录不会被信任，测试中把源目录的修改时间调到过去
+        now = time.time()
+        for dirpath, dirnames, filenames in os.walk(self.src_dir):
+            if os.stat(dirpath).st_mtime > now - 10:
+                os.utime(dirpath, (now - 100, now - 100))
+
+    def run_backup(self, **kwargs):
+        events = list(self.manager.backup_generator(self.src_dir, self.dst_dir, dir_pruning=True, **kwargs))
+        return sorted((e['action'], e['rel_path']) for e in events if e.get('type') == 'progress')
+
+    def test_unchanged_dirs_are_skipped(self):
+        first = self.run_backup()
+        self.assertEqual(len(first), 4)
+        # 未变化的目录不再列出，记录的文件仍逐个比对
+        self.assertEqual(self.run_backup(), [('skipped', rel_path) for _action, rel_path in first])
+
+        # 新增文件改变所在目录的修改时间，该目录重新列出
+        new_file = os.path.join(self.src_dir, 'a', 'b', 'new.txt')
+        self.create_file(new_file, 'new')
+        self.age_dirs()
+        actions = self.run_backup()
+        self.assertIn(('copied', os.path.join('a', 'b', 'new.txt')), actions)
+        self.assertEqual(len(actions), 5)
+
+    def test_new_subtree_is_scanned(self):
+        self.run_backup()
+        os.makedirs(os.path.join(self.src_dir, 'c', 'd', 'e'))
+        self.create_file(os.path.join(self.src_dir, 'c', 'd', 'e', 'deep.txt'), 'deep')
+        self.age_dirs()
+        actions = self.run_backup()
+        self.assertIn(('copied', os.path.join('c', 'd', 'e', 'deep.txt')), actions)
+        self.assertTrue(os.path.exists(os.path.join(self.dst_dir, 'c', 'd', 'e', 'deep.txt')))
+
+    def test_in_place_change_is_copied(self):
+        self.run_backup()
+        dir_path = os.path.join(self.src_dir, 'c')
+        dir_st = os.stat(dir_path)
+        path = os.path.join(dir_path, 'z.txt')
+        self.create_file(path, 'changed in place')
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 5 * 10 ** 9))
+        self.assertEqual(os.stat(dir_path).st_mtime_ns, dir_st.st_mtime_ns)
+
+        self.assertIn(('copied', os.path.join('c', 'z.txt')), self.run_backup())
+        with open(os.path.join(self.dst_dir, 'c', 'z.txt')) as f:
+            self.assertEqual(f.read(), 'changed in place')
+
+    def test_racy_dir_is_rescanned(self):
+        self.run_backup()
+        self.create_file(os.path.join(self.src_dir, 'a', 'new.txt'), 'new')
+        new_file = os.path.join('a', 'new.txt')
+        self.assertIn(('copied', new_file), self.run_backup())
+        # 目录修改时间距扫描过近，下次运行仍然列出: 同一时间精度内新增的文件不改变修改时间也不会遗漏
+        dir_path = os.path.join(self.src_dir, 'a')
+        dir_st = os.stat(dir_path)
+        self.create_file(os.path.join(dir_path, 'later.txt'), 'later')
+        os.utime(dir_path, ns=(dir_st.st_atime_ns, dir_st.st_mtime_ns))
+        actions = self.run_backup()
+        self.assertIn(('skipped', new_file), actions)
+        self.assertIn(('copied', os.path.join('a', 'later.txt')), actions)
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), "需要命名管道")
+    def test_special_file_in_pruned_dir_is_skipped(self):
+        self.run_backup()
+        # 记录中的文件被替换为命名管道 (与 scan_dir 相同: 不备份，也不打开)
+        dir_path = os.path.join(self.src_dir, 'c')
+        os.remove(os.path.join(dir_path, 'z.txt'))
+        os.mkfifo(os.path.join(dir_path, 'z.txt'))
+        files, failed = DirCache._stat_files(dir_path, 'c', ('z.txt',), None)
+        self.assertEqual((files, failed), ({}, False))
+
+if __name__ == '__main__':
+    unittest.main()
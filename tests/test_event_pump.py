@@ -0,0 +1,53 @@
+import unittest
+import threading
+from gui.event_pump import EventPump
+
+class TestEventPump(unittest.TestCase):
+    def test_progress_is_coalesced(self):
+        pump = EventPump()
+        for i in range(1000):
+            pump.post_progress(i / 10, 1000, f"file {i}")
+        progress, lines, calls = pump.drain()
+        self.assertEqual(progress, (99.9, 1000, "file 999"))
+        self.assertEqual((lines, calls), ([], []))
+        self.assertEqual(pump.drain(), (None, [], []))
+
+    def test_log_is_capped(self):
+        pump = EventPump(max_lines=100)
+        for i in range(100000):
+            pump.post_log(f"deleted {i}")
+        _, lines, _ = pump.drain()
+        self.assertEqual(len(lines), 100)
+        self.assertEqual(lines[0], "deleted 99900")
+        self.assertEqual(lines[-1], "deleted 99999")
+
+    def test_concurrent_producers(self):
+        pump = EventPump(max_lines=100000)
+        order = []
+
+        def produce(n):
+            for i in range(5000):
+                pump.post_log(f"{n}:{i}")
+            pump.call(lambda: order.append(n))
+
+        threads = [threading.Thread(target=produce, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        collected, calls = [], []
+        while any(t.is_alive() for t in threads):
+            _, lines, pending = pump.drain()
+            collected += lines
+            calls += pending
+        for t in threads:
+            t.join()
+        _, lines, pending = pump.drain()
+        collected += lines
+        for func in calls + pending:
+            func()
+        self.assertEqual(len(collected), 20000)
+        # 同一线程的日志保持顺序
+        self.assertEqual([l for l in collected if l.startswith("2:")], [f"2:{i}" for i in range(5000)])
+        self.assertEqual(sorted(order), [0, 1, 2, 3])
+
+if __name__ == '__main__':
+    unittest.main()
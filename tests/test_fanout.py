@@ -0,0 +1,154 @@
+import unittest
+import errno
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+from core.backup import BackupManager
+from core.fanout import FanoutCopier, TargetLane
+from core.scanner import FileEntry
+
+class TestFanout(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.test_dir, 'src')
+        self.dst_dirs = [os.path.join(self.test_dir, 'usb1'), os.path.join(self.test_dir, 'usb2')]
+        os.makedirs(os.path.join(self.src_dir, 'docs'))
+        self.manager = BackupManager()
+        self.create_file(os.path.join(self.src_dir, 'a.txt'), 'a')
+        self.create_file(os.path.join(self.src_dir, 'docs', 'b.txt'), 'b')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def create_file(self, path, content='content'):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def run_fanout(self):
+        events = list(self.manager.fanout_generator(self.src_dir, self.dst_dirs))
+        actions = sorted((os.path.basename(e['target']), e['action'], e['rel_path'])
+                         for e in events if e.get('type') == 'progress')
+        return actions, events
+
+    def test_compares_each_destination(self):
+        actions, events = self.run_fanout()
+        self.assertEqual([a for _, a, _ in actions], ['copied'] * 4)
+        done = events[-1]
+        self.assertEqual((done['summary']['processed'], done['summary']['total']), (4, 4))
+        for dst_dir in self.dst_dirs:
+            self.assertEqual(done['targets'][dst_dir]['copied'], 2)
+            with open(os.path.join(dst_dir, 'docs', 'b.txt')) as f:
+                self.assertEqual(f.read(), 'b')
+
+        # 只在一个目标中缺失的文件只复制到该目标
+        os.remove(os.path.join(self.dst_dirs[1], 'a.txt'))
+        self.create_file(os.path.join(self.src_dir, 'new.txt'), 'new')
+        with mock.patch('core.fanout.FanoutCopier._read', autospec=True,
+                        side_effect=FanoutCopier._read) as read:
+            actions, events = self.run_fanout()
+        copied = [(t, p) for t, a, p in actions if a == 'copied']
+        self.assertEqual(copied, [('usb1', 'new.txt'), ('usb2', 'a.txt'), ('usb2', 'new.txt')])
+        # 每个需要复制的源文件只读取一次 (新建的清单尚不完整，按目录扫描比对各目标)
+        self.assertEqual(sorted(os.path.basename(c.args[1]) for c in read.call_args_list), ['a.txt', 'new.txt'])
+
+    def test_failing_destination_is_isolated(self):
+        for i in range(5):
+            self.create_file(os.path.join(self.src_dir, f'{i}.txt'), str(i))
+        real_replace = os.replace
+
+        def replace(src, dst):
+            if dst.startswith(self.dst_dirs[1]):
+                raise OSError(errno.ENOSPC, "No space left on device")
+            real_replace(src, dst)
+
+        with mock.patch('core.fanout.os.replace', side_effect=replace):
+            actions, events = self.run_fanout()
+        failed = [e for e in events if e.get('action') == 'target_failed']
+        self.assertEqual([e['target'] for e in failed], [self.dst_dirs[1]])
+        done = events[-1]
+        self.assertFalse(done['stopped'])
+        self.assertEqual(done['targets'][self.dst_dirs[0]]['copied'], 7)
+        self.assertEqual(done['targets'][self.dst_dirs[1]]['copied'], 0)
+        written = [name for path, _, names in os.walk(self.dst_dirs[1]) if '.bakui' not in path for name in names]
+        self.assertEqual(written, [])
+
+    def test_slow_destination_detaches(self):
+        src_path = os.path.join(self.src_dir, 'big.bin')
+        data = os.urandom(64 * 1024)
+        with open(src_path, 'wb') as f:
+            f.write(data)
+        for dst_dir in self.dst_dirs:
+            os.makedirs(dst_dir)
+        release = threading.Event()
+        with FanoutCopier(self.dst_dirs, shutil.copy2, workers=1, chunk_size=4096, buffer_limit=8192,
+                          lag_timeout=0.05) as copier:
+            fast, slow = copier.lanes
+            # 占住慢目标唯一的写入线程
+            slow._pool.submit(release.wait)
+            copier.submit(FileEntry('big.bin', len(data), 0), src_path,
+                          [(lane, os.path.join(lane.dst_dir, 'big.bin')) for lane in copier.lanes])
+            first = next(copier._take(True) for _ in iter(int, 1))
+            self.assertIs(first.lane, fast)
+            self.assertIsNone(first.error)
+            release.set()
+            second = list(copier.drain())[0]
+        self.assertIs(second.lane, slow)
+        self.assertTrue(second.detached)
+        for dst_dir in self.dst_dirs:
+            with open(os.path.join(dst_dir, 'big.bin'), 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+    def test_slow_destination_queue_is_bounded(self):
+        for dst_dir in self.dst_dirs:
+            os.makedirs(dst_dir)
+        release = threading.Event()
+        names = ['a.txt', os.path.join('docs', 'b.txt')]
+        with FanoutCopier(self.dst_dirs, shutil.copy2, workers=1, max_pending=1) as copier:
+            fast, slow = copier.lanes
+            slow._pool.submit(release.wait)
+            early = []
+            try:
+                for name in names:
+                    copier.submit(FileEntry(name, 1, 0), os.path.join(self.src_dir, name),
+                                  [(lane, os.path.join(lane.dst_dir, os.path.basename(name)))
+                                   for lane in copier.lanes])
+                    early.append(copier._take(True))
+            finally:
+                release.set()
+            results = early + list(copier.drain())
+        # 慢目标排队已满，第二个文件不进入其队列，在慢目标写完之前就得到 deferred 结果
+        self.assertEqual([(r.lane, r.tag.rel_path, r.deferred) for r in early],
+                         [(fast, names[0], False), (slow, names[1], True)])
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(r.error is None for r in results))
+        self.assertEqual(sorted(os.listdir(self.dst_dirs[1])), ['a.txt'])
+
+    def test_deferred_files_are_reported(self):
+        real_open_stream = TargetLane.open_stream
+
+        def open_stream(lane, tag, src_path, dst_path, results):
+            # 第二个目标的排队已满
+            if lane.dst_dir == self.dst_dirs[1]:
+                return None
+            return real_open_stream(lane, tag, src_path, dst_path, results)
+
+        with mock.patch('core.fanout.TargetLane.open_stream', autospec=True, side_effect=open_stream):
+            actions, events = self.run_fanout()
+        self.assertEqual([(t, a) for t, a, _ in actions], [('usb1', 'copied')] * 2 + [('usb2', 'deferred')] * 2)
+        done = events[-1]
+        self.assertFalse(done['stopped'])
+        self.assertIn("未完成", done['message'])
+        self.assertEqual(done['summary']['deferred'], 2)
+        self.assertEqual(done['targets'][self.dst_dirs[1]]['deferred'], 2)
+        self.assertEqual(done['targets'][self.dst_dirs[0]]['deferred'], 0)
+
+        # 推迟的文件没有记入清单，下次备份时复制
+        actions, events = self.run_fanout()
+        self.assertEqual([(t, a) for t, a, _ in actions], [('usb1', 'skipped')] * 2 + [('usb2', 'copied')] * 2)
+        self.assertIn("完成", events[-1]['message'])
+        self.assertNotIn("未完成", events[-1]['message'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from core.fanout import FanoutCopier
+from core.fastcopy import (FastCopier, METHOD_COPY_FILE_RANGE, METHOD_PORTABLE, _Unsupported,
+                           _available_methods)
+from core.scanner import FileEntry
+
+class TestFastCopier(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.test_dir, 'src.bin')
+        self.dst = os.path.join(self.test_dir, 'dst.bin')
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+        with open(self.src, 'wb') as f:
+            f.write(self.data)
+        os.utime(self.src, (1000000000, 1000000000))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def assert_copied(self):
+        with open(self.dst, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(int(os.stat(self.dst).st_mtime), 1000000000)
+
+    def test_each_available_method(self):
+        for method in _available_methods():
+            with self.subTest(method=method):
+                copier = FastCopier(methods=[method, METHOD_PORTABLE])
+                used = copier.copy2(self.src, self.dst)
+                self.assertIn(used, (method, METHOD_PORTABLE))
+                self.assert_copied()
+                os.remove(self.dst)
+
+    def test_probe_result_is_cached(self):
+        copier = FastCopier()
+        first = copier.copy2(self.src, self.dst)
+        st = os.stat(self.test_dir)
+        self.assertEqual(copier.method_for(st.st_dev, st.st_dev), first)
+        self.assertEqual(copier.copy2(self.src, self.dst), first)
+        self.assert_copied()
+
+    def test_empty_file(self):
+        open(self.src, 'wb').close()
+        self.data = b''
+        os.utime(self.src, (1000000000, 1000000000))
+        FastCopier().copy2(self.src, self.dst)
+        self.assert_copied()
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), "需要命名管道")
+    def test_fifo_is_rejected_without_blocking(self):
+        fifo = os.path.join(self.test_dir, 'pipe')
+        os.mkfifo(fifo)
+        # 打开命名管道会一直等待写入方，必须在 open 之前拒绝
+        with self.assertRaises(shutil.SpecialFileError):
+            FastCopier().copy2(fifo, self.dst)
+        self.assertFalse(os.path.exists(self.dst))
+
+        with FanoutCopier([self.test_dir], shutil.copy2) as copier:
+            copier.submit(FileEntry('pipe', 0, 0), fifo, [(copier.lanes[0], self.dst)])
+            results = list(copier.drain())
+        self.assertIsInstance(results[0].error, shutil.SpecialFileError)
+        self.assertTrue(results[0].source_error)
+
+    def test_zero_return_before_eof_falls_back(self):
+        with open(self.src, 'rb') as f:
+            with self.assertRaises(_Unsupported):
+                FastCopier._kernel_loop(lambda offset, count: 0, len(self.data), f.fileno())
+            # 源文件在复制过程中缩短: 复制到新的末尾即完成
+            FastCopier._kernel_loop(lambda offset, count: len(self.data) if offset == 0 else 0,
+                                    len(self.data) + 100, f.fileno())
+
+        if not hasattr(os, 'copy_file_range'):
+            return
+        copier = FastCopier(methods=[METHOD_COPY_FILE_RANGE, METHOD_PORTABLE])
+        with mock.patch('os.copy_file_range', return_value=0):
+            self.assertEqual(copier.copy2(self.src, self.dst), METHOD_PORTABLE)
+        self.assert_copied()
+        st = os.stat(self.test_dir)
+        self.assertEqual(copier.method_for(st.st_dev, st.st_dev), METHOD_PORTABLE)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.hashing import HashCache, ParallelHasher, hash_file
+from core.scanner import FileEntry
+
+class TestHashing(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.test_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_cache_requires_matching_stat(self):
+        cache = HashCache(self.test_dir)
+        self.assertTrue(cache.open())
+        entry = FileEntry('a.txt', 10, 100.0, ino=5, ctime=100.0)
+        cache.put(entry, 'abc')
+        cache.close()
+
+        cache = HashCache(self.test_dir)
+        cache.open()
+        self.assertEqual(cache.get(FileEntry('a.txt', 10, 100.0, ino=5, ctime=100.0)), 'abc')
+        # 修改时间被回设但 ctime 变化，缓存失效
+        self.assertIsNone(cache.get(FileEntry('a.txt', 10, 100.0, ino=5, ctime=200.0)))
+        self.assertIsNone(cache.get(FileEntry('a.txt', 10, 100.0, ino=6, ctime=100.0)))
+        cache.close()
+
+    def test_parallel_hasher_returns_all_results(self):
+        paths = [self.write(f"f{i}.bin", os.urandom(1000 + i)) for i in range(20)]
+        with ParallelHasher(workers=2, use_processes=False) as hasher:
+            for i, path in enumerate(paths):
+                hasher.submit(i, path, None)
+            jobs = {job.tag: job for job in hasher.drain()}
+            files, hashed_bytes, rate = hasher.throughput()
+
+        self.assertEqual(len(jobs), 20)
+        self.assertEqual(jobs[3].src_hash, hash_file(paths[3]))
+        self.assertIsNone(jobs[3].dst_hash)
+        self.assertEqual(files, 20)
+        self.assertEqual(hashed_bytes, sum(os.path.getsize(p) for p in paths))
+
+    def test_missing_file_reports_error(self):
+        with ParallelHasher(workers=1, use_processes=False) as hasher:
+            hasher.submit('x', None, os.path.join(self.test_dir, 'missing'), src_hash='known')
+            job = next(iter(hasher.drain()))
+        self.assertEqual(job.src_hash, 'known')
+        self.assertIsNone(job.dst_hash)
+        self.assertIsNotNone(job.dst_error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@ import unittest
 import os
 import json
 import tempfile
-from history_manager import HistoryManager
+from core.history import HistoryManager
 
 class TestHistoryManager(unittest.TestCase):
     def setUp(self):
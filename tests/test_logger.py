@@ -0,0 +1,88 @@
+import unittest
+import json
+import logging
+import os
+import shutil
+import tempfile
+from core.backup import BackupManager
+from unittest import mock
+from core.logger import Logger, CATEGORY_FILE, app_data_dir
+
+class TestLogger(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.test_dir, 'bakui_log.jsonl')
+        self.logger = Logger()
+        self.logger.set_log_file(self.log_path)
+        self.messages = []
+        self.logger.set_gui_callback(self.messages.append)
+
+    def tearDown(self):
+        self.logger.set_gui_callback(None)
+        self.logger.set_log_file(None)
+        self.logger.set_category(CATEGORY_FILE)
+        shutil.rmtree(self.test_dir)
+
+    def read_log(self):
+        self.logger.flush()
+        with open(self.log_path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_log_file_in_app_data_dir(self):
+        with mock.patch('core.logger.sys.platform', 'linux'), \
+                mock.patch.dict(os.environ, {'XDG_DATA_HOME': self.test_dir}):
+            data_dir = app_data_dir()
+        self.assertEqual(data_dir, os.path.join(self.test_dir, 'bakui'))
+        # 数据目录首次使用时创建
+        self.log_path = os.path.join(data_dir, 'bakui_log.jsonl')
+        self.logger.set_log_file(self.log_path)
+        self.logger.info("hello")
+        self.assertEqual([r['message'] for r in self.read_log()], ["hello"])
+
+    def test_backup_run_is_structured(self):
+        src_dir = os.path.join(self.test_dir, 'src')
+        os.makedirs(src_dir)
+        with open(os.path.join(src_dir, 'a.txt'), 'w') as f:
+            f.write('12345')
+        BackupManager().start_backup(src_dir, os.path.join(self.test_dir, 'dst'), None)
+
+        records = self.read_log()
+        copied = [r for r in records if r.get('action') == 'copied']
+        self.assertEqual(len(copied), 1)
+        self.assertEqual((copied[0]['rel_path'], copied[0]['bytes']), ('a.txt', 5))
+        done = records[-1]
+        self.assertEqual((done['category'], done['action']), ('summary', 'done'))
+        self.assertEqual(done['summary']['copied'], 1)
+        self.assertIn('duration', done)
+        # 同一次任务的记录带有相同的 run_id
+        self.assertIsNotNone(done['run_id'])
+        self.assertEqual(copied[0]['run_id'], done['run_id'])
+        # 逐文件的结构化记录不显示在界面中
+        self.assertFalse(any('copied: a.txt' in m for m in self.messages))
+
+    def test_category_sampling_keeps_summaries(self):
+        self.logger.set_category(CATEGORY_FILE, sample=10)
+        self.logger.begin_run()
+        for i in range(100):
+            self.logger.info(f"删除文件: {i}.txt", category=CATEGORY_FILE)
+            self.logger.record('deleted', f"{i}.txt")
+        self.logger.error("删除文件失败 x.txt", category=CATEGORY_FILE)
+        self.logger.end_run()
+
+        records = self.read_log()
+        self.assertEqual(len([r for r in records if r.get('action') == 'deleted']), 10)
+        self.assertEqual(len([m for m in self.messages if m.startswith("[INFO] 删除文件")]), 10)
+        # 错误不参与采样，省略的条数写入摘要
+        self.assertIn("[ERROR] 删除文件失败 x.txt", self.messages)
+        self.assertEqual(records[-1]['category'], 'summary')
+        self.assertIn("180", records[-1]['message'])
+
+    def test_level_suppresses_per_file_lines(self):
+        self.logger.set_category(CATEGORY_FILE, level=logging.WARNING)
+        self.logger.info("移动文件: a -> b", category=CATEGORY_FILE)
+        self.logger.info("备份完成")
+        self.logger.flush()
+        self.assertEqual(self.messages, ["[INFO] 备份完成"])
+
+if __name__ == '__main__':
+    unittest.main()
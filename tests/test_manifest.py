@@ -0,0 +1,58 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.manifest import Manifest
+from core.scanner import FileEntry
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.manifest = Manifest(self.test_dir)
+        self.assertTrue(self.manifest.open())
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_new_manifest_is_stale(self):
+        self.assertIsNotNone(self.manifest.stale_reason())
+
+    def test_rebuild_and_load(self):
+        deep = os.path.join('a', 'b.txt')
+        self.manifest.rebuild([FileEntry(deep, 3, 100.0)], {'a'})
+        self.manifest.close()
+
+        self.manifest = Manifest(self.test_dir)
+        self.manifest.open()
+        self.assertIsNone(self.manifest.stale_reason())
+        files, dirs = self.manifest.load()
+        self.assertEqual(files[deep].size, 3)
+        self.assertEqual(dirs, {'a'})
+
+    def test_unclean_run_is_stale(self):
+        self.manifest.rebuild([], set())
+        self.manifest.begin_run()
+        self.manifest.close(clean=False)
+
+        self.manifest = Manifest(self.test_dir)
+        self.manifest.open()
+        self.assertIsNotNone(self.manifest.stale_reason())
+
+    def test_remove_tree_is_prefix_exact(self):
+        a_file = os.path.join('a', 'x')
+        ab_file = os.path.join('ab', 'y')
+        upper_file = os.path.join('A', 'z')
+        self.manifest.rebuild([FileEntry(p, 1, 1.0) for p in (a_file, ab_file, upper_file)], {'a', 'ab', 'A'})
+        self.manifest.remove_tree('a')
+        files, dirs = self.manifest.load()
+        self.assertEqual(set(files), {ab_file, upper_file})
+        self.assertEqual(dirs, {'ab', 'A'})
+
+    def test_record_dir_adds_parents(self):
+        self.manifest.record_dir(os.path.join('x', 'y', 'z'))
+        self.assertTrue(self.manifest.has_dir('x'))
+        self.assertTrue(self.manifest.has_dir(os.path.join('x', 'y')))
+
+if __name__ == '__main__':
+    unittest.main()
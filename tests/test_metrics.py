@@ -0,0 +1,130 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import threading
+from core.backup import BackupManager, BackupStats
+from core.metrics import RunMetrics, PHASE_COPY, PHASE_SCAN_SOURCE
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class TestRunMetrics(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.metrics = RunMetrics(clock=self.clock)
+        self.stats = BackupStats()
+
+    def test_rates_and_eta(self):
+        mb = 1024 * 1024
+        self.stats.total, self.stats.total_bytes, self.stats.scan_done = 3, 100 * mb, True
+        self.clock.now += 10
+        self.metrics.file_done(self.stats, 'copied', 40 * mb)
+        self.clock.now += 10
+        self.metrics.file_done(self.stats, 'skipped', 10 * mb)
+        snap = self.metrics.snapshot()
+        self.assertEqual(snap['bytes_transferred'], 40 * mb)
+        self.assertEqual(snap['byte_percent'], 50.0)
+        self.assertAlmostEqual(snap['bytes_per_sec_avg'], 2 * mb)
+        # 最近 1 秒内没有写入
+        self.assertEqual(snap['bytes_per_sec'], 0)
+        # 已处理 50 MB / 20 s，剩余 50 MB
+        self.assertAlmostEqual(snap['eta'], 20.0)
+        self.assertEqual(snap['actions'], {'copied': 1, 'skipped': 1})
+        self.assertAlmostEqual(snap['files_per_sec'], 0.1)
+
+    def test_phases(self):
+        self.metrics.begin(PHASE_SCAN_SOURCE)
+        self.clock.now += 1
+        self.metrics.file_done(self.stats, 'copied', 10)
+        self.clock.now += 2
+        self.metrics.file_done(self.stats, 'copied', 10)
+        self.clock.now += 3
+        with self.metrics.phase('diff'):
+            self.clock.now += 0.5
+        self.metrics.finish()
+        phases = self.metrics.phases()
+        self.assertEqual(phases[PHASE_COPY], 2)
+        self.assertEqual(phases['diff'], 0.5)
+        # 未结束的扫描阶段记到任务结束
+        self.assertEqual(phases[PHASE_SCAN_SOURCE], 6.5)
+        self.assertIsNone(self.metrics.snapshot()['eta'])
+
+    def test_snapshot_while_phases_start(self):
+        metrics = RunMetrics()
+        errors = []
+
+        def read():
+            try:
+                while not done.is_set():
+                    metrics.snapshot()
+            except RuntimeError as e:
+                errors.append(e)
+
+        done = threading.Event()
+        reader = threading.Thread(target=read)
+        reader.start()
+        # 备份线程不断开始新的阶段，界面线程同时读取
+        for i in range(20000):
+            metrics.begin(f'phase-{i}')
+            metrics.add_phase(f'timed-{i}', 0.0)
+        done.set()
+        reader.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(metrics.phases()), 40000)
+
+    def test_prometheus_text(self):
+        self.metrics.file_done(self.stats, 'copied', 123)
+        self.metrics.file_failed(self.stats, 'copy_failed')
+        self.clock.now += 2
+        self.metrics.finish()
+        text = self.metrics.prometheus_text({'dst': 'E:\\backup'})
+        self.assertIn('bakui_backup_bytes_transferred{dst="E:\\\\backup"} 123\n', text)
+        self.assertIn('bakui_backup_actions{dst="E:\\\\backup",action="copied"} 1\n', text)
+        self.assertIn('bakui_backup_last_run_success{dst="E:\\\\backup"} 0\n', text)
+        self.assertIn('# TYPE bakui_backup_phase_seconds gauge\n', text)
+
+class TestBackupMetrics(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.test_dir, 'src')
+        os.makedirs(self.src_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_progress_is_byte_weighted(self):
+        stats = BackupStats()
+        stats.total, stats.total_bytes, stats.scan_done = 1001, 40 * 1024 ** 3, True
+        # 1000 个小文件已完成，大文件尚未完成
+        stats.processed, stats.processed_bytes = 1000, 1000 * 1024
+        self.assertLess(stats.percent(), 1)
+        stats.processed, stats.processed_bytes = 1001, stats.total_bytes + 1000 * 1024
+        self.assertEqual(stats.percent(), 100)
+
+    def test_run_report_and_textfile(self):
+        for i in range(3):
+            with open(os.path.join(self.src_dir, f'{i}.txt'), 'w') as f:
+                f.write('x' * 100)
+        manager = BackupManager()
+        manager.metrics_textfile = os.path.join(self.test_dir, 'bakui.prom')
+        manager.metrics_report = os.path.join(self.test_dir, 'report.json')
+        manager.start_backup(self.src_dir, os.path.join(self.test_dir, 'dst'), None)
+
+        with open(manager.metrics_report) as f:
+            report = json.load(f)
+        self.assertEqual(report['actions'], {'copied': 3})
+        self.assertEqual(report['bytes_transferred'], 300)
+        self.assertFalse(report['stopped'])
+        self.assertIn(PHASE_SCAN_SOURCE, report['phases'])
+        self.assertIn(PHASE_COPY, report['phases'])
+        with open(manager.metrics_textfile) as f:
+            self.assertIn('bakui_backup_files 3\n', f.read())
+
+if __name__ == '__main__':
+    unittest.main()
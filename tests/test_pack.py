@@ -0,0 +1,94 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from core.backup import BackupManager
+from core.pack import PackStore
+from core.scanner import FileEntry
+
+class TestPackStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.test_dir, 'src')
+        self.dst_dir = os.path.join(self.test_dir, 'dst')
+        os.makedirs(os.path.join(self.src_dir, 'node_modules', 'pkg'))
+        self.manager = BackupManager()
+        for i in range(20):
+            self.create_file(os.path.join(self.src_dir, 'node_modules', 'pkg', f'{i}.js'), f'module {i}')
+        self.create_file(os.path.join(self.src_dir, 'big.bin'), 'x' * 200)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def create_file(self, path, content='content'):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def run_packed(self):
+        events = list(self.manager.packed_generator(self.src_dir, self.dst_dir, pack_threshold=100))
+        actions = [e['action'] for e in events if e.get('type') == 'progress']
+        return actions, events[-1]
+
+    def open_pack(self):
+        pack = PackStore(self.dst_dir)
+        self.assertTrue(pack.open())
+        self.addCleanup(pack.close)
+        return pack
+
+    def test_small_files_packed_large_files_plain(self):
+        actions, done = self.run_packed()
+        self.assertEqual(actions.count('packed'), 20)
+        self.assertEqual(actions.count('copied'), 1)
+        self.assertTrue(os.path.isfile(os.path.join(self.dst_dir, 'big.bin')))
+        self.assertFalse(os.path.exists(os.path.join(self.dst_dir, 'node_modules')))
+
+        rel_path = os.path.join('node_modules', 'pkg', '7.js')
+        pack = self.open_pack()
+        self.assertEqual(pack.read(rel_path), b'module 7')
+        out_path = os.path.join(self.test_dir, 'out', '7.js')
+        pack.extract(rel_path, out_path)
+        with open(out_path) as f:
+            self.assertEqual(f.read(), 'module 7')
+        self.assertEqual(os.path.getmtime(out_path),
+                         os.path.getmtime(os.path.join(self.src_dir, rel_path)))
+
+    def test_incremental_update(self):
+        self.run_packed()
+        time.sleep(1.1)
+        rel_path = os.path.join('node_modules', 'pkg', '3.js')
+        self.create_file(os.path.join(self.src_dir, rel_path), 'module 3 v2')
+        # 文件变小到阈值以下，改为打包保存
+        self.create_file(os.path.join(self.src_dir, 'big.bin'), 'small now')
+        actions, done = self.run_packed()
+        self.assertEqual(actions.count('packed'), 2)
+        self.assertEqual(actions.count('skipped'), 19)
+        self.assertFalse(os.path.exists(os.path.join(self.dst_dir, 'big.bin')))
+        pack = self.open_pack()
+        self.assertEqual(pack.read(rel_path), b'module 3 v2')
+        self.assertEqual(pack.read('big.bin'), b'small now')
+
+    def test_compact_reclaims_dead_segments(self):
+        pack = self.open_pack()
+        pack.segment_size = 64
+        for i in range(8):
+            pack.add(FileEntry(f'{i}.txt', 16, 1000.0, mode=0o644), bytes([i]) * 16)
+        # 覆盖前 4 个文件，第一个段 (4 个记录) 全部失效
+        for i in range(4):
+            pack.add(FileEntry(f'{i}.txt', 16, 2000.0, mode=0o644), bytes([i + 100]) * 16)
+        pack.remove('4.txt')
+        pack.commit()
+        # 第二个段只有 1/4 失效，不回收
+        compacted, freed = pack.compact()
+        self.assertEqual((compacted, freed), (1, 64))
+        self.assertFalse(os.path.exists(pack.segment_path(1)))
+        self.assertTrue(os.path.exists(pack.segment_path(2)))
+        self.assertIsNone(pack.get('4.txt'))
+        self.assertEqual(len(pack), 7)
+        for i in range(4):
+            self.assertEqual(pack.read(f'{i}.txt'), bytes([i + 100]) * 16)
+        for i in range(5, 8):
+            self.assertEqual(pack.read(f'{i}.txt'), bytes([i]) * 16)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.backup import BackupManager
+from core.plan import BackupPlan
+
+class TestBackupPlan(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.test_dir, 'src')
+        self.dst_dir = os.path.join(self.test_dir, 'dst')
+        os.makedirs(os.path.join(self.src_dir, 'docs'))
+        os.makedirs(self.dst_dir)
+        self.manager = BackupManager()
+
+        self.create_file(os.path.join(self.src_dir, 'keep.txt'), 'keep')
+        self.create_file(os.path.join(self.src_dir, 'change.txt'), 'old')
+        self.create_file(os.path.join(self.src_dir, 'docs', 'big.bin'), 'x' * 100000)
+        self.create_file(os.path.join(self.src_dir, 'gone.txt'), 'gone')
+        for _ in self.manager.backup_generator(self.src_dir, self.dst_dir, sync_mode=True): pass
+
+        # 修改、新增、删除、移动
+        self.create_file(os.path.join(self.src_dir, 'change.txt'), 'new content')
+        self.create_file(os.path.join(self.src_dir, 'new.txt'), 'new')
+        os.remove(os.path.join(self.src_dir, 'gone.txt'))
+        os.makedirs(os.path.join(self.src_dir, 'archive'))
+        os.rename(os.path.join(self.src_dir, 'docs', 'big.bin'), os.path.join(self.src_dir, 'archive', 'big.bin'))
+        shutil.rmtree(os.path.join(self.src_dir, 'docs'))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def create_file(self, path, content='content'):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def snapshot(self, root):
+        result = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                result[os.path.relpath(path, root)] = os.stat(path).st_mtime
+        return result
+
+    def test_plan_does_not_touch_destination(self):
+        before = self.snapshot(self.dst_dir)
+        plan = self.manager.plan_backup(self.src_dir, self.dst_dir, sync_mode=True)
+        self.assertEqual(self.snapshot(self.dst_dir), before)
+
+        actions = {(item.action, item.rel_path) for item in plan.items}
+        self.assertIn(('update', 'change.txt'), actions)
+        self.assertIn(('copy', 'new.txt'), actions)
+        self.assertIn(('delete', 'gone.txt'), actions)
+        self.assertIn(('move', os.path.join('archive', 'big.bin')), actions)
+        self.assertIn(('create_dir', 'archive'), actions)
+        self.assertIn(('delete_dir', 'docs'), actions)
+        self.assertEqual(plan.unchanged, 1)
+        self.assertEqual(plan.totals()['transfer_bytes'], len('new content') + len('new'))
+
+    def test_saved_plan_executes_as_is(self):
+        plan = self.manager.plan_backup(self.src_dir, self.dst_dir, sync_mode=True)
+        path = os.path.join(self.test_dir, 'plan.json')
+        plan.save(path)
+        loaded = BackupPlan.load(path)
+        self.assertEqual(loaded.to_dict(), plan.to_dict())
+
+        events = list(self.manager.plan_generator(loaded))
+        self.assertIn('moved', [e.get('action') for e in events])
+        self.assertEqual(set(self.snapshot(self.dst_dir)) - {os.path.join('.bakui', 'manifest.db')},
+                         set(self.snapshot(self.src_dir)))
+        with open(os.path.join(self.dst_dir, 'change.txt')) as f:
+            self.assertEqual(f.read(), 'new content')
+
+    def test_plan_paths_must_stay_inside_destination(self):
+        data = self.manager.plan_backup(self.src_dir, self.dst_dir, sync_mode=True).to_dict()
+        for path in ('/etc/passwd', '..', '../outside.txt', 'docs/../../outside.txt', 'C:/Windows/x.dll',
+                     'C:x.dll', '\\\\server\\share\\x', 'docs\\..\\..\\x'):
+            for key in ('path', 'from'):
+                item = {'action': 'move', 'path': 'a.txt', 'from': 'b.txt', 'size': 1, 'mtime': 0, key: path}
+                with self.assertRaises(ValueError, msg=path):
+                    BackupPlan.from_dict(dict(data, items=[item]))
+        item = {'action': 'copy', 'path': 'ab:c/..x.txt', 'size': 1, 'mtime': 0}
+        self.assertEqual(BackupPlan.from_dict(dict(data, items=[item])).items[0].rel_path, os.path.join('ab:c', '..x.txt'))
+
+    def test_execution_keeps_paths_recreated_after_planning(self):
+        plan = self.manager.plan_backup(self.src_dir, self.dst_dir, sync_mode=True)
+        self.create_file(os.path.join(self.src_dir, 'gone.txt'), 'back again')
+
+        events = list(self.manager.plan_generator(plan))
+        self.assertIn('delete_skipped', [e.get('action') for e in events])
+        self.assertTrue(os.path.exists(os.path.join(self.dst_dir, 'gone.txt')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import threading
+from core.backup import BackupManager, BackupStats
+from core.metrics import RunMetrics, PHASE_COPY, PHASE_SCAN_SOURCE
+from core.profiler import Profiler, SAMPLER_CPROFILE, SAMPLER_STACK
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.profiler = Profiler(top_n=2, clock=self.clock)
+
+    def test_operations_and_slowest(self):
+        for rel_path, seconds in (('a.txt', 1), ('b.bin', 5), ('c.txt', 2)):
+            with self.profiler.operation(rel_path, size=10):
+                self.clock.now += seconds
+        with self.assertRaises(OSError):
+            with self.profiler.operation('d.txt', cat='delete'):
+                self.clock.now += 0.5
+                raise OSError("busy")
+
+        slowest = self.profiler.slowest()
+        self.assertEqual([r['path'] for r in slowest], ['b.bin', 'c.txt'])
+        self.assertEqual(slowest[0]['duration'], 5)
+        self.assertEqual(self.profiler.file_count, 4)
+        events = [e for e in self.profiler.trace()['traceEvents'] if e['ph'] == 'X']
+        self.assertEqual(events[1]['ts'], 1e6)
+        self.assertEqual(events[1]['dur'], 5e6)
+        self.assertEqual(events[3]['args']['error'], "OSError: busy")
+
+    def test_phases_from_metrics(self):
+        metrics = RunMetrics(clock=self.clock, tracer=self.profiler)
+        stats = BackupStats()
+        metrics.begin(PHASE_SCAN_SOURCE)
+        self.clock.now += 1
+        metrics.file_done(stats, 'copied', 10)
+        self.clock.now += 2
+        metrics.end(PHASE_SCAN_SOURCE)
+        metrics.file_done(stats, 'copied', 10)
+        self.clock.now += 1
+        metrics.finish()
+
+        trace = self.profiler.trace()['traceEvents']
+        phases = {e['name']: e for e in trace if e['ph'] == 'X'}
+        self.assertEqual((phases[PHASE_SCAN_SOURCE]['ts'], phases[PHASE_SCAN_SOURCE]['dur']), (0, 3e6))
+        # 复制阶段: 第一次到最后一次复制
+        self.assertEqual((phases[PHASE_COPY]['ts'], phases[PHASE_COPY]['dur']), (1e6, 2e6))
+        self.assertNotEqual(phases[PHASE_SCAN_SOURCE]['tid'], phases[PHASE_COPY]['tid'])
+        names = {e['args']['name'] for e in trace if e['name'] == 'thread_name'}
+        self.assertIn(f"阶段 {PHASE_COPY}", names)
+
+    def test_trace_while_recording(self):
+        profiler = Profiler()
+        # 线程同时存活，线程 id 不会被复用
+        done = threading.Barrier(4)
+
+        def record(worker):
+            for i in range(2000):
+                with profiler.operation(f'{worker}/{i}.txt'):
+                    pass
+                profiler.add_phase(f'phase-{worker}-{i % 50}', 0, 0, 0)
+            done.wait()
+
+        threads = [threading.Thread(target=record, args=(w,), name=f'rec_{w}') for w in range(4)]
+        for t in threads:
+            t.start()
+        # 记录线程和阶段的同时生成 trace，不会遇到遍历中被修改的字典
+        while any(t.is_alive() for t in threads):
+            profiler.trace()
+        for t in threads:
+            t.join()
+        names = {e['args']['name'] for e in profiler.trace()['traceEvents'] if e['name'] == 'thread_name'}
+        self.assertTrue({f'rec_{w}' for w in range(4)} <= names)
+        tids = [e['tid'] for e in profiler.trace()['traceEvents'] if e['name'] == 'thread_sort_index']
+        self.assertEqual(len(tids), len(set(tids)))
+
+class TestBackupProfiling(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.test_dir, 'src')
+        self.dst_dir = os.path.join(self.test_dir, 'dst')
+        self.profile_dir = os.path.join(self.test_dir, 'profile')
+        os.makedirs(os.path.join(self.src_dir, 'sub'))
+        for i in range(3):
+            with open(os.path.join(self.src_dir, 'sub', f'{i}.txt'), 'w') as f:
+                f.write('x' * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _outputs(self, suffix):
+        return sorted(name for name in os.listdir(self.profile_dir) if name.endswith(suffix))
+
+    def test_backup_writes_trace_and_report(self):
+        manager = BackupManager()
+        manager.profile_dir = self.profile_dir
+        manager.profile_sampler = SAMPLER_CPROFILE
+        manager.start_backup(self.src_dir, self.dst_dir, None, sync_mode=True)
+
+        with open(os.path.join(self.profile_dir, self._outputs('.trace.json')[0]), encoding='utf-8') as f:
+            events = json.load(f)['traceEvents']
+        copies = sorted(e['name'] for e in events if e.get('cat') == 'copy')
+        self.assertEqual(copies, [os.path.join('sub', f'{i}.txt') for i in range(3)])
+        phases = {e['name'] for e in events if e.get('cat') == 'phase'}
+        self.assertTrue({PHASE_SCAN_SOURCE, PHASE_COPY} <= phases)
+        self.assertEqual(len(self._outputs('.slowest.txt')), 1)
+        self.assertEqual(len(self._outputs('.prof')), 1)
+
+        # 删除操作也记录为 span；关闭后不再写入
+        shutil.rmtree(self.profile_dir)
+        shutil.rmtree(os.path.join(self.src_dir, 'sub'))
+        manager.profile_sampler = SAMPLER_STACK
+        manager.start_backup(self.src_dir, self.dst_dir, None, sync_mode=True)
+        self.assertEqual(len(self._outputs('.folded')), 1)
+        with open(os.path.join(self.profile_dir, self._outputs('.trace.json')[0]), encoding='utf-8') as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual([e['name'] for e in events if e.get('cat') == 'delete'], ['sub'])
+
+        manager.profile_dir = None
+        manager.start_backup(self.src_dir, self.dst_dir, None, sync_mode=True)
+        self.assertIsNone(manager.profiler)
+        self.assertEqual(len(self._outputs('.trace.json')), 1)
+
+if __name__ == '__main__':
+    unittest.main()
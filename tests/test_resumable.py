@@ -0,0 +1,63 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.copier import CopyStopped
+from core.resumable import ResumableCopier
+
+CHUNK = 64 * 1024
+
+class TestResumableCopier(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.test_dir, 'big.img')
+        self.dst_root = os.path.join(self.test_dir, 'dst')
+        os.makedirs(self.dst_root)
+        self.dst = os.path.join(self.dst_root, 'big.img')
+        self.data = os.urandom(CHUNK * 10 + 123)
+        with open(self.src, 'wb') as f:
+            f.write(self.data)
+        self.copier = ResumableCopier(self.dst_root, chunk_size=CHUNK, journal_interval=CHUNK)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def stop_after(self, chunks):
+        calls = []
+
+        def check():
+            calls.append(1)
+            return len(calls) > chunks
+        return check
+
+    def test_full_copy(self):
+        written = self.copier.copy(self.src, self.dst, 'big.img')
+        self.assertEqual(written, len(self.data))
+        with open(self.dst, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.listdir(self.copier.partial_dir), [])
+
+    def test_resume_after_stop(self):
+        with self.assertRaises(CopyStopped):
+            self.copier.copy(self.src, self.dst, 'big.img', stop_check=self.stop_after(4))
+        self.assertFalse(os.path.exists(self.dst))
+
+        written = self.copier.copy(self.src, self.dst, 'big.img')
+        self.assertEqual(written, len(self.data) - CHUNK * 4)
+        with open(self.dst, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_restart_when_source_changed(self):
+        with self.assertRaises(CopyStopped):
+            self.copier.copy(self.src, self.dst, 'big.img', stop_check=self.stop_after(4))
+        self.data = os.urandom(CHUNK * 6)
+        with open(self.src, 'wb') as f:
+            f.write(self.data)
+
+        written = self.copier.copy(self.src, self.dst, 'big.img')
+        self.assertEqual(written, len(self.data))
+        with open(self.dst, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+if __name__ == '__main__':
+    unittest.main()
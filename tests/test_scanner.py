@@ -0,0 +1,61 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.scanner import scan_tree, scan_dir, DirectoryLookup
+
+class TestScanner(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.test_dir, 'a', 'b'))
+        os.makedirs(os.path.join(self.test_dir, 'empty'))
+        with open(os.path.join(self.test_dir, 'root.txt'), 'w') as f:
+            f.write('12345')
+        with open(os.path.join(self.test_dir, 'a', 'b', 'deep.txt'), 'w') as f:
+            f.write('x')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_scan_tree(self):
+        files, dirs = scan_tree(self.test_dir)
+        deep = os.path.join('a', 'b', 'deep.txt')
+        self.assertEqual(set(files), {'root.txt', deep})
+        self.assertEqual(dirs, {'a', os.path.join('a', 'b'), 'empty'})
+        self.assertEqual(files['root.txt'].size, 5)
+        self.assertEqual(files[deep].rel_path, deep)
+
+    def test_scan_tree_exclude(self):
+        files, dirs = scan_tree(self.test_dir, exclude=('a',))
+        self.assertEqual(set(files), {'root.txt'})
+        self.assertEqual(dirs, {'empty'})
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), "需要命名管道")
+    def test_special_files_are_skipped(self):
+        os.mkfifo(os.path.join(self.test_dir, 'a', 'pipe'))
+        errors = []
+        files, subdirs = scan_dir(os.path.join(self.test_dir, 'a'), 'a', lambda path, e: errors.append(path))
+        self.assertEqual((files, subdirs, errors), ({}, ['b'], []))
+
+    def test_scan_missing_dir(self):
+        self.assertEqual(scan_dir(os.path.join(self.test_dir, 'missing')), (None, None))
+
+    def test_directory_lookup(self):
+        lookup = DirectoryLookup(self.test_dir)
+        self.assertEqual(lookup.get('root.txt').size, 5)
+        self.assertIsNone(lookup.get(os.path.join('missing', 'x.txt')))
+        self.assertFalse(lookup.dir_exists('missing'))
+        self.assertTrue(lookup.dir_exists('empty'))
+
+    def test_mark_created_keeps_listing(self):
+        lookup = DirectoryLookup(self.test_dir)
+        self.assertTrue(lookup.dir_exists(''))
+        # 对已存在的目录调用 mark_created 不应清空缓存的列表
+        lookup.mark_created('')
+        self.assertEqual(lookup.get('root.txt').size, 5)
+        lookup.mark_created('new')
+        self.assertTrue(lookup.dir_exists('new'))
+        self.assertIsNone(lookup.get(os.path.join('new', 'x.txt')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from core.backup import BackupManager
+from core.snapshot import SnapshotStore, expired_snapshots
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.test_dir, 'src')
+        self.dst_dir = os.path.join(self.test_dir, 'dst')
+        os.makedirs(os.path.join(self.src_dir, 'docs'))
+        self.manager = BackupManager()
+        self.store = SnapshotStore(self.dst_dir)
+        self.create_file(os.path.join(self.src_dir, 'a.txt'), 'a1')
+        self.create_file(os.path.join(self.src_dir, 'docs', 'b.txt'), 'b1')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def create_file(self, path, content='content'):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def run_snapshot(self, **kwargs):
+        events = list(self.manager.snapshot_generator(self.src_dir, self.dst_dir, **kwargs))
+        actions = sorted((e['action'], e['rel_path']) for e in events if e.get('type') == 'progress')
+        return actions, events[-1]
+
+    def read(self, *parts):
+        with open(os.path.join(self.dst_dir, *parts)) as f:
+            return f.read()
+
+    def test_unchanged_files_are_hardlinked(self):
+        actions, done = self.run_snapshot()
+        self.assertEqual([a for a, _ in actions], ['copied', 'copied'])
+        first = self.store.latest()
+
+        time.sleep(1.1)
+        self.create_file(os.path.join(self.src_dir, 'a.txt'), 'a2 changed')
+        actions, done = self.run_snapshot()
+        self.assertEqual(actions, [('copied', 'a.txt'), ('linked', os.path.join('docs', 'b.txt'))])
+        second = self.store.latest()
+        self.assertNotEqual(first, second)
+
+        # 旧快照保持原样，未变化的文件共享同一个 inode
+        self.assertEqual(self.read(first, 'a.txt'), 'a1')
+        self.assertEqual(self.read(second, 'a.txt'), 'a2 changed')
+        self.assertEqual(os.stat(os.path.join(self.dst_dir, first, 'docs', 'b.txt')).st_ino,
+                         os.stat(os.path.join(self.dst_dir, second, 'docs', 'b.txt')).st_ino)
+        self.assertEqual(done['summary']['linked'], 1)
+
+    def test_resume_does_not_write_through_links(self):
+        self.run_snapshot()
+        first = self.store.latest()
+        # 模拟中断: 未完成快照中的文件是指向上一个快照的硬链接，但源文件已经变化
+        partial = os.path.join(self.dst_dir, '2000-01-01_000000.partial')
+        os.makedirs(partial)
+        os.link(os.path.join(self.dst_dir, first, 'a.txt'), os.path.join(partial, 'a.txt'))
+        time.sleep(1.1)
+        self.create_file(os.path.join(self.src_dir, 'a.txt'), 'a2 changed')
+
+        actions, done = self.run_snapshot()
+        self.assertIn(('copied', 'a.txt'), actions)
+        self.assertEqual(self.read(first, 'a.txt'), 'a1')
+        self.assertEqual(self.read(self.store.latest(), 'a.txt'), 'a2 changed')
+        self.assertEqual(self.store.partials(), [])
+
+    def test_retention_prunes_old_snapshots(self):
+        for _ in range(3):
+            self.run_snapshot()
+        self.assertEqual(len(self.store.snapshots()), 3)
+        actions, done = self.run_snapshot(keep_last=1, keep_daily=1, keep_weekly=0)
+        self.assertEqual([a for a, _ in actions].count('pruned'), 3)
+        self.assertEqual(len(self.store.snapshots()), 1)
+        self.assertEqual(self.read(self.store.latest(), 'docs', 'b.txt'), 'b1')
+
+    def test_expired_snapshots_policy(self):
+        names = ['2026-09-01_100000', '2026-09-01_120000', '2026-09-20_100000',
+                 '2026-10-10_100000', '2026-10-17_080000', '2026-10-18_090000', '2026-10-18_090000_2']
+        expired = expired_snapshots(names, keep_daily=2, keep_weekly=3, keep_last=1)
+        # 每天/每周保留最新的一个: 10-18 和 10-17 (按天)，以及 10-10 和 09-20 (按周)
+        self.assertEqual(expired, ['2026-09-01_100000', '2026-09-01_120000', '2026-10-18_090000'])
+
+if __name__ == '__main__':
+    unittest.main()
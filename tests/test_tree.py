@@ -0,0 +1,55 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.scanner import scan_tree
+from core.tree import FileTree
+
+class TestFileTree(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.test_dir, 'a', 'b'))
+        os.makedirs(os.path.join(self.test_dir, 'empty'))
+        for rel_path, data in (('root.txt', '12345'), (os.path.join('a', 'x.txt'), 'xx'),
+                               (os.path.join('a', 'b', 'deep.txt'), 'x')):
+            with open(os.path.join(self.test_dir, rel_path), 'w') as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_scan_matches_scan_tree(self):
+        tree = FileTree.scan(self.test_dir)
+        files, dirs = scan_tree(self.test_dir)
+        self.assertEqual(len(tree), len(files))
+        self.assertEqual(set(tree.iter_dirs()), dirs)
+        for entry in tree.iter_files():
+            expected = files[entry.rel_path]
+            self.assertEqual((entry.size, entry.mtime, entry.ino), (expected.size, expected.mtime, expected.ino))
+        self.assertEqual(tree.get('root.txt').size, 5)
+        self.assertIsNone(tree.get(os.path.join('missing', 'x.txt')))
+        self.assertTrue(tree.has_dir('empty'))
+        self.assertFalse(tree.has_dir('missing'))
+
+    def test_unmarked_paths(self):
+        tree = FileTree.scan(self.test_dir)
+        tree.mark('root.txt')
+        tree.mark_dir(os.path.join('a', 'b'))
+        tree.mark(os.path.join('a', 'b', 'deep.txt'))
+
+        self.assertEqual([e.rel_path for e in tree.unmarked_files()], [os.path.join('a', 'x.txt')])
+        self.assertEqual(list(tree.unmarked_dirs()), ['empty'])
+
+    def test_names_are_shared(self):
+        tree = FileTree()
+        tree.add_file(os.path.join('p1', 'index.js'), 1, 1.0)
+        tree.add_file(os.path.join('p2', 'index.js'), 2, 2.0)
+        tree.add_file(os.path.join('p1', 'a.js'), 3, 3.0)
+        p1, p2 = tree.root.children['p1'], tree.root.children['p2']
+        self.assertIs(p1.names[p1.index('index.js')], p2.names[p2.index('index.js')])
+        # 追加顺序与名称顺序不同时仍可查找
+        self.assertEqual(tree.get(os.path.join('p1', 'a.js')).size, 3)
+        self.assertEqual(tree.get(os.path.join('p1', 'index.js')).size, 1)
+
+if __name__ == '__main__':
+    unittest.main()
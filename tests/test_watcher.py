@@ -0,0 +1,122 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+from core.backup import BackupManager
+from core.watcher import InotifyWatcher, PollingWatcher, DirtySet
+
+def wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+class TestWatchers(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def collect(self, watcher, expected):
+        paths = set()
+        wait_for(lambda: paths.update(watcher.changes(0.1)[0]) or expected <= paths)
+        return paths
+
+    def test_inotify_reports_new_subtree(self):
+        try:
+            watcher = InotifyWatcher(self.test_dir)
+        except OSError as e:
+            self.skipTest(f"inotify 不可用: {e}")
+        try:
+            os.makedirs(os.path.join(self.test_dir, 'a', 'b'))
+            with open(os.path.join(self.test_dir, 'a', 'b', 'f.txt'), 'w') as f:
+                f.write('x')
+            expected = {'a', os.path.join('a', 'b'), os.path.join('a', 'b', 'f.txt')}
+            self.assertLessEqual(expected, self.collect(watcher, expected))
+            # 新目录已加入监视
+            with open(os.path.join(self.test_dir, 'a', 'b', 'g.txt'), 'w') as f:
+                f.write('y')
+            self.assertIn(os.path.join('a', 'b', 'g.txt'),
+                          self.collect(watcher, {os.path.join('a', 'b', 'g.txt')}))
+        finally:
+            watcher.close()
+
+    def test_polling_reports_changes(self):
+        path = os.path.join(self.test_dir, 'old.txt')
+        with open(path, 'w') as f:
+            f.write('x')
+        watcher = PollingWatcher(self.test_dir, interval=0.1)
+        os.remove(path)
+        with open(os.path.join(self.test_dir, 'new.txt'), 'w') as f:
+            f.write('y')
+        self.assertEqual(self.collect(watcher, {'old.txt', 'new.txt'}), {'old.txt', 'new.txt'})
+
+    def test_dirty_set_debounce(self):
+        dirty = DirtySet(debounce=0.2, max_delay=10)
+        self.assertFalse(dirty.ready())
+        dirty.add({os.path.join('a', 'b'), 'a'})
+        self.assertFalse(dirty.ready())
+        time.sleep(0.25)
+        self.assertTrue(dirty.ready())
+        self.assertEqual(dirty.take(), ['a', os.path.join('a', 'b')])
+        self.assertEqual(len(dirty), 0)
+
+class TestWatchMode(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.test_dir, 'src')
+        self.dst_dir = os.path.join(self.test_dir, 'dst')
+        os.makedirs(os.path.join(self.src_dir, 'docs'))
+        os.makedirs(self.dst_dir)
+        with open(os.path.join(self.src_dir, 'docs', 'old.txt'), 'w') as f:
+            f.write('old')
+        self.manager = BackupManager()
+
+    def tearDown(self):
+        self.manager.stop()
+        shutil.rmtree(self.test_dir)
+
+    def run_watch(self, **kwargs):
+        events = []
+
+        def consume():
+            for event in self.manager.watch_generator(self.src_dir, self.dst_dir, debounce=0.1, **kwargs):
+                events.append(event)
+
+        thread = threading.Thread(target=consume, daemon=True)
+        thread.start()
+        self.assertTrue(wait_for(lambda: any('正在监视变化' in e.get('message', '') for e in events)))
+        return thread, events
+
+    def check_changes_are_backed_up(self, **kwargs):
+        thread, events = self.run_watch(sync_mode=True, **kwargs)
+        self.assertTrue(os.path.exists(os.path.join(self.dst_dir, 'docs', 'old.txt')))
+
+        os.makedirs(os.path.join(self.src_dir, 'new', 'deep'))
+        with open(os.path.join(self.src_dir, 'new', 'deep', 'a.txt'), 'w') as f:
+            f.write('new file')
+        os.remove(os.path.join(self.src_dir, 'docs', 'old.txt'))
+        self.assertTrue(wait_for(lambda: os.path.exists(os.path.join(self.dst_dir, 'new', 'deep', 'a.txt'))
+                                 and not os.path.exists(os.path.join(self.dst_dir, 'docs', 'old.txt'))))
+
+        self.manager.stop()
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(events[-1]['type'], 'done')
+        self.assertTrue(events[-1]['stopped'])
+        with open(os.path.join(self.dst_dir, 'new', 'deep', 'a.txt')) as f:
+            self.assertEqual(f.read(), 'new file')
+
+    def test_watch_inotify(self):
+        self.check_changes_are_backed_up()
+
+    def test_watch_polling(self):
+        self.check_changes_are_backed_up(use_inotify=False, poll_interval=0.2)
+
+if __name__ == '__main__':
+    unittest.main()